@@ -0,0 +1,222 @@
+"""
+Throughput benchmarks for top1 joins and prejoin stats on seeded synthetic data. Records wall time, pairs scored per second and peak memory for each benchmark and size so results can be compared across commits.
+
+Usage:
+    python benchmarks/bench.py --sizes 1e3 1e4 1e5 --out results.csv
+    python benchmarks/bench.py --only str_block num_noblock --sizes 1e6 --compare results.csv
+
+"""
+import argparse
+import inspect
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import jellyfish
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import d6tjoin.top1
+import d6tjoin.utils
+import d6tjoin.smart_join
+from benchmarks import datagen
+
+
+# ******************************************
+# pairs
+# ******************************************
+
+def _gen(fun, n, **kwargs):
+    # generators ignore options they don't have, eg typo_rate for numbers
+    params = inspect.signature(fun).parameters
+    return fun(n, **dict((k, v) for k, v in kwargs.items() if k in params))
+
+
+def _pairs_allpairs(df1, df2, by=None):
+    # candidate pairs of unique keys an all-pairs top1 join would score
+    cols = (by or [])+['key']
+    keys1, keys2 = df1[cols].drop_duplicates(), df2[cols].drop_duplicates()
+    if not by:
+        return keys1.shape[0]*keys2.shape[0]
+    sizes = keys1.groupby(by).size().to_frame('n1').join(keys2.groupby(by).size().to_frame('n2'), how='inner')
+    return int((sizes['n1']*sizes['n2']).sum())
+
+
+def _pairs_sorted(df1, df2, by=None):
+    # sorted search looks at each unique key once
+    cols = (by or [])+['key']
+    return df1[cols].drop_duplicates().shape[0]+df2[cols].drop_duplicates().shape[0]
+
+
+# ******************************************
+# benchmarks
+# ******************************************
+
+def bench_str_noblock(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_strings, n, seed=seed, **kwargs)
+    return _pairs_allpairs(df1, df2), lambda: d6tjoin.top1.MergeTop1Diff(df1, df2, 'key', 'key', jellyfish.levenshtein_distance).top1_diff()
+
+
+def bench_str_block(n, seed=0, nblocks=None, **kwargs):
+    df1, df2 = _gen(datagen.gen_strings, n, nblocks=nblocks or max(n//100, 1), seed=seed, **kwargs)
+    return _pairs_allpairs(df1, df2, ['block']), lambda: d6tjoin.top1.MergeTop1Diff(df1, df2, 'key', 'key', jellyfish.levenshtein_distance, ['block'], ['block']).top1_diff()
+
+
+def bench_num_noblock(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_numbers, n, seed=seed, **kwargs)
+    return _pairs_sorted(df1, df2), lambda: d6tjoin.top1.MergeTop1Number(df1, df2, 'key', 'key').top1_diff()
+
+
+def bench_num_block(n, seed=0, nblocks=None, **kwargs):
+    df1, df2 = _gen(datagen.gen_numbers, n, nblocks=nblocks or max(n//100, 1), seed=seed, **kwargs)
+    return _pairs_sorted(df1, df2, ['block']), lambda: d6tjoin.top1.MergeTop1Number(df1, df2, 'key', 'key', ['block'], ['block']).top1_diff()
+
+
+def bench_multikey(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_multikey, n, seed=seed, **kwargs)
+    npairs = _pairs_sorted(df1[['date']].rename(columns={'date':'key'}), df2[['date']].rename(columns={'date':'key'}))
+    npairs += _pairs_allpairs(df1.rename(columns={'date':'block'}), df2.rename(columns={'date':'block'}), ['block'])
+    return npairs, lambda: d6tjoin.top1.MergeTop1(df1, df2, ['date','key'], ['date','key']).merge()
+
+
+def bench_fuzzyjoin(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_strings, n, seed=seed, **kwargs)
+    return _pairs_allpairs(df1, df2), lambda: d6tjoin.smart_join.FuzzyJoinTop1([df1, df2], fuzzy_keys=['key'], fuzzy_how={0:{}}).join()
+
+
+def bench_prejoin(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_strings, n, seed=seed, **kwargs)
+    return df1.shape[0]+df2.shape[0], lambda: d6tjoin.utils.PreJoin([df1, df2], ['block','key']).stats_prejoin(print_only=False)
+
+
+def bench_prejoin_approx(n, seed=0, **kwargs):
+    df1, df2 = _gen(datagen.gen_strings, n, seed=seed, **kwargs)
+    return df1.shape[0]+df2.shape[0], lambda: d6tjoin.utils.PreJoin([df1, df2], ['block','key']).stats_prejoin_approx(print_only=False)
+
+
+BENCHMARKS = OrderedDict([
+    ('str_noblock', bench_str_noblock),
+    ('str_block', bench_str_block),
+    ('num_noblock', bench_num_noblock),
+    ('num_block', bench_num_block),
+    ('multikey', bench_multikey),
+    ('fuzzyjoin', bench_fuzzyjoin),
+    ('prejoin', bench_prejoin),
+    ('prejoin_approx', bench_prejoin_approx),
+])
+
+
+# ******************************************
+# runner
+# ******************************************
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_time(fun, repeat=1):
+    """
+    Fastest wall time in seconds of repeat runs
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def measure_memory(fun):
+    """
+    Peak memory in MB of python and numpy allocations in this process during one run. Tracing slows down python code so it runs separately from timing. Workers of multicore joins are not counted
+    """
+    tracemalloc.start()
+    try:
+        fun()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak/2**20
+
+
+def run(names=None, sizes=(1e3, 1e4), repeat=1, seed=0, max_pairs=None, memory=True, **kwargs):
+    """
+    Runs benchmarks for each size, keeps the fastest of repeat runs. Memory gets measured in one more run
+
+    Args:
+        names (list): benchmarks in `BENCHMARKS`, default all
+        sizes (list): rows in each dataframe
+        repeat (int): runs per benchmark and size
+        seed (int): random seed of the data generators
+        max_pairs (float): skip all-pairs sizes with more candidate pairs
+        memory (bool): measure peak memory
+        kwargs: passed to data generators, eg str_len, typo_rate, block_skew
+
+    Returns:
+        dataframe: one row per benchmark and size
+    """
+    results = []
+    commit = _git_commit()
+    params = ' '.join('%s=%s' % (k, v) for k, v in sorted(kwargs.items()))
+    for name in names or list(BENCHMARKS):
+        for n in sizes:
+            npairs, fun = BENCHMARKS[name](int(n), seed=seed, **kwargs)
+            if max_pairs and npairs > max_pairs:
+                print('%s n=%d skipped, %d pairs' % (name, n, npairs))
+                continue
+            seconds = measure_time(fun, repeat)
+            peak_mb = measure_memory(fun) if memory else np.nan
+            results.append({'commit':commit, 'benchmark':name, 'params':params, 'nrows':int(n), 'pairs':npairs, 'seconds':seconds, 'pairs_per_sec':npairs/seconds, 'peak_mb':peak_mb})
+            print('%s n=%d %.3fs %.3g pairs/s %.1fMB' % (name, n, seconds, npairs/seconds, peak_mb))
+    return pd.DataFrame(results, columns=['commit','benchmark','params','nrows','pairs','seconds','pairs_per_sec','peak_mb'])
+
+
+def compare(df_new, df_base):
+    """
+    Joins two runs by benchmark, generator params and size, ratios above 1 are slower or larger than base
+    """
+    df_base, df_new = df_base.fillna({'params':''}), df_new.fillna({'params':''})
+    df = df_base.merge(df_new, on=['benchmark','params','nrows'], suffixes=['_base',''])
+    df['time_ratio'] = df['seconds']/df['seconds_base']
+    df['mem_ratio'] = df['peak_mb']/df['peak_mb_base']
+    return df[['benchmark','params','nrows','seconds_base','seconds','time_ratio','peak_mb_base','peak_mb','mem_ratio']]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run, default all')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1e3, 1e4], help='rows in each dataframe, eg 1e3 1e5 1e7')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced run for peak memory')
+    parser.add_argument('--max-pairs', type=float, default=1e10, help='skip all-pairs sizes above this many candidate pairs')
+    parser.add_argument('--str-len', type=int, help='average string key length')
+    parser.add_argument('--typo-rate', type=float, help='probability of a typo at each letter')
+    parser.add_argument('--block-skew', type=float, help='zipf exponent of block sizes')
+    parser.add_argument('--out', help='append results to this csv')
+    parser.add_argument('--compare', help='csv of a previous run to compare against')
+    args = parser.parse_args(argv)
+
+    kwargs = dict((k, v) for k, v in [('str_len', args.str_len), ('typo_rate', args.typo_rate), ('block_skew', args.block_skew)] if v is not None)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df = run(args.only, args.sizes, args.repeat, args.seed, args.max_pairs, not args.no_memory, **kwargs)
+
+    if args.out:
+        df.to_csv(args.out, mode='a', header=not os.path.exists(args.out), index=False)
+    if args.compare:
+        print(compare(df, pd.read_csv(args.compare).drop_duplicates(['benchmark','params','nrows'], keep='last')).to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    main()
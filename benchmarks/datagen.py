@@ -0,0 +1,119 @@
+import string
+import numpy as np
+import pandas as pd
+
+
+# ******************************************
+# helpers
+# ******************************************
+
+def _block_ids(nrows, nblocks, block_skew, rng):
+    """
+    Block of each row, block sizes follow a zipf law: skew 0 is uniform, larger skew puts more rows into the first blocks
+    """
+    weights = 1.0/np.arange(1, nblocks+1)**block_skew
+    return rng.choice(nblocks, size=nrows, p=weights/weights.sum())
+
+
+def _random_strings(n, str_len, rng):
+    lengths = np.maximum(rng.poisson(str_len, n), 1)
+    chars = np.array(list(string.ascii_lowercase))
+    letters = chars[rng.randint(0, len(chars), lengths.sum())]
+    bounds = np.r_[0, np.cumsum(lengths)]
+    return np.array([''.join(letters[i:j]) for i, j in zip(bounds[:-1], bounds[1:])], dtype=object)
+
+
+def _add_typos(values, typo_rate, rng):
+    """
+    Substitutes, deletes or inserts a letter at each position with probability typo_rate
+    """
+    chars = string.ascii_lowercase
+    out = []
+    for v in values:
+        ntypos = rng.binomial(len(v), typo_rate)
+        v = list(v)
+        for pos in rng.randint(0, max(len(v), 1), ntypos):
+            pos = min(pos, len(v)-1)
+            kind = rng.randint(3)
+            if kind == 0 and v:
+                v[pos] = chars[rng.randint(len(chars))]
+            elif kind == 1 and len(v) > 1:
+                del v[pos]
+            else:
+                v.insert(pos, chars[rng.randint(len(chars))])
+        out.append(''.join(v))
+    return np.array(out, dtype=object)
+
+
+# ******************************************
+# generators
+# ******************************************
+
+def gen_strings(nrows, nunique=None, str_len=10, typo_rate=0.05, nblocks=1, block_skew=0., seed=0):
+    """
+    Left and right dataframes with string keys, right keys are left keys with typos
+
+    Args:
+        nrows (int): rows in each dataframe
+        nunique (int): unique keys, default nrows
+        str_len (int): average key length
+        typo_rate (float): probability of a typo at each letter
+        nblocks (int): number of values of the exact key 'block'
+        block_skew (float): zipf exponent of block sizes, 0 for equal blocks
+        seed (int): random seed
+
+    Returns:
+        tuple: left, right dataframe with columns 'block','key','v1'/'v2'
+    """
+    rng = np.random.RandomState(seed)
+    nunique = nunique or nrows
+    keys = _random_strings(nunique, str_len, rng)
+    blocks = _block_ids(nunique, nblocks, block_skew, rng)
+    ileft, iright = rng.randint(0, nunique, nrows), rng.randint(0, nunique, nrows)
+    df1 = pd.DataFrame({'block':blocks[ileft], 'key':keys[ileft], 'v1':np.arange(nrows)})
+    df2 = pd.DataFrame({'block':blocks[iright], 'key':_add_typos(keys, typo_rate, rng)[iright], 'v2':np.arange(nrows)})
+    return df1, df2
+
+
+def gen_numbers(nrows, nblocks=1, block_skew=0., noise=0.01, is_date=False, seed=0):
+    """
+    Left and right dataframes with number or date keys, right keys are left keys plus noise
+
+    Args:
+        nrows (int): rows in each dataframe
+        nblocks (int): number of values of the exact key 'block'
+        block_skew (float): zipf exponent of block sizes, 0 for equal blocks
+        noise (float): standard deviation of right keys around left keys, relative to the key range. Days for dates
+        is_date (bool): date keys, one day per unit
+        seed (int): random seed
+
+    Returns:
+        tuple: left, right dataframe with columns 'block','key','v1'/'v2'
+    """
+    rng = np.random.RandomState(seed)
+    keys = rng.rand(nrows)
+    keys_right = rng.permutation(keys + rng.randn(nrows)*noise)
+    if is_date:
+        keys = pd.Timestamp('2010-01-01') + pd.to_timedelta(np.round(keys*nrows), unit='D')
+        keys_right = pd.Timestamp('2010-01-01') + pd.to_timedelta(np.round(keys_right*nrows), unit='D')
+    df1 = pd.DataFrame({'block':_block_ids(nrows, nblocks, block_skew, rng), 'key':keys, 'v1':np.arange(nrows)})
+    df2 = pd.DataFrame({'block':_block_ids(nrows, nblocks, block_skew, rng), 'key':keys_right, 'v2':np.arange(nrows)})
+    return df1, df2
+
+
+def gen_multikey(nrows, ndates=10, str_len=10, typo_rate=0.05, seed=0):
+    """
+    Left and right dataframes with a date and a string key, eg ids by date. Right dates are business days only
+
+    Returns:
+        tuple: left, right dataframe with columns 'date','key','v1'/'v2'
+    """
+    rng = np.random.RandomState(seed)
+    nids = max(nrows // ndates, 1)
+    keys = _random_strings(nids, str_len, rng)
+    dates1 = pd.date_range('2010-01-01', periods=ndates)
+    dates2 = pd.bdate_range('2010-01-01', periods=ndates)
+    df1 = pd.DataFrame({'date':np.repeat(dates1, nids), 'key':np.tile(keys, ndates)})
+    df2 = pd.DataFrame({'date':np.repeat(dates2, nids), 'key':np.tile(_add_typos(keys, typo_rate, rng), ndates)})
+    df1['v1'], df2['v2'] = np.arange(df1.shape[0]), np.arange(df2.shape[0])
+    return df1, df2
@@ -0,0 +1,247 @@
+import sqlite3
+import pickle
+import hashlib
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+_PICKLE_PROTOCOL = 4 # fixed so keys are the same across python versions
+_SQL_CHUNKSIZE = 500 # below sqlite limit on query parameters
+
+
+# ******************************************
+# helpers
+# ******************************************
+
+def _code_hash(code, hasher, names):
+    # bytecode and constants of a code object and the code objects nested in it, collects referenced names
+    hasher.update(code.co_code)
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_hash(const, hasher, names)
+        else:
+            hasher.update(repr(const).encode())
+
+
+def _value_fingerprint(name, value, seen):
+    if isinstance(value, types.ModuleType):
+        return value.__name__
+    if isinstance(value, types.FunctionType):
+        return fun_fingerprint(value, seen)
+    if isinstance(value, type) or callable(value) and hasattr(value, '__qualname__'):
+        return '%s.%s' % (getattr(value, '__module__', ''), value.__qualname__) # classes and builtins
+    try:
+        return hashlib.sha1(_dumps(value)).hexdigest()
+    except Exception:
+        raise ValueError('cannot fingerprint %s, which the function depends on. Set an explicit cache key with fun.cache_key' % name)
+
+
+def fun_fingerprint(fun, seen=None):
+    """
+    Identifies a function across runs by its qualified name, bytecode, defaults, closure values and referenced globals. Functions with a `cache_key` attribute are identified by it instead
+
+    Raises:
+        ValueError: function depends on values which can't be pickled and has no `cache_key`
+    """
+    if fun is None:
+        return 'None'
+    if getattr(fun, 'cache_key', None) is not None:
+        return 'key:%s' % fun.cache_key
+    code = getattr(fun, '__code__', None)
+    name = '%s.%s' % (getattr(fun, '__module__', ''), getattr(fun, '__qualname__', repr(fun)))
+    if code is None:
+        return name
+
+    seen = set() if seen is None else seen
+    if id(fun) in seen:
+        return name # recursion
+    seen.add(id(fun))
+
+    hasher, names = hashlib.sha1(), set()
+    _code_hash(code, hasher, names)
+    for label, value in [('defaults', fun.__defaults__), ('kwdefaults', fun.__kwdefaults__)]:
+        hasher.update(_value_fingerprint('%s of %s' % (label, name), value, seen).encode())
+    for var, cell in zip(code.co_freevars, fun.__closure__ or ()):
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue # not assigned yet
+        hasher.update(('%s=%s' % (var, _value_fingerprint(var, value, seen))).encode())
+    for var in sorted(names):
+        if var in fun.__globals__:
+            hasher.update(('%s=%s' % (var, _value_fingerprint(var, fun.__globals__[var], seen))).encode())
+    return '%s:%s' % (name, hasher.hexdigest())
+
+
+def values_fingerprint(values):
+    """
+    Hash of a set of values, independent of order
+    """
+    hashes = np.sort(pd.util.hash_array(np.asarray(list(values), dtype=object)))
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def _dumps(value):
+    return pickle.dumps(value, protocol=_PICKLE_PROTOCOL)
+
+
+def _chunks(values, size=_SQL_CHUNKSIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+
+# ******************************************
+# cache
+# ******************************************
+
+class DiffCache(object):
+    """
+    Persistent cache of top1 differences in a local SQLite file. Stores the topn matches for each left value with the right values they were found among, and differences of key pairs. Least recently used entries are evicted beyond maxsize.
+
+    Args:
+        path (str): SQLite file, ':memory:' for a cache which only lives as long as the object
+        maxsize (int): maximum number of entries per table, None for unbounded
+
+    """
+
+    def __init__(self, path, maxsize=1000000):
+        self.path = path
+        self.maxsize = maxsize
+        self.conn = sqlite3.connect(path)
+        if 'rights' not in [c[1] for c in self.conn.execute('PRAGMA table_info(top1)')]:
+            self.conn.execute('DROP TABLE IF EXISTS top1') # written by an earlier version without right values
+        self.conn.execute('CREATE TABLE IF NOT EXISTS top1 (fingerprint TEXT, left BLOB, rights TEXT, rows BLOB, used REAL, PRIMARY KEY (fingerprint, left, rights))')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rights (rights TEXT PRIMARY KEY, vals BLOB, used REAL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pairs (fingerprint TEXT, left BLOB, right BLOB, diff BLOB, used REAL, PRIMARY KEY (fingerprint, left, right))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS top1_used ON top1 (used)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS pairs_used ON pairs (used)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS rights_used ON rights (used)')
+        self.conn.commit()
+
+    def _evict(self, table):
+        if self.maxsize is None:
+            return
+        nrows = self.conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        if nrows > self.maxsize:
+            self.conn.execute('DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s ORDER BY used LIMIT ?)' % (table, table), (nrows - self.maxsize,))
+
+    def _get_rights(self, rights):
+        # right values of a cached topn, None if evicted
+        row = self.conn.execute('SELECT vals FROM rights WHERE rights=?', (rights,)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def get_top1(self, fingerprint, values_left, values_right):
+        """
+        Looks up cached topn matches found among values_right or a subset of it
+
+        Args:
+            fingerprint (str): identifies difference function and settings
+            values_left (list): left values to look up
+            values_right (list): right values to find matches among
+
+        Returns:
+            dict: left value to (list of (right value, difference) tuples, list of right values not scored yet), only for cached left values
+        """
+        keys = {_dumps(v): v for v in values_left}
+        rights_current = values_fingerprint(values_right)
+        values_right = set(values_right)
+        added = {rights_current: []} # right values added since a cached set of right values, None if not a subset
+        found = {}
+        for chunk in _chunks(list(keys)):
+            sql = 'SELECT left, rights, rows FROM top1 WHERE fingerprint=? AND left IN (%s)' % ','.join('?'*len(chunk))
+            for left, rights, rows in self.conn.execute(sql, [fingerprint]+chunk):
+                if rights not in added:
+                    values_cached = self._get_rights(rights)
+                    added[rights] = list(values_right.difference(values_cached)) if values_cached is not None and values_right.issuperset(values_cached) else None
+                if added[rights] is not None and (left not in found or len(added[rights]) < len(added[found[left][0]])):
+                    found[left] = (rights, rows)
+        if found:
+            now = time.time()
+            self.conn.executemany('UPDATE top1 SET used=? WHERE fingerprint=? AND left=? AND rights=?', [(now, fingerprint, k, rights) for k, (rights, rows) in found.items()])
+            self.conn.executemany('UPDATE rights SET used=? WHERE rights=?', [(now, rights) for rights in {rights for rights, rows in found.values()}])
+            self.conn.commit()
+        return {keys[k]: (pickle.loads(rows), added[rights]) for k, (rights, rows) in found.items()}
+
+    def set_top1(self, fingerprint, values_right, matches):
+        """
+        Stores topn matches, replaces matches of the same left values found among fewer right values
+
+        Args:
+            fingerprint (str): identifies difference function and settings
+            values_right (list): right values the matches were found among
+            matches (dict): left value to list of (right value, difference) tuples
+        """
+        now = time.time()
+        rights = values_fingerprint(values_right)
+        if self.conn.execute('SELECT COUNT(*) FROM rights WHERE rights=?', (rights,)).fetchone()[0]:
+            self.conn.execute('UPDATE rights SET used=? WHERE rights=?', (now, rights))
+        else:
+            self.conn.execute('INSERT INTO rights VALUES (?,?,?)', (rights, _dumps(list(values_right)), now))
+        lefts = [_dumps(k) for k in matches]
+        values_right = set(values_right)
+        superseded = {rights: True}
+        for chunk in _chunks(lefts):
+            sql = 'SELECT left, rights FROM top1 WHERE fingerprint=? AND left IN (%s)' % ','.join('?'*len(chunk))
+            delete = []
+            for left, rights_cached in self.conn.execute(sql, [fingerprint]+chunk).fetchall():
+                if rights_cached not in superseded:
+                    values_cached = self._get_rights(rights_cached)
+                    superseded[rights_cached] = values_cached is None or values_right.issuperset(values_cached)
+                if superseded[rights_cached]:
+                    delete.append((fingerprint, left, rights_cached))
+            self.conn.executemany('DELETE FROM top1 WHERE fingerprint=? AND left=? AND rights=?', delete)
+        self.conn.executemany('INSERT INTO top1 VALUES (?,?,?,?,?)', [(fingerprint, k, rights, _dumps(v), now) for k, v in zip(lefts, matches.values())])
+        self._evict('top1')
+        self._evict('rights')
+        self.conn.commit()
+
+    def get_pairs(self, fingerprint, pairs):
+        """
+        Looks up cached differences of key pairs
+
+        Args:
+            fingerprint (str): identifies difference function
+            pairs (list): list of (left value, right value) tuples
+
+        Returns:
+            dict: (left value, right value) to difference, only for cached pairs
+        """
+        keys = {(_dumps(l), _dumps(r)): (l, r) for l, r in pairs}
+        found = {}
+        for chunk in _chunks(list({k[0] for k in keys})):
+            sql = 'SELECT left, right, diff FROM pairs WHERE fingerprint=? AND left IN (%s)' % ','.join('?'*len(chunk))
+            for left, right, diff in self.conn.execute(sql, [fingerprint]+chunk):
+                if (left, right) in keys:
+                    found[(left, right)] = pickle.loads(diff)
+        if found:
+            self.conn.executemany('UPDATE pairs SET used=? WHERE fingerprint=? AND left=? AND right=?', [(time.time(), fingerprint, l, r) for l, r in found])
+            self.conn.commit()
+        return {keys[k]: v for k, v in found.items()}
+
+    def set_pairs(self, fingerprint, diffs):
+        """
+        Stores differences of key pairs
+
+        Args:
+            fingerprint (str): identifies difference function
+            diffs (dict): (left value, right value) to difference
+        """
+        now = time.time()
+        self.conn.executemany('INSERT OR REPLACE INTO pairs VALUES (?,?,?,?,?)', [(fingerprint, _dumps(l), _dumps(r), _dumps(d), now) for (l, r), d in diffs.items()])
+        self._evict('pairs')
+        self.conn.commit()
+
+    def clear(self):
+        """
+        Removes all cached entries
+        """
+        self.conn.execute('DELETE FROM top1')
+        self.conn.execute('DELETE FROM pairs')
+        self.conn.execute('DELETE FROM rights')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,371 @@
+import numpy as np
+import pandas as pd
+import jellyfish
+
+_BANDED_MAX_WIDTH = 8 # wider bands are slower than the full bit-parallel kernel
+
+
+# ******************************************
+# encoding
+# ******************************************
+
+def to_str_array(values):
+    """
+    Converts strings to a fixed width unicode array, or an object array if any string ends with '\\x00' which numpy would strip
+
+    Args:
+        values (list): list of strings
+
+    Returns:
+        np.array: strings
+    """
+    values = list(values)
+    if any(v.endswith('\x00') for v in values):
+        return np.asarray(values, dtype=object)
+    return np.asarray(values, dtype=str)
+
+
+def factorize(values, sort=False):
+    """
+    Same as `pd.factorize`, also for strings containing '\\x00' which pandas' string hashtable cuts off
+
+    Args:
+        values (list): values
+        sort (bool): sort uniques, raises TypeError if they aren't sortable
+
+    Returns:
+        tuple: codes, -1 for missing values, and uniques
+    """
+    if not isinstance(values, np.ndarray) or values.dtype != object:
+        values = pd.Series(list(values), dtype=object).values # keeps tuples as values
+    if not any(isinstance(v, str) and '\x00' in v for v in values):
+        return pd.factorize(values, sort=sort)
+    uniques = pd.Series(values).dropna().drop_duplicates().values # hashes python objects
+    if sort:
+        uniques = np.sort(uniques)
+    return pd.Index(uniques, dtype=object).get_indexer(values), uniques
+
+
+def str_to_codes(values):
+    """
+    Encodes strings as a zero padded matrix of unicode code points
+
+    Args:
+        values (list): list of strings or numpy unicode array, see `to_str_array`
+
+    Returns:
+        tuple: (codes, lengths). codes is int32 array of shape (len(values), max string length), lengths is int array of string lengths
+    """
+    if len(values) == 0:
+        return np.zeros((0, 0), dtype=np.int32), np.zeros(0, dtype=np.int64)
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'U':
+        lengths = np.char.str_len(values).astype(np.int64)
+    else:
+        # lengths from python keep trailing '\x00' as code 0
+        lengths = np.fromiter((len(v) for v in values), dtype=np.int64, count=len(values))
+        values = np.asarray(values, dtype='<U%d' % max(lengths.max(), 1))
+    codes = values.view(np.int32).reshape(values.shape[0], -1)
+    return codes, lengths
+
+
+# ******************************************
+# levenshtein
+# ******************************************
+
+def _levenshtein_codes_dp(a, codes, lengths):
+    """
+    Row-by-row dynamic programming, vectorized over all strings in codes.
+    """
+    n, m = codes.shape
+    cols = np.arange(m + 1, dtype=np.int32)
+    prev = np.tile(cols, (n, 1))
+    t = np.empty_like(prev)
+    for i, c in enumerate(a, 1):
+        t[:, 0] = i
+        np.minimum(prev[:, 1:] + 1, prev[:, :-1] + (codes != ord(c)), out=t[:, 1:])
+        prev = np.minimum.accumulate(t - cols, axis=1) + cols
+    return prev[np.arange(n), lengths].astype(np.int64)
+
+
+def _levenshtein_codes_bitparallel(a, codes, lengths):
+    """
+    Myers/Hyyrö bit-parallel algorithm with `a` as the pattern (len(a)<=64), vectorized over all strings in codes
+    """
+    n, m = codes.shape
+    codes_a = np.array([ord(c) for c in a], dtype=np.int32)
+    alpha = np.unique(codes_a)
+    peq = np.zeros(alpha.shape[0] + 1, dtype=np.uint64)  # last entry = no match
+    for i, c in enumerate(codes_a):
+        peq[np.searchsorted(alpha, c)] |= np.uint64(1) << np.uint64(i)
+    pos = np.searchsorted(alpha, codes)
+    pos[alpha[np.minimum(pos, alpha.shape[0] - 1)] != codes] = alpha.shape[0]
+    eq_all = np.asfortranarray(peq[pos])
+
+    one = np.uint64(1)
+    highbit = np.uint64(1) << np.uint64(len(a) - 1)
+    pv = np.full(n, np.iinfo(np.uint64).max, dtype=np.uint64)
+    mv = np.zeros(n, dtype=np.uint64)
+    score = np.full(n, len(a), dtype=np.int64)
+    for j in range(m):
+        eq = eq_all[:, j]
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        active = lengths > j
+        score += ((ph & highbit) != 0) & active
+        score -= ((mh & highbit) != 0) & active
+        ph = (ph << one) | one
+        mh = mh << one
+        pv = mh | ~(xv | ph)
+        mv = ph & xv
+    return score
+
+
+def levenshtein_codes(a, codes, lengths):
+    """
+    Levenshtein distance between string `a` and every string encoded with `str_to_codes`
+
+    Args:
+        a (str): string
+        codes (np.array): code point matrix from `str_to_codes`
+        lengths (np.array): string lengths from `str_to_codes`
+
+    Returns:
+        np.array: distances, one for each row in codes
+    """
+    if codes.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64)
+    if len(a) == 0:
+        return lengths.astype(np.int64)
+    if len(a) <= 64:
+        return _levenshtein_codes_bitparallel(a, codes, lengths)
+    return _levenshtein_codes_dp(a, codes, lengths)
+
+
+def _levenshtein_codes_banded(a, codes, lengths, k):
+    """
+    Dynamic programming restricted to the diagonal band of width 2k+1, vectorized over all strings in codes. Strings are dropped once they are more than k edits away.
+    """
+    n, m = codes.shape
+    big = len(a) + m + k + 2 # larger than any distance
+    offsets = np.arange(-k, k + 1) # column minus row
+    steps = np.arange(2 * k + 1)
+    ret = np.full(n, k + 1, dtype=np.int64)
+
+    alive = np.flatnonzero(np.abs(lengths - len(a)) <= k)
+    codes, lengths = codes[alive], lengths[alive]
+    prev = np.where((offsets >= 0) & (offsets <= lengths[:, None]), offsets, big)
+    for i, c in enumerate(a, 1):
+        if alive.size == 0:
+            break
+        cols = i + offsets
+        valid = (cols >= 0) & (cols <= lengths[:, None])
+        t = prev + (codes[:, np.clip(cols - 1, 0, m - 1)] != ord(c))
+        np.minimum(t[:, :-1], prev[:, 1:] + 1, out=t[:, :-1])
+        if i <= k:
+            t[:, k - i] = i
+        t[~valid] = big
+        prev = np.minimum.accumulate(t - steps, axis=1) + steps
+        prev[~valid] = big
+
+        # lower bound of the final distance through each cell
+        keep = (prev + np.abs(lengths[:, None] - cols - (len(a) - i))).min(axis=1) <= k
+        if not keep.all():
+            alive, codes, lengths, prev = alive[keep], codes[keep], lengths[keep], prev[keep]
+
+    ret[alive] = prev[np.arange(alive.size), lengths - len(a) + k]
+    return np.minimum(ret, k + 1)
+
+
+def levenshtein_codes_bounded(a, codes, lengths, max_diff):
+    """
+    Levenshtein distance between string `a` and every string encoded with `str_to_codes`, only computed exactly up to max_diff
+
+    Args:
+        a (str): string
+        codes (np.array): code point matrix from `str_to_codes`
+        lengths (np.array): string lengths from `str_to_codes`
+        max_diff (float): maximum difference of interest
+
+    Returns:
+        np.array: distances, distances above max_diff are returned as floor(max_diff)+1
+    """
+    k = int(np.floor(max_diff))
+    if k < 0:
+        return np.zeros(codes.shape[0], dtype=np.int64)
+    if len(a) == 0 or codes.shape[1] == 0 or 2 * k + 1 >= _BANDED_MAX_WIDTH:
+        return np.minimum(levenshtein_codes(a, codes, lengths), k + 1)
+    return _levenshtein_codes_banded(a, codes, lengths, k)
+
+
+def levenshtein_batch(a, values, max_diff=None):
+    """
+    Levenshtein distance between string `a` and every string in values. Same results as `jellyfish.levenshtein_distance`
+
+    Args:
+        a (str): string
+        values (list): list of strings or numpy unicode array, which is encoded without a copy
+        max_diff (float): if given only distances up to max_diff are computed exactly, see `levenshtein_codes_bounded`
+
+    Returns:
+        np.array: distances
+    """
+    codes, lengths = str_to_codes(values)
+    if max_diff is not None and np.isfinite(max_diff):
+        return levenshtein_codes_bounded(a, codes, lengths, max_diff)
+    return levenshtein_codes(a, codes, lengths)
+
+
+def levenshtein_bounded(a, b, max_diff):
+    """
+    Thresholded Levenshtein distance between two strings
+
+    Args:
+        a (str): string
+        b (str): string
+        max_diff (float): maximum difference of interest
+
+    Returns:
+        int: distance, floor(max_diff)+1 if the distance is larger than max_diff
+    """
+    return int(levenshtein_batch(a, [b], max_diff)[0])
+
+
+# ******************************************
+# batched difference functions
+# ******************************************
+
+# difference functions which have a batched equivalent scoring one string against an array of strings at once
+FUN_DIFF_BATCH = {
+    jellyfish.levenshtein_distance: levenshtein_batch,
+}
+
+
+# batched difference functions which take a maximum difference `f(value, values, max_diff)` and stop computing pairs as soon as they exceed it
+FUN_DIFF_BATCH_BOUNDED = {
+    levenshtein_batch,
+}
+
+
+def has_bounded_batch(fun_diff_batch):
+    """
+    Checks if a batched difference function takes a maximum difference
+    """
+    try:
+        return fun_diff_batch in FUN_DIFF_BATCH_BOUNDED
+    except TypeError: # unhashable callable
+        return False
+
+
+def apply_fun_diff_bounded(fun_diff_batch, value, values, max_diff=None):
+    """
+    Applies a batched difference function, passing max_diff if it takes one. Differences above max_diff can be any value larger than max_diff
+    """
+    if max_diff is not None and np.isfinite(max_diff) and has_bounded_batch(fun_diff_batch):
+        return np.asarray(fun_diff_batch(value, values, max_diff))
+    return np.asarray(fun_diff_batch(value, values))
+
+
+def get_fun_diff_batch(fun_diff):
+    """
+    Returns batched equivalent of a difference function, None if there is none
+    """
+    try:
+        return FUN_DIFF_BATCH.get(fun_diff)
+    except TypeError: # unhashable callable
+        return None
+
+
+# difference functions which are at least the difference in string lengths, allows pruning by length
+FUN_DIFF_LENGTH_BOUND = {
+    jellyfish.levenshtein_distance,
+    jellyfish.damerau_levenshtein_distance,
+}
+
+
+# difference functions which are at most the number of edits, allows the q-gram count filter
+FUN_DIFF_QGRAM_BOUND = {
+    jellyfish.levenshtein_distance,
+}
+
+
+def has_length_bound(fun_diff):
+    """
+    Checks if a difference function is at least the difference in string lengths
+    """
+    try:
+        return fun_diff in FUN_DIFF_LENGTH_BOUND
+    except TypeError: # unhashable callable
+        return False
+
+
+def has_qgram_bound(fun_diff):
+    """
+    Checks if a difference function can use the q-gram count filter
+    """
+    try:
+        return fun_diff in FUN_DIFF_QGRAM_BOUND
+    except TypeError: # unhashable callable
+        return False
+
+
+def fun_diff_to_batch(fun_diff):
+    """
+    Wraps a pairwise difference function so it has the same signature as a batched difference function
+    """
+    def fun_diff_batch(a, values):
+        return np.array([fun_diff(a, v) for v in values])
+    return fun_diff_batch
+
+
+def apply_fun_diff_batch_codes(codes1, uniques1, codes2, uniques2, fun_diff_batch, max_diff=None):
+    """
+    Applies a batched difference function to aligned pairs of integer codes into vocabularies of strings
+
+    Args:
+        codes1 (np.array): left codes into uniques1
+        uniques1 (np.array): left vocabulary
+        codes2 (np.array): right codes into uniques2, same length as codes1
+        uniques2 (np.array): right vocabulary
+        fun_diff_batch (function): batched difference function, see `FUN_DIFF_BATCH`
+        max_diff (float): maximum difference of interest, differences above it can be any larger value, see `apply_fun_diff_bounded`
+
+    Returns:
+        np.array: differences
+    """
+    codes1, codes2 = np.asarray(codes1), np.asarray(codes2)
+    uniques2 = to_str_array(uniques2)
+
+    order = np.argsort(codes1, kind='mergesort')
+    bounds = np.searchsorted(codes1[order], np.arange(len(uniques1) + 1))
+
+    ret = np.zeros(len(codes1), dtype=np.int64)
+    for i in np.unique(codes1):
+        idx = order[bounds[i]:bounds[i + 1]]
+        ret[idx] = apply_fun_diff_bounded(fun_diff_batch, uniques1[i], uniques2[codes2[idx]], max_diff)
+    return ret
+
+
+def apply_fun_diff_batch(values1, values2, fun_diff_batch):
+    """
+    Applies a batched difference function to aligned pairs of strings
+
+    Args:
+        values1 (np.array): left strings
+        values2 (np.array): right strings, same length as values1
+        fun_diff_batch (function): batched difference function, see `FUN_DIFF_BATCH`
+
+    Returns:
+        np.array: differences
+    """
+    codes1, uniques1 = factorize(values1)
+    codes2, uniques2 = factorize(values2)
+    return apply_fun_diff_batch_codes(codes1, uniques1, codes2, uniques2, fun_diff_batch)
+
+
+def is_str_values(values):
+    """
+    Checks if all values are strings, batched string kernels only apply then
+    """
+    return pd.api.types.infer_dtype(values, skipna=False) == 'string'
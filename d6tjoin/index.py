@@ -0,0 +1,310 @@
+import numpy as np
+
+from d6tjoin.distance import to_str_array, str_to_codes, apply_fun_diff_bounded
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError: # optional, points get scored in chunks without it
+    cKDTree = None
+
+_POINTS_CHUNKSIZE = 2**22 # coordinates compared at once without KD-tree
+
+
+# ******************************************
+# helpers
+# ******************************************
+
+def _topn_threshold(best, diffs, topn, top_limit):
+    """
+    Updates the topn smallest unique differences seen so far and returns the largest difference which can still make it into the topn
+    """
+    best = np.unique(np.concatenate([best, np.asarray(diffs, dtype=best.dtype)]))[:topn]
+    threshold = best[-1] if len(best)>=topn else np.inf
+    if top_limit is not None:
+        threshold = min(threshold, top_limit)
+    return best, threshold
+
+
+# ******************************************
+# length index
+# ******************************************
+
+class LengthIndex(object):
+    """
+    Index of strings bucketed by length, for edit distances which are at least the difference in string lengths.
+
+    Args:
+        values (list): list of strings to index
+
+    """
+
+    def __init__(self, values):
+        values = to_str_array(values)
+        lengths = str_to_codes(values)[1]
+        self.order = np.argsort(lengths, kind='mergesort')
+        self.values = values[self.order]
+        self.lengths, self.starts = np.unique(lengths[self.order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(values)).astype(int)
+
+    def query(self, value, fun_diff_batch, topn=1, top_limit=None):
+        """
+        Scores value against all indexed values which can be among its topn closest values
+
+        Args:
+            value (str): value to look up
+            fun_diff_batch (function): batched difference function `f(value, values)->np.array`, needs to be at least the difference in lengths. Gets the current topn-th best difference as maximum difference if it takes one
+            topn (int): number of unique smallest differences to keep
+            top_limit (float): maximum difference
+
+        Returns:
+            tuple: positions of scored values in the indexed values, differences. Differences which can't be among the topn can be capped by a bounded difference function
+        """
+        len_diffs = np.abs(self.lengths - len(value))
+        best, threshold = np.zeros(0), np.inf if top_limit is None else top_limit
+        positions, diffs = [], []
+        for ibucket in np.argsort(len_diffs, kind='mergesort'):
+            if len_diffs[ibucket] > threshold:
+                break
+            start, end = self.starts[ibucket], self.ends[ibucket]
+            d = apply_fun_diff_bounded(fun_diff_batch, value, self.values[start:end], threshold)
+            positions.append(self.order[start:end])
+            diffs.append(d)
+            best, threshold = _topn_threshold(best, d, topn, top_limit)
+
+        if not positions:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        return np.concatenate(positions), np.concatenate(diffs)
+
+
+# ******************************************
+# q-gram index
+# ******************************************
+
+def _qgram_keys(codes, lengths, q):
+    """
+    Packs all q-grams of encoded strings into int64 keys, 21 bits per code point
+
+    Returns:
+        tuple: q-gram keys, position of string each q-gram belongs to
+    """
+    n, m = codes.shape
+    if m < q:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.zeros((n, m - q + 1), dtype=np.int64)
+    for t in range(q):
+        keys |= codes[:, t:m - q + 1 + t].astype(np.int64) << (21 * t)
+    valid = np.arange(m - q + 1) < (lengths - q + 1)[:, None]
+    ids = np.broadcast_to(np.arange(n)[:, None], keys.shape)[valid]
+    return keys[valid], ids
+
+
+class QGramIndex(object):
+    """
+    Inverted index of q-grams (substrings of length q) for Levenshtein distance. Strings within distance k share at least max(len(a),len(b))-q+1-k*q q-grams, needs a maximum difference.
+
+    Args:
+        values (list): list of strings to index
+        q (int): q-gram length, 1 to 3
+
+    """
+
+    def __init__(self, values, q=2):
+        if q < 1 or q > 3:
+            raise ValueError('q needs to be between 1 and 3')
+        self.q = q
+        self.values = to_str_array(values)
+        codes, self.lengths = str_to_codes(self.values)
+        keys, ids = _qgram_keys(codes, self.lengths, q)
+
+        # postings: count of each q-gram in each string, sorted by q-gram
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        is_new = np.ones(len(keys), dtype=bool)
+        is_new[1:] = (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])
+        starts = np.flatnonzero(is_new)
+        self.post_ids = ids[starts]
+        self.post_counts = np.diff(np.append(starts, len(keys)))
+        self.gram_keys, self.gram_starts = np.unique(keys[starts], return_index=True)
+        self.gram_ends = np.append(self.gram_starts[1:], len(starts)).astype(int)
+
+    def count_common(self, value):
+        """
+        Number of q-grams value has in common with each indexed value
+        """
+        keys, _ = _qgram_keys(*str_to_codes([value]), self.q)
+        keys, counts = np.unique(keys, return_counts=True)
+        common = np.zeros(len(self.values), dtype=np.int64)
+        igram = np.searchsorted(self.gram_keys, keys)
+        for key, count, i in zip(keys, counts, igram):
+            if i < len(self.gram_keys) and self.gram_keys[i] == key:
+                start, end = self.gram_starts[i], self.gram_ends[i]
+                common[self.post_ids[start:end]] += np.minimum(self.post_counts[start:end], count)
+        return common
+
+    def query(self, value, fun_diff_batch, topn=1, top_limit=None):
+        """
+        Scores value against all indexed values which pass the q-gram count filter for top_limit
+
+        Args:
+            value (str): value to look up
+            fun_diff_batch (function): batched difference function `f(value, values)->np.array`, needs to be Levenshtein distance or larger
+            topn (int): number of unique smallest differences to keep, doesn't affect candidates
+            top_limit (float): maximum difference, required
+
+        Returns:
+            tuple: positions of scored values in the indexed values, differences
+        """
+        if top_limit is None:
+            raise ValueError('q-gram index needs top_limit')
+        k = int(np.floor(top_limit))
+        required = np.maximum(len(value), self.lengths) - self.q + 1 - k * self.q
+        is_candidate = (np.abs(self.lengths - len(value)) <= k) & (self.count_common(value) >= required)
+        positions = np.flatnonzero(is_candidate)
+        return positions, apply_fun_diff_bounded(fun_diff_batch, value, self.values[positions], top_limit)
+
+
+# ******************************************
+# BK-tree
+# ******************************************
+
+class BKTree(object):
+    """
+    Burkhard-Keller tree, a metric tree over values for any integer valued metric. Stored in flat arrays.
+
+    Args:
+        values (list): list of values to index
+        fun_diff (function): integer valued metric, needs to satisfy the triangle inequality eg Levenshtein distance
+
+    """
+
+    def __init__(self, values, fun_diff):
+        self.values = values
+        self.fun_diff = fun_diff
+
+        children = [dict() for _ in range(len(values))]
+        for i in range(1, len(values)):
+            node = 0
+            while True:
+                d = fun_diff(values[i], values[node])
+                child = children[node].get(d)
+                if child is None:
+                    children[node][d] = i
+                    break
+                node = child
+
+        self.child_starts = np.cumsum([0]+[len(c) for c in children]).astype(int)
+        self.child_dists = np.array([d for c in children for d in c.keys()], dtype=float)
+        self.child_nodes = np.array([n for c in children for n in c.values()], dtype=int)
+
+    def query(self, value, fun_diff_batch=None, topn=1, top_limit=None):
+        """
+        Scores value against all indexed values in subtrees which can contain one of its topn closest values
+
+        Args:
+            value: value to look up
+            fun_diff_batch (function): not used, the tree always uses the metric it was built with
+            topn (int): number of unique smallest differences to keep
+            top_limit (float): maximum difference
+
+        Returns:
+            tuple: positions of scored values in the indexed values, differences
+        """
+        best, threshold = np.zeros(0), np.inf if top_limit is None else top_limit
+        positions, diffs = [], []
+        stack = [(0, 0)] if len(self.values) else [] # (node, lower bound of difference)
+        while stack:
+            node, lower = stack.pop()
+            if lower > threshold:
+                continue
+            d = self.fun_diff(value, self.values[node])
+            positions.append(node)
+            diffs.append(d)
+            best, threshold = _topn_threshold(best, [d], topn, top_limit)
+
+            start, end = self.child_starts[node], self.child_starts[node+1]
+            lowers = np.abs(self.child_dists[start:end] - d)
+            is_candidate = lowers <= threshold
+            order = np.argsort(-lowers[is_candidate], kind='mergesort') # closest subtree visited first
+            stack.extend(zip(self.child_nodes[start:end][is_candidate][order], lowers[is_candidate][order]))
+
+        return np.array(positions, dtype=int), np.array(diffs)
+
+
+# ******************************************
+# point index
+# ******************************************
+
+class PointIndex(object):
+    """
+    Nearest neighbour index over points in euclidean space, eg scaled (time, price) or (lat, lon) as unit vectors. Uses a KD-tree if scipy is installed, otherwise compares all points in bounded chunks with numpy.
+
+    Args:
+        points (np.array): coordinates, shape (number of points, dimensions)
+
+    """
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float)
+        self.tree = cKDTree(self.points) if cKDTree is not None and len(self.points) else None
+
+    def _query_chunked(self, points, k):
+        chunksize = max(_POINTS_CHUNKSIZE // max(self.points.size, 1), 1)
+        dists, positions = [], []
+        for start in range(0, len(points), chunksize):
+            d = np.sqrt(((points[start:start+chunksize, None, :] - self.points[None, :, :])**2).sum(axis=2))
+            i = np.argsort(d, axis=1, kind='mergesort')[:, :k]
+            dists.append(np.take_along_axis(d, i, axis=1))
+            positions.append(i)
+        return np.concatenate(dists), np.concatenate(positions)
+
+    def query(self, points, topn=1, max_dist=None):
+        """
+        Finds the topn nearest indexed points for each point. Ties are broken arbitrarily
+
+        Args:
+            points (np.array): coordinates, shape (number of points, dimensions)
+            topn (int): number of nearest points to keep
+            max_dist (float): maximum distance
+
+        Returns:
+            tuple: position of query point, position of indexed point, distance
+        """
+        points = np.asarray(points, dtype=float)
+        k = min(topn, len(self.points))
+        if k == 0 or len(points) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+
+        if self.tree is not None:
+            upper = np.inf if max_dist is None else np.nextafter(max_dist, np.inf) # scipy bound is exclusive
+            dist, positions = self.tree.query(points, k=k, distance_upper_bound=upper)
+            dist, positions = dist.reshape(len(points), k), positions.reshape(len(points), k)
+        else:
+            dist, positions = self._query_chunked(points, k)
+
+        is_valid = np.isfinite(dist)
+        if max_dist is not None:
+            is_valid &= dist <= max_dist
+        iquery, icol = np.nonzero(is_valid)
+        return iquery, positions[iquery, icol], dist[iquery, icol]
+
+
+def build_index(index, values, fun_diff=None):
+    """
+    Builds an index over values to look up candidates for top1 joins
+
+    Args:
+        index (str): 'length' see `LengthIndex`, 'qgram' see `QGramIndex`, 'bktree' see `BKTree`
+        values (list): list of values to index
+        fun_diff (function): difference function, only used by 'bktree'
+
+    Returns:
+        object: index with a `query(value, fun_diff_batch, topn, top_limit)` method
+    """
+    if index=='length':
+        return LengthIndex(values)
+    elif index=='qgram':
+        return QGramIndex(values)
+    elif index=='bktree':
+        return BKTree(values, fun_diff)
+    else:
+        raise ValueError("index needs to be one of 'length', 'qgram', 'bktree'")
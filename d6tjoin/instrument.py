@@ -0,0 +1,127 @@
+import logging
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('d6tjoin')
+
+_STAGE_COLUMNS = ['level', 'stage', 'seconds', 'pairs_generated', 'pairs_scored', 'pairs_pruned', 'rows', 'peak_mb']
+_SLOWEST_COLUMNS = ['level', 'left', 'right', 'diff', 'seconds']
+
+
+# ******************************************
+# profile
+# ******************************************
+
+def _record(level, name):
+    return OrderedDict([('level', level), ('stage', name), ('seconds', np.nan), ('pairs_generated', 0), ('pairs_scored', 0), ('pairs_pruned', 0), ('rows', 0), ('peak_mb', np.nan)])
+
+
+class JoinProfile(object):
+    """
+    Opt-in instrumentation of joins. Records wall time, candidate pairs, output rows and optionally peak memory for each stage and fuzzy level, logged to the 'd6tjoin' logger at INFO level.
+
+    Args:
+        trace_memory (bool): trace peak memory of python and numpy allocations with `tracemalloc`, slows down python code. Workers of multicore joins are not traced
+        nsamples (int): difference function calls timed after each scoring stage, on random candidate pairs
+        nslowest (int): slowest timed difference function calls to keep
+
+    Note:
+        * stages: 'candidates' finds unique keys and candidate pairs, 'scoring' applies the difference function, 'reduce' keeps the topn matches for each left value, 'merge' joins the payload columns
+        * one profile can be shared by several joins, `level` tells fuzzy keys apart
+
+    """
+
+    def __init__(self, trace_memory=False, nsamples=100, nslowest=5):
+        self.cfg_trace_memory = trace_memory
+        self.cfg_nsamples = nsamples
+        self.cfg_nslowest = nslowest
+        self.level = None
+        self.stages = []
+        self.slowest = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager which records one stage. Yields a dict to fill in 'pairs_generated', 'pairs_scored', 'pairs_pruned' and 'rows'
+        """
+        record = _record(self.level, name)
+        is_start_trace = self.cfg_trace_memory and not tracemalloc.is_tracing()
+        if is_start_trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if self.cfg_trace_memory and tracemalloc.is_tracing():
+                record['peak_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+            if is_start_trace:
+                tracemalloc.stop()
+            self.stages.append(record)
+            logger.info('%s %s: %.3fs, %d pairs generated, %d scored, %d pruned, %d rows', record['level'], name, record['seconds'], record['pairs_generated'], record['pairs_scored'], record['pairs_pruned'], record['rows'])
+
+    def sample_fun_diff(self, fun_diff, values_left, values_right, seed=0):
+        """
+        Times fun_diff on random (left, right) pairs and keeps the slowest calls
+
+        Args:
+            fun_diff (function): difference function `f(left, right)`
+            values_left (list): left values
+            values_right (list): right values
+        """
+        values_left, values_right = list(values_left), list(values_right)
+        if not self.cfg_nsamples or not values_left or not values_right:
+            return
+        rng = np.random.RandomState(seed)
+        for ileft, iright in zip(rng.randint(0, len(values_left), self.cfg_nsamples), rng.randint(0, len(values_right), self.cfg_nsamples)):
+            start = time.perf_counter()
+            diff = fun_diff(values_left[ileft], values_right[iright])
+            self.slowest.append((self.level, values_left[ileft], values_right[iright], diff, time.perf_counter() - start))
+        self.slowest = sorted(self.slowest, key=lambda x: -x[-1])[:self.cfg_nslowest]
+        for level, left, right, diff, seconds in self.slowest:
+            logger.debug('%s slow fun_diff(%r, %r)=%s: %.6fs', level, left, right, diff, seconds)
+
+    def to_frame(self):
+        """
+        Returns:
+            dataframe: one row per stage
+        """
+        return pd.DataFrame(self.stages, columns=_STAGE_COLUMNS)
+
+    def slowest_frame(self):
+        """
+        Returns:
+            dataframe: slowest timed difference function calls
+        """
+        return pd.DataFrame(self.slowest, columns=_SLOWEST_COLUMNS)
+
+    def __repr__(self):
+        return repr(self.to_frame())
+
+
+def to_profile(profile):
+    """
+    Profile from True, a `JoinProfile` or None/False for no instrumentation
+    """
+    if profile is None or profile is False or isinstance(profile, JoinProfile):
+        return profile or None
+    if profile is True:
+        return JoinProfile()
+    raise ValueError('profile needs to be True or a JoinProfile')
+
+
+@contextmanager
+def stage(profile, name):
+    """
+    `JoinProfile.stage` if profile is not None, else yields a record which gets discarded
+    """
+    if profile is None:
+        yield _record(None, name)
+    else:
+        with profile.stage(name) as record:
+            yield record
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+from d6tjoin.distance import factorize
+
+
+# ******************************************
+# steps
+# ******************************************
+
+def _lower(values):
+    return values.str.lower()
+
+
+def _strip_punctuation(values):
+    return values.str.replace(r'[^\w\s]', '', regex=True)
+
+
+def _collapse_whitespace(values):
+    return values.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def _unicode_fold(values):
+    # decompose accented characters, drop the accents and fold case
+    return values.str.normalize('NFKD').str.replace('[\u0300-\u036f]', '', regex=True).str.casefold()
+
+
+# named normalization steps, vectorized over a series of strings
+NORMALIZE_STEPS = {
+    'lower': _lower,
+    'strip_punctuation': _strip_punctuation,
+    'collapse_whitespace': _collapse_whitespace,
+    'unicode_fold': _unicode_fold,
+}
+
+
+# ******************************************
+# normalizer
+# ******************************************
+
+class Normalizer(object):
+    """
+    Normalizes join keys before computing differences, eg to ignore case and punctuation. Normalized values are memoized across calls.
+
+    Args:
+        steps (list): steps applied in order. Names in `NORMALIZE_STEPS` are vectorized and only change strings, functions `f(value)->value` get called once for each unique value
+
+    """
+
+    def __init__(self, steps):
+        if not isinstance(steps, (list, tuple)):
+            steps = [steps]
+        for step in steps:
+            if not callable(step) and step not in NORMALIZE_STEPS:
+                raise ValueError('Normalization steps need to be functions or one of %s' % sorted(NORMALIZE_STEPS))
+        self.steps = list(steps)
+        self.memo = {}
+
+    def _apply(self, values):
+        values = pd.Series(values, dtype=object)
+        for step in self.steps:
+            if callable(step):
+                values = pd.Series([step(v) for v in values], index=values.index, dtype=object)
+            else:
+                is_str = values.map(type) == str
+                values[is_str] = NORMALIZE_STEPS[step](values[is_str])
+        return values.values
+
+    def __call__(self, values):
+        """
+        Normalizes values
+
+        Args:
+            values (list): values to normalize
+
+        Returns:
+            np.array: normalized values, same length as values
+        """
+        codes, uniques = factorize(list(values))
+        uniques_new = [v for v in uniques if v not in self.memo]
+        self.memo.update(zip(uniques_new, self._apply(uniques_new)))
+        normalized = np.empty(len(uniques), dtype=object)
+        normalized[:] = [self.memo[v] for v in uniques]
+        return normalized[codes]
+
+
+def to_normalizer(normalize):
+    """
+    Normalizer from a list of steps, a single step or a `Normalizer`, None for no normalization
+    """
+    if normalize is None or isinstance(normalize, Normalizer):
+        return normalize
+    return Normalizer(normalize)
@@ -0,0 +1,127 @@
+from collections import OrderedDict
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from d6tjoin.utils import _block_codes
+
+# rough peak memory, measured with tracemalloc on the respective code paths
+_BYTES_PER_PAIR = 56 # materialized candidate pair as codes: codes, difference, match type and reduction
+_BYTES_PER_PAIR_EXACT_KEY = 64 # each exact key column of materialized candidates in blocks
+_BYTES_PER_PAIR_OBJECT = 160 # materialized candidate pair of python values, see `d6tjoin.smart_join.apply_gen_candidates`
+_BYTES_PER_VALUE = 512 # unique key in streamed or sorted scoring: values, index and topn results
+
+STRATEGIES = ('allpairs', 'allpairs objects', 'stream', 'merge_asof')
+
+
+# ******************************************
+# estimates
+# ******************************************
+
+def count_pairs(df_left, df_right, by_left, by_right, key_left, key_right, is_exact_excluded=True):
+    """
+    Candidate pairs of each unique left key from unique key counts by block of exact keys. Cheap compared to generating candidates
+
+    Args:
+        df_left (dataframe): left dataframe
+        df_right (dataframe): right dataframe
+        by_left (list): exact keys, left dataframe
+        by_right (list): exact keys, right dataframe
+        key_left (str): fuzzy key, left dataframe
+        key_right (str): fuzzy key, right dataframe
+        is_exact_excluded (bool): left values with an exact match in their block have no candidates
+
+    Returns:
+        tuple: unique left keys with columns '__block__', '__exact__', '__pairs__'; number of unique right values by block
+    """
+    keys_left = df_left[by_left+[key_left]].dropna().drop_duplicates()
+    keys_right = df_right[by_right+[key_right]].dropna().drop_duplicates()
+    codes_left, codes_right = _block_codes(keys_left, keys_right, by_left, by_right)
+    nblocks = int(max(codes_left.max(initial=-1), codes_right.max(initial=-1)))+1
+    nright = np.bincount(codes_right, minlength=nblocks)
+
+    is_exact = pd.MultiIndex.from_arrays([codes_left, keys_left[key_left].values]).isin(pd.MultiIndex.from_arrays([codes_right, keys_right[key_right].values]))
+    keys_left = keys_left.reset_index(drop=True)
+    keys_left['__block__'] = codes_left
+    keys_left['__exact__'] = is_exact
+    keys_left['__pairs__'] = nright[codes_left]
+    if is_exact_excluded:
+        keys_left.loc[is_exact, '__pairs__'] = 0
+    return keys_left, nright
+
+
+def estimate_memory(strategy, nleft, nright, npairs, topn=1, nexact_keys=0):
+    """
+    Rough peak memory of a top1 join in bytes
+
+    Args:
+        strategy (str): one of `STRATEGIES`. 'allpairs' scores all candidate pairs at once, 'allpairs objects' as python values, 'stream' scores left values in chunks and keeps the running topn, 'merge_asof' sorted search for numbers
+        nleft (int): unique left values
+        nright (int): unique right values
+        npairs (int): candidate pairs
+        topn (int): matches kept for each left value
+        nexact_keys (int): exact key columns of materialized candidates
+
+    Returns:
+        float: bytes
+    """
+    if strategy == 'allpairs':
+        return float(npairs)*(_BYTES_PER_PAIR + nexact_keys*_BYTES_PER_PAIR_EXACT_KEY)
+    elif strategy == 'allpairs objects':
+        return float(npairs)*(_BYTES_PER_PAIR_OBJECT + nexact_keys*_BYTES_PER_PAIR_EXACT_KEY)
+    elif strategy == 'stream':
+        return float(nleft*topn + nright)*_BYTES_PER_VALUE
+    elif strategy == 'merge_asof':
+        return float(nleft + nright)*_BYTES_PER_VALUE
+    raise ValueError('strategy needs to be one of %s' % (STRATEGIES,))
+
+
+def _chunk_ids(weights, max_weight):
+    # consecutive chunks with a total weight of about max_weight, a single heavy value gets its own chunk
+    before = np.cumsum(weights) - weights
+    ids = np.floor(before/max_weight).astype(int)
+    return np.unique(ids, return_inverse=True)[1] if len(ids) else ids
+
+
+def plan_chunks(df_counts, nright, strategy, topn=1, nexact_keys=0, memory_budget=None):
+    """
+    Summarizes the size of a join and splits left values into chunks which fit memory_budget
+
+    Args:
+        df_counts (dataframe): unique left keys, see `count_pairs`
+        nright (np.array): unique right values by block, see `count_pairs`
+        strategy (str): see `estimate_memory`
+        memory_budget (float): maximum bytes for one pass, None for one pass
+
+    Returns:
+        tuple: plan (dict), chunk of each unique left key (np.array)
+    """
+    nleft, npairs = len(df_counts), int(df_counts['__pairs__'].sum())
+    nright_total = int(nright.sum())
+    memory = estimate_memory(strategy, nleft, nright_total, npairs, topn, nexact_keys)
+    chunk_ids = np.zeros(nleft, dtype=int)
+
+    if memory_budget and memory > memory_budget:
+        if strategy in ('allpairs', 'allpairs objects'):
+            bytes_per_pair = estimate_memory(strategy, 0, 0, 1, topn, nexact_keys)
+            chunk_ids = _chunk_ids(df_counts['__pairs__'].values, max(memory_budget/bytes_per_pair, 1))
+        else:
+            memory_fixed = estimate_memory(strategy, 0, nright_total, 0, topn, nexact_keys)
+            if memory_fixed >= memory_budget:
+                warnings.warn('memory_budget is below the estimated memory for right values, joining in one pass')
+            else:
+                bytes_per_left = estimate_memory(strategy, 1, 0, 0, topn, nexact_keys)
+                chunk_ids = _chunk_ids(np.ones(nleft), max((memory_budget-memory_fixed)//bytes_per_left, 1))
+
+    plan = OrderedDict([
+        ('strategy', strategy),
+        ('blocks', int((nright > 0).sum())),
+        ('left uniques', nleft),
+        ('left exact', int(df_counts['__exact__'].sum())),
+        ('right uniques', nright_total),
+        ('candidate pairs', npairs),
+        ('peak memory MB', memory/2**20),
+        ('chunks', int(chunk_ids.max())+1 if nleft else 1),
+    ])
+    return plan, chunk_ids
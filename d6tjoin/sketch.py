@@ -0,0 +1,239 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15) # odd constant which spreads hashes of earlier key columns before combining
+_SKETCH_CHUNKSIZE = 2**18 # rows hashed at once, bounds memory of hashing
+
+
+# ******************************************
+# sketches
+# ******************************************
+
+class KeySketch(object):
+    """
+    Mergeable sketch of the unique values of a join key, HyperLogLog registers and the k smallest hashes (bottom-k MinHash)
+
+    Args:
+        p (int): 2**p HyperLogLog registers, relative standard error 1.04/sqrt(2**p)
+        k (int): smallest hashes kept, standard error of overlap fractions sqrt(f*(1-f)/k)
+
+    Note:
+        * memory is 2**p bytes plus 8*k bytes regardless of input size, 24KB with the defaults
+        * sketches of partitions merge into the sketch of all rows, see `merge`
+
+    """
+
+    def __init__(self, p=14, k=1024):
+        if not 4 <= p <= 18:
+            raise ValueError('p needs to be between 4 and 18')
+        self.cfg_p = p
+        self.cfg_k = k
+        self.registers = np.zeros(2**p, dtype=np.uint8)
+        self.mins = np.array([], dtype=np.uint64)
+
+    def update(self, hashes):
+        """
+        Adds 64 bit hashes of key values, see `hash_keys`
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return self
+
+        # register of the first p bits keeps the max position of the first 1 bit of the remaining bits
+        idx = (hashes >> np.uint64(64-self.cfg_p)).astype(np.intp)
+        w = (hashes << np.uint64(self.cfg_p)) | np.uint64(1 << (self.cfg_p-1))
+        rank = 65 - np.frexp(w.astype(np.float64))[1]
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+        # k smallest unique hashes
+        if len(self.mins) == self.cfg_k:
+            hashes = hashes[hashes < self.mins[-1]]
+        hashes = pd.unique(hashes)
+        if len(hashes) > self.cfg_k:
+            hashes = np.partition(hashes, self.cfg_k-1)[:self.cfg_k]
+        self.mins = np.union1d(self.mins, hashes)[:self.cfg_k].astype(np.uint64)
+        return self
+
+    def merge(self, other):
+        """
+        Sketch of the values of both sketches
+        """
+        if (self.cfg_p, self.cfg_k) != (other.cfg_p, other.cfg_k):
+            raise ValueError('can only merge sketches with the same p and k')
+        merged = KeySketch(self.cfg_p, self.cfg_k)
+        merged.registers = np.maximum(self.registers, other.registers)
+        merged.mins = np.union1d(self.mins, other.mins)[:self.cfg_k].astype(np.uint64)
+        return merged
+
+    def is_exact(self):
+        return len(self.mins) < self.cfg_k
+
+    def count(self):
+        """
+        Estimated number of unique values
+        """
+        if self.is_exact():
+            return float(len(self.mins))
+        m = float(2**self.cfg_p)
+        alpha = 0.7213/(1+1.079/m)
+        estimate = alpha*m*m/np.sum(np.ldexp(1., -self.registers.astype(int)))
+        nzeros = np.count_nonzero(self.registers==0)
+        if estimate <= 2.5*m and nzeros:
+            estimate = m*np.log(m/nzeros) # linear counting for small cardinalities
+        return float(estimate)
+
+    def stderr(self):
+        """
+        Standard error of `count`
+        """
+        return 0. if self.is_exact() else 1.04/np.sqrt(2**self.cfg_p)*self.count()
+
+    def __repr__(self):
+        return 'KeySketch(p=%d, k=%d, count~%d)' % (self.cfg_p, self.cfg_k, self.count())
+
+
+# ******************************************
+# hashing
+# ******************************************
+
+def _hash_values(values):
+    # numbers hash as float64 so int and float keys of both dataframes match, precision beyond 2**53 is lost
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return pd.util.hash_array(values.values.astype(np.float64))
+    if values.dtype == object:
+        return pd.util.hash_array(values.values, categorize=False) # same hashes, skips factorizing each chunk
+    return pd.util.hash_pandas_object(values, index=False).values
+
+
+def _is_nan(values):
+    # float NaN, unlike None or NaT never equal in tuples of python values
+    is_nan = values.isnull().values
+    if values.dtype == object:
+        is_nan[is_nan] = [isinstance(v, float) for v in values.values[is_nan]]
+    elif not pd.api.types.is_float_dtype(values):
+        is_nan[:] = False
+    return is_nan
+
+
+def _mix(hashes):
+    # splitmix64 finalizer, tuples sharing some key values get independent hashes
+    hashes = (hashes ^ (hashes >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def hash_keys(dfg, keys):
+    """
+    64 bit hashes of join key values of each row. '__all__' hashes the tuple of all keys, tuples with float NaN go to '__all__ nan'
+
+    Args:
+        dfg (dataframe): rows
+        keys (list): join keys
+
+    Returns:
+        dict: hashes by key, '__all__' and '__all__ nan'
+    """
+    hashes = OrderedDict()
+    hash_all, is_nan = None, np.zeros(dfg.shape[0], dtype=bool)
+    for key in keys:
+        h, is_valid = _hash_values(dfg[key]), dfg[key].notnull().values
+        h_all = np.where(is_valid, h, np.uint64(0)) # all missing values alike, same as shared codes of stats_prejoin
+        hash_all = h_all if hash_all is None else (hash_all*_HASH_MIX) ^ h_all
+        hashes[key] = h[is_valid]
+        is_nan |= _is_nan(dfg[key])
+    hash_all = _mix(hash_all)
+    hashes['__all__'], hashes['__all__ nan'] = hash_all[~is_nan], hash_all[is_nan]
+    return hashes
+
+
+def sketch_keys(chunks, keys, p=14, k=1024):
+    """
+    Sketches of join keys, '__all__' and '__all__ nan' streaming over chunks of rows, see `hash_keys`
+
+    Args:
+        chunks (iterable): dataframes, eg `pd.read_csv(chunksize=)`, or a single dataframe which gets hashed in chunks
+        keys (list): join keys
+        p (int): see `KeySketch`
+        k (int): see `KeySketch`
+
+    Returns:
+        dict: `KeySketch` by key, '__all__' and '__all__ nan'
+    """
+    if isinstance(chunks, pd.DataFrame):
+        dfg_all = chunks
+        chunks = (dfg_all.iloc[i:i+_SKETCH_CHUNKSIZE] for i in range(0, max(dfg_all.shape[0], 1), _SKETCH_CHUNKSIZE))
+    sketches = OrderedDict((key, KeySketch(p, k)) for key in list(keys)+['__all__', '__all__ nan'])
+    for dfg in chunks:
+        for key, hashes in hash_keys(dfg, keys).items():
+            sketches[key].update(hashes)
+    return sketches
+
+
+def merge_sketches(sketches1, sketches2):
+    """
+    Merges sketches of two partitions by key, see `sketch_keys`
+    """
+    return OrderedDict((key, sketch.merge(sketches2[key])) for key, sketch in sketches1.items())
+
+
+# ******************************************
+# stats
+# ******************************************
+
+def estimate_keyset(sketch_left, sketch_right):
+    """
+    Estimated prejoin stats of one join key from sketches of both dataframes
+
+    Returns:
+        tuple: counts and their standard errors as dicts with keys 'left', 'right', 'inner', 'outer', 'unmatched total', 'unmatched left', 'unmatched right'
+    """
+    union = sketch_left.merge(sketch_right)
+    is_left = np.isin(union.mins, sketch_left.mins, assume_unique=True)
+    is_right = np.isin(union.mins, sketch_right.mins, assume_unique=True)
+    nsample = max(len(union.mins), 1)
+    nouter, err_outer = union.count(), union.stderr()
+
+    counts, errors = OrderedDict(), OrderedDict()
+    counts['left'], errors['left'] = sketch_left.count(), sketch_left.stderr()
+    counts['right'], errors['right'] = sketch_right.count(), sketch_right.stderr()
+    counts['outer'], errors['outer'] = nouter, err_outer
+    for k, is_sel in [('inner', is_left & is_right), ('unmatched total', is_left ^ is_right), ('unmatched left', is_left & ~is_right), ('unmatched right', ~is_left & is_right)]:
+        f = np.count_nonzero(is_sel)/float(nsample)
+        counts[k] = f*nouter
+        errors[k] = 0. if union.is_exact() else np.sqrt(f*(1-f)/nsample*nouter**2 + (f*err_outer)**2)
+    return counts, errors
+
+
+def _add_unmatched(counts, errors, sketch_left, sketch_right):
+    # tuples which only count on their own side, errors add up as independent
+    for k, sketches in [('left', [sketch_left]), ('right', [sketch_right]), ('outer', [sketch_left, sketch_right]), ('unmatched total', [sketch_left, sketch_right]), ('unmatched left', [sketch_left]), ('unmatched right', [sketch_right])]:
+        counts[k] += sum(s.count() for s in sketches)
+        errors[k] = np.sqrt(errors[k]**2 + sum(s.stderr()**2 for s in sketches))
+
+
+def stats_sketches(sketches_left, sketches_right, keys):
+    """
+    Approximate prejoin stats table from sketches of both dataframes, see `d6tjoin.utils.PreJoin.stats_prejoin`
+
+    Args:
+        sketches_left (dict): sketches by key of the left dataframe, see `sketch_keys`
+        sketches_right (dict): sketches by key of the right dataframe
+        keys (list): [left key, right key] by join level, '__all__' gets added
+
+    Returns:
+        dataframe: same columns as `stats_prejoin` with estimated counts, then standard errors of the counts
+    """
+    cols = ['inner','left','right','outer','unmatched total','unmatched left','unmatched right']
+    df_out = []
+    for key_left, key_right in list(keys)+[['__all__','__all__']]:
+        counts, errors = estimate_keyset(sketches_left[key_left], sketches_right[key_right])
+        if key_left == '__all__':
+            _add_unmatched(counts, errors, sketches_left['__all__ nan'], sketches_right['__all__ nan'])
+        df_key = OrderedDict([('key left', key_left), ('key right', key_right), ('all matched', counts['unmatched total']==0)])
+        df_key.update((k, int(round(counts[k]))) for k in cols)
+        df_key.update((k+' stderr', errors[k]) for k in cols)
+        df_out.append(df_key)
+    return pd.DataFrame(df_out)
@@ -5,7 +5,12 @@ import itertools
 import warnings
 import jellyfish
 
-from d6tjoin.utils import BaseJoin
+from d6tjoin.utils import BaseJoin, filter_group_topn, gen_candidates, unique_keys_sorted, merge_asof_top1
+from d6tjoin.distance import get_fun_diff_batch, apply_fun_diff_batch, fun_diff_to_batch, has_length_bound, has_qgram_bound, is_str_values
+from d6tjoin.index import build_index
+from d6tjoin.top1 import _applyFunTop1Blocks
+from d6tjoin.instrument import to_profile, stage
+from d6tjoin.plan import count_pairs, estimate_memory, plan_chunks
 
 
 # ******************************************
@@ -16,37 +21,64 @@ def set_values(dfg, key):
     return v[~pd.isnull(v)]
 
 
-def apply_gen_candidates_group(dfg):
-    return pd.DataFrame(list(itertools.product(dfg['__top1left__'].values[0],dfg['__top1right__'].values[0])),columns=['__top1left__','__top1right__'])
-
-
 def apply_gen_candidates(set1, set2):
-    df_candidates = list(itertools.product(set1, set2))
-    df_candidates = pd.DataFrame(df_candidates,columns=['__top1left__','__top1right__'])
-
-    return df_candidates
-
-
-def diff_arithmetic(x,y):
-    return abs(x - y)
+    return gen_candidates(set1, set2)
 
 
-def diff_edit(a,b):
-    return jellyfish.levenshtein_distance(a,b)
+def apply_gen_candidates_index(values_left, values_right, fun_diff, top_limit=None, index='length', counts=None):
+    """
 
+    Generates scored candidates using an index over values_right, see `d6tjoin.index.build_index`. Pair counts get added to counts
 
-def filter_group_minmax(dfg, col):
+    """
+    fun_diff_batch = get_fun_diff_batch(fun_diff) or fun_diff_to_batch(fun_diff)
+    index = build_index(index, values_right, fun_diff)
+    ileft, iright, diffs = [], [], []
+    for i, v in enumerate(values_left):
+        positions, d = index.query(v, fun_diff_batch, 1, top_limit)
+        ileft.append(np.full(len(positions), i))
+        iright.append(positions)
+        diffs.append(d)
+
+    ileft, iright, diffs = np.concatenate(ileft or [[]]).astype(int), np.concatenate(iright or [[]]).astype(int), np.concatenate(diffs or [[]])
+    if counts is not None:
+        counts['pairs_generated'] += len(values_left)*len(values_right)
+        counts['pairs_scored'] += len(diffs)
+        counts['pairs_pruned'] += len(values_left)*len(values_right) - len(diffs)
+    order = np.lexsort((iright, ileft)) # same order as apply_gen_candidates
+    return pd.DataFrame({'__top1left__':values_left[ileft[order]],'__top1right__':values_right[iright[order]],'__top1diff__':diffs[order]})
+
+
+def apply_gen_candidates_blocks(df_keysets_groups, cfg_group, fun_diff, top_limit=None, index=None, counts=None):
     """
 
-    Returns all rows equal to min in col
+    Generates the closest candidates for each block of exact keys, see `d6tjoin.top1._applyFunTop1Blocks`. Left values with an exact match in any block only keep their exact matches. Pair counts get added to counts
 
     """
-    return dfg[dfg[col] == dfg[col].min()]
+    blocks = [(v1[~pd.isnull(v1)], v2[~pd.isnull(v2)]) for v1, v2 in zip(df_keysets_groups['__top1left__'].values, df_keysets_groups['__top1right__'].values)]
+    is_exact = [pd.Series(v1).isin(v2).values for v1, v2 in blocks]
+    values_exact = set(itertools.chain.from_iterable(v1[e] for (v1, v2), e in zip(blocks, is_exact)))
+    blocks_fuzzy = [(v1[~pd.Series(v1).isin(values_exact).values], v2) for v1, v2 in blocks]
+
+    df_exact = pd.DataFrame([(iblock, v) for iblock, ((v1, v2), e) in enumerate(zip(blocks, is_exact)) for v in v1[e]], columns=['__block__','__top1left__'])
+    df_exact['__top1right__'] = df_exact['__top1left__']
+    df_fuzzy = _applyFunTop1Blocks(blocks_fuzzy, fun_diff, get_fun_diff_batch(fun_diff), 1, top_limit, index, counts=counts)
+
+    # same order as filtering all candidates: by left value, candidate order within left value
+    positions = [(dict((v, i) for i, v in enumerate(v1)), dict((v, i) for i, v in enumerate(v2))) for v1, v2 in blocks_fuzzy]
+    ileft = [positions[b][0][v] for b, v in zip(df_fuzzy['__block__'].values, df_fuzzy['__top1left__'].values)]
+    iright = [positions[b][1][v] for b, v in zip(df_fuzzy['__block__'].values, df_fuzzy['__top1right__'].values)]
+    df_fuzzy = df_fuzzy.iloc[np.lexsort((iright, ileft, df_fuzzy['__block__'].values.astype(int)))]
+    df_fuzzy = df_fuzzy.sort_values('__top1left__', kind='mergesort')
+
+    dfg = pd.concat([df_exact, df_fuzzy], ignore_index=True, sort=False)
+    dfg = pd.concat([df_keysets_groups[cfg_group].iloc[dfg['__block__'].values.astype(int)].reset_index(drop=True), dfg.drop(columns='__block__')], axis=1)
+    return dfg
 
 
-def prep_match_df(dfg):
-    dfg = dfg[['__top1left__', '__top1right__', '__top1diff__', '__match type__']]
-    return dfg
+def diff_arithmetic(x,y):
+    return abs(x - y)
+
 
 # ******************************************
 # fuzzy join
@@ -78,6 +110,9 @@ class FuzzyJoinTop1(BaseJoin):
                     * fun_diff: difference function or list of difference functions applied sequentially. Needs to be 0=similar and >0 dissimilar
                     * top_limit: maximum difference, keep only canidates with difference <= top_limit
                     * top_nrecords: keep only n top_nrecords, good for generating previews
+                    * direction: for numbers and dates with the default `pd.merge_asof`, 'nearest', 'backward' to match smaller or equal right values, 'forward' to match larger or equal right values
+                    * index: index over right values to skip candidates which can't be a top match when there are no exact keys. 'length' for edit distances, 'qgram' for Levenshtein distance with top_limit, 'bktree' for any integer valued metric, None to score all pairs. Default 'auto' picks 'length' for edit distances
+                    * memory_budget: maximum estimated peak memory in MB. Without exact keys and index, joins which would materialize more candidate pairs score left values in bounded chunks instead. See `explain`
 
         """
 
@@ -113,6 +148,7 @@ class FuzzyJoinTop1(BaseJoin):
         self.exact_how = exact_how
         self.set_fuzzy_how_all(fuzzy_how)
 
+        self.profile = None
         if init_merge:
             self.join()
         else:
@@ -161,7 +197,7 @@ class FuzzyJoinTop1(BaseJoin):
                 if cfg_top1['type'] == 'number':
                     cfg_top1['fun_diff'] = pd.merge_asof
                 elif cfg_top1['type'] == 'string':
-                    cfg_top1['fun_diff'] = diff_edit
+                    cfg_top1['fun_diff'] = jellyfish.levenshtein_distance
                 else:
                     raise ValueError('Unrecognized data type for top match, need to pass fun_diff in arguments')
             else:
@@ -178,6 +214,25 @@ class FuzzyJoinTop1(BaseJoin):
             if 'top_nrecords' not in cfg_top1:
                 cfg_top1['top_nrecords'] = None
 
+            if 'direction' not in cfg_top1:
+                cfg_top1['direction'] = 'nearest'
+            if cfg_top1['direction'] not in ('nearest', 'backward', 'forward'):
+                raise ValueError("direction needs to be one of 'nearest', 'backward', 'forward'")
+
+            if 'index' not in cfg_top1:
+                cfg_top1['index'] = 'auto'
+            if cfg_top1['index']=='auto':
+                cfg_top1['index'] = 'length' if has_length_bound(cfg_top1['fun_diff'][0]) else None
+            if cfg_top1['index'] not in ('length', 'qgram', 'bktree', None):
+                raise ValueError("index needs to be one of 'auto', 'length', 'qgram', 'bktree', None")
+            if cfg_top1['index']=='length' and not has_length_bound(cfg_top1['fun_diff'][0]):
+                raise ValueError("index='length' needs a difference function in d6tjoin.distance.FUN_DIFF_LENGTH_BOUND")
+            if cfg_top1['index']=='qgram' and (not has_qgram_bound(cfg_top1['fun_diff'][0]) or cfg_top1['top_limit'] is None):
+                raise ValueError("index='qgram' needs top_limit and a difference function in d6tjoin.distance.FUN_DIFF_QGRAM_BOUND")
+
+            if 'memory_budget' not in cfg_top1:
+                cfg_top1['memory_budget'] = None
+
             cfg_top1['dir'] = 'left'
 
             # save config
@@ -190,46 +245,55 @@ class FuzzyJoinTop1(BaseJoin):
         else:
             return self._gen_match_top1(ilevel)
 
-    def _gen_match_top1_left_number(self, cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords):
+    def _gen_match_top1_left_number(self, cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords, top_limit=None, direction='nearest'):
         if len(cfg_group_left) > 0:
 
-            # unique values
-            if top_nrecords is None:
-                # df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique())
-                df_keys_left = self.dfs[0].groupby(cfg_group_left)[keyleft].apply(lambda x: pd.Series(x.unique()))
-                df_keys_left.index = df_keys_left.index.droplevel(1)
-                df_keys_left = pd.DataFrame(df_keys_left)
-            else:
-                # df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique()[:top_nrecords])
-                df_keys_left = self.dfs[0].groupby(cfg_group_left)[keyleft].apply(lambda x: pd.Series(x.unique()[:top_nrecords]))
-                df_keys_left.index = df_keys_left.index.droplevel(1)
-                df_keys_left = pd.DataFrame(df_keys_left)
-            df_keys_right = self.dfs[1].groupby(cfg_group_right)[keyright].apply(lambda x: pd.Series(x.unique()))
-            df_keys_right.index = df_keys_right.index.droplevel(1)
-            df_keys_right = pd.DataFrame(df_keys_right)
-            # df_keys_right = pd.DataFrame(self.dfs[1].groupby(cfg_group_right)[keyright].unique())
-
-            # sort
-            df_keys_left = df_keys_left.sort_values(keyleft).reset_index().rename(columns={keyleft:'__top1left__'})
-            df_keys_right = df_keys_right.sort_values(keyright).reset_index().rename(columns={keyright:'__top1right__'})
-
-            df_match = pd.merge_asof(df_keys_left, df_keys_right, left_on='__top1left__', right_on='__top1right__', left_by=cfg_group_left, right_by=cfg_group_right, direction='nearest')
-        else:
-            # uniques
-            values_left = set_values(self.dfs[0], keyleft)
-            values_right = set_values(self.dfs[1], keyright)
+            # unique values, sorted
+            df_keys_left = unique_keys_sorted(self.dfs[0], cfg_group_left, keyleft, top_nrecords).rename(columns={keyleft:'__top1left__'})
+            df_keys_right = unique_keys_sorted(self.dfs[1], cfg_group_right, keyright).rename(columns={keyright:'__top1right__'})
 
-            if top_nrecords:
-                values_left = values_left[:top_nrecords]
+            df_match = merge_asof_top1(df_keys_left, df_keys_right, cfg_group_left, cfg_group_right, direction, top_limit)
+        else:
+            # uniques, sorted
+            df_keys_left = unique_keys_sorted(self.dfs[0], [], keyleft, top_nrecords if top_nrecords else None).rename(columns={keyleft:'__top1left__'})
+            df_keys_right = unique_keys_sorted(self.dfs[1], [], keyright).rename(columns={keyright:'__top1right__'})
 
-            df_keys_left = pd.DataFrame({'__top1left__':values_left}).sort_values('__top1left__')
-            df_keys_right = pd.DataFrame({'__top1right__':values_right}).sort_values('__top1right__')
+            df_match = merge_asof_top1(df_keys_left, df_keys_right, direction=direction, top_limit=top_limit)
 
-            df_match = pd.merge_asof(df_keys_left, df_keys_right, left_on='__top1left__', right_on='__top1right__', direction='nearest')
+        return df_match
 
-        df_match['__top1diff__'] = (df_match['__top1left__']-df_match['__top1right__']).abs()
+    def _gen_candidates_top1_left(self, cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords, fun_diff, top_limit=None, index=None, counts=None, memory_budget=None):
+        if len(cfg_group_left)>0:
+            # generate candidates if exact matches are present (= blocking index)
 
-        return df_match
+            if top_nrecords is None:
+                df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique())
+            else:
+                df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique()[:top_nrecords])
+            df_keys_right = pd.DataFrame(self.dfs[1].groupby(cfg_group_right)[keyright].unique())
+            df_keysets_groups = df_keys_left.merge(df_keys_right,left_index=True, right_index=True)
+            df_keysets_groups.columns = ['__top1left__','__top1right__']
+            # blocks are independent, score them in parallel for first diff function
+            return apply_gen_candidates_blocks(df_keysets_groups.reset_index(), cfg_group_left, fun_diff, top_limit, index, counts)
+
+        # generate candidates if NO exact matches
+        values_left = set_values(self.dfs[0],keyleft)
+        values_right = set_values(self.dfs[1],keyright)
+
+        if top_nrecords is not None:
+            values_left = values_left[:top_nrecords]
+
+        if index and is_str_values(values_left) and is_str_values(values_right):
+            # only score candidates which can be the closest match for first diff function
+            return apply_gen_candidates_index(values_left, values_right, fun_diff, top_limit, index, counts)
+        if memory_budget and estimate_memory('allpairs objects', 0, 0, len(values_left)*len(values_right)) > memory_budget*2**20:
+            # all values in one block, scored in bounded chunks instead of materializing all pairs
+            df_keysets_groups = pd.DataFrame({'__top1left__':[values_left], '__top1right__':[values_right]})
+            return apply_gen_candidates_blocks(df_keysets_groups, [], fun_diff, top_limit, None, counts)
+        dfg = apply_gen_candidates(values_left,values_right)
+        if counts is not None:
+            counts['pairs_generated'] += len(dfg)
+        return dfg
 
     def _gen_match_top1(self, ilevel, top_nrecords=None):
         """
@@ -251,6 +315,8 @@ class FuzzyJoinTop1(BaseJoin):
 
         keyleft = self.keys_fuzzy[ilevel][0]
         keyright = self.keys_fuzzy[ilevel][1]
+        if self.profile is not None:
+            self.profile.level = keyleft
 
         #******************************************
         # table LEFT
@@ -263,30 +329,9 @@ class FuzzyJoinTop1(BaseJoin):
 
             if cfg_top1['type'] == 'string' or (cfg_top1['type'] == 'number' and cfg_top1['fun_diff'] != [pd.merge_asof]):
 
-                if len(cfg_group_left)>0:
-                    # generate candidates if exact matches are present (= blocking index)
-
-                    if top_nrecords is None:
-                        df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique())
-                    else:
-                        df_keys_left = pd.DataFrame(self.dfs[0].groupby(cfg_group_left)[keyleft].unique()[:top_nrecords])
-                    df_keys_right = pd.DataFrame(self.dfs[1].groupby(cfg_group_right)[keyright].unique())
-                    df_keysets_groups = df_keys_left.merge(df_keys_right,left_index=True, right_index=True)
-                    df_keysets_groups.columns = ['__top1left__','__top1right__']
-                    dfg = df_keysets_groups.reset_index().groupby(cfg_group_left).apply(apply_gen_candidates_group)
-                    dfg = dfg.reset_index(-1,drop=True).reset_index()
-                    dfg = dfg.dropna()
-
-                else:
-                    # generate candidates if NO exact matches
-                    values_left = set_values(self.dfs[0],keyleft)
-                    values_right = set_values(self.dfs[1],keyright)
-
-                    if top_nrecords is None:
-                        dfg = apply_gen_candidates(values_left,values_right)
-                    else:
-                        dfg = apply_gen_candidates(values_left[:top_nrecords], values_right)
-
+                with stage(self.profile, 'candidates') as record:
+                    dfg = self._gen_candidates_top1_left(cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords, fun_diff[0], top_limit, cfg_top1['index'], record, cfg_top1['memory_budget'])
+                    record['rows'] = len(dfg)
 
                 # find exact matches and remove from candidates
                 # todo: use set logic before generating candidates
@@ -298,26 +343,39 @@ class FuzzyJoinTop1(BaseJoin):
                 idxSel = dfg['__top1left__'].isin(df_match_exact['__top1left__'])
                 dfg = dfg[~idxSel]
 
-                for fun_diff in cfg_top1['fun_diff']:
-                    dfg['__top1diff__'] = dfg.apply(lambda x: fun_diff(x['__top1left__'], x['__top1right__']), axis=1)
-
-                    # filtering
-                    if not top_limit is None:
-                        dfg = dfg[dfg['__top1diff__'] <= top_limit]
-
-                    # get top 1
-                    dfg = dfg.groupby('__top1left__',group_keys=False).apply(lambda x: filter_group_minmax(x,'__top1diff__'))
+                for ifun, fun_diff in enumerate(cfg_top1['fun_diff']):
+                    with stage(self.profile, 'scoring') as record:
+                        fun_diff_batch = get_fun_diff_batch(fun_diff)
+                        if ifun==0 and '__top1diff__' in dfg:
+                            pass # already scored during candidate generation
+                        elif fun_diff_batch and is_str_values(dfg['__top1left__'].values) and is_str_values(dfg['__top1right__'].values):
+                            dfg['__top1diff__'] = apply_fun_diff_batch(dfg['__top1left__'].values, dfg['__top1right__'].values, fun_diff_batch)
+                            record['pairs_generated'] = record['pairs_scored'] = len(dfg)
+                        else:
+                            dfg['__top1diff__'] = dfg.apply(lambda x: fun_diff(x['__top1left__'], x['__top1right__']), axis=1)
+                            record['pairs_generated'] = record['pairs_scored'] = len(dfg)
+                        record['rows'] = len(dfg)
+                    if self.profile is not None:
+                        self.profile.sample_fun_diff(fun_diff, dfg['__top1left__'].values, dfg['__top1right__'].values)
+
+                    with stage(self.profile, 'reduce') as record:
+                        # filtering
+                        if not top_limit is None:
+                            dfg = dfg[dfg['__top1diff__'] <= top_limit]
+
+                        # get top 1
+                        dfg = filter_group_topn(dfg, '__top1left__', '__top1diff__')
+                        record['rows'] = len(dfg)
 
                 # return results
                 dfg['__match type__'] = 'top1 left'
                 df_match = pd.concat([dfg,df_match_exact])
 
             elif cfg_top1['type'] == 'number' and cfg_top1['fun_diff'] == [pd.merge_asof]:
-                df_match = self._gen_match_top1_left_number(cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords).copy()
-
-                # filtering
-                if not top_limit is None:
-                    df_match = df_match[df_match['__top1diff__'] <= top_limit]
+                # filtered by top_limit
+                with stage(self.profile, 'scoring') as record:
+                    df_match = self._gen_match_top1_left_number(cfg_group_left, cfg_group_right, keyleft, keyright, top_nrecords, top_limit, cfg_top1['direction']).copy()
+                    record['rows'] = len(df_match)
 
                 df_match['__match type__'] = 'top1 left'
                 df_match.loc[df_match['__top1left__'] == df_match['__top1right__'], '__match type__'] = 'exact'
@@ -336,12 +394,57 @@ class FuzzyJoinTop1(BaseJoin):
         return {'key left':keyleft, 'key right':keyright,
                 'table':df_match,'has duplicates':df_match.groupby('__top1left__').size().max()>1}
 
+    def _plan_level(self, ilevel):
+        cfg_top1 = self.fuzzy_how[ilevel]
+        keyleft = self.keys_fuzzy[ilevel][0]
+        keyright = self.keys_fuzzy[ilevel][1]
+        cfg_group_left = self.keysdf_exact[0] if self.keysdf_exact else []
+        cfg_group_right = self.keysdf_exact[1] if self.keysdf_exact else []
+
+        # mirrors the branches of _gen_match_top1 and _gen_candidates_top1_left
+        df_counts, nright = count_pairs(self.dfs[0], self.dfs[1], cfg_group_left, cfg_group_right, keyleft, keyright, is_exact_excluded=len(cfg_group_left)>0)
+        if cfg_top1['type'] == 'number' and cfg_top1['fun_diff'] == [pd.merge_asof]:
+            strategy, index = 'merge_asof', 'sorted'
+        elif len(cfg_group_left)>0 or (cfg_top1['index'] and cfg_top1['type'] == 'string'):
+            strategy, index = 'stream', cfg_top1['index']
+        else:
+            strategy, index = 'allpairs objects', None
+            if cfg_top1['memory_budget'] and estimate_memory(strategy, 0, 0, df_counts['__pairs__'].sum()) > cfg_top1['memory_budget']*2**20:
+                strategy = 'stream'
+
+        plan = plan_chunks(df_counts, nright, strategy, nexact_keys=len(cfg_group_left))[0]
+        if strategy == 'merge_asof':
+            plan['candidate pairs'] = plan['left uniques']
+        plan['index'] = index
+        return plan
+
+    def explain(self):
+        """
+        Estimates each fuzzy join level from unique key counts by exact key block without generating candidates
+
+        Returns:
+            dataframe: one row per fuzzy key. 'strategy' 'allpairs objects' materializes all candidate pairs, 'stream' scores in chunks and keeps the closest matches, 'merge_asof' sorted search for numbers. 'blocks', unique keys, 'candidate pairs' scored without an index and 'peak memory MB' estimate
+        """
+        plans = [self._plan_level(ilevel) for ilevel in range(self.cfg_njoins_fuzzy)]
+        return pd.DataFrame(plans, index=pd.Index([k[0] for k in self.keys_fuzzy], name='key'))
+
     def run_match_top1_all(self, cfg_top1=None):
 
         for ilevel in range(self.cfg_njoins_fuzzy):
             self.table_fuzzy[ilevel] = self._gen_match_top1(ilevel)
 
-    def join(self, is_keep_debug=False):
+    def join(self, is_keep_debug=False, profile=None):
+        """
+        Joins dataframes on exact and best matching fuzzy keys
+
+        Args:
+            is_keep_debug (bool): keep diagnostics columns, good for debugging
+            profile (bool or JoinProfile): record time, candidate pairs and memory by stage and fuzzy key in `self.profile`, see `d6tjoin.instrument.JoinProfile`
+
+        Returns:
+            dataframe: joined dataframe
+        """
+        self.profile = to_profile(profile)
         if self.cfg_njoins_fuzzy==0:
             self.dfjoined = self.dfs[0].merge(self.dfs[1], left_on=self.keysdf_exact[0], right_on=self.keysdf_exact[1], how=self.exact_how)
         else:
@@ -350,19 +453,23 @@ class FuzzyJoinTop1(BaseJoin):
 
             cfg_group_left = self.keysdf_exact[0] if self.keysdf_exact else []
             cfg_group_right = self.keysdf_exact[1] if self.keysdf_exact else []
-            self.dfjoined = self.dfs[0]
-            for ilevel in range(self.cfg_njoins_fuzzy):
-                keyleft = self.keys_fuzzy[ilevel][0]
-                keyright = self.keys_fuzzy[ilevel][1]
-                dft = self.table_fuzzy[ilevel]['table'].copy()
-                dft.columns = [s + keyleft if s.startswith('__') else s for s in dft.columns]
-                self.dfjoined = self.dfjoined.merge(dft, left_on=cfg_group_left+[keyleft], right_on=cfg_group_left+['__top1left__'+keyleft])
-                pass
-
-            cfg_keys_left = cfg_group_left+['__top1right__'+k for k in self.keysdf_fuzzy[0]]
-            cfg_keys_right = cfg_group_right+[k for k in self.keysdf_fuzzy[1]]
-
-            self.dfjoined = self.dfjoined.merge(self.dfs[1], left_on = cfg_keys_left, right_on = cfg_keys_right, suffixes=['','__right__'])
+            if self.profile is not None:
+                self.profile.level = None
+            with stage(self.profile, 'merge') as record:
+                self.dfjoined = self.dfs[0]
+                for ilevel in range(self.cfg_njoins_fuzzy):
+                    keyleft = self.keys_fuzzy[ilevel][0]
+                    keyright = self.keys_fuzzy[ilevel][1]
+                    dft = self.table_fuzzy[ilevel]['table'].copy()
+                    dft.columns = [s + keyleft if s.startswith('__') else s for s in dft.columns]
+                    self.dfjoined = self.dfjoined.merge(dft, left_on=cfg_group_left+[keyleft], right_on=cfg_group_left+['__top1left__'+keyleft])
+                    pass
+
+                cfg_keys_left = cfg_group_left+['__top1right__'+k for k in self.keysdf_fuzzy[0]]
+                cfg_keys_right = cfg_group_right+[k for k in self.keysdf_fuzzy[1]]
+
+                self.dfjoined = self.dfjoined.merge(self.dfs[1], left_on = cfg_keys_left, right_on = cfg_keys_right, suffixes=['','__right__'])
+                record['rows'] = len(self.dfjoined)
 
             if not is_keep_debug:
                 self.dfjoined = self.dfjoined[self.dfjoined.columns[~self.dfjoined.columns.str.startswith('__')]]
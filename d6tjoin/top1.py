@@ -2,11 +2,27 @@ import pandas as pd
 import numpy as np
 from collections import OrderedDict
 import itertools
+import copy
 import warnings
 import jellyfish
 from joblib import Parallel, delayed
 import multiprocessing
 
+from d6tjoin.distance import factorize, to_str_array, get_fun_diff_batch, apply_fun_diff_batch, apply_fun_diff_batch_codes, apply_fun_diff_bounded, has_bounded_batch, fun_diff_to_batch, has_length_bound, has_qgram_bound, is_str_values
+from d6tjoin.index import build_index, PointIndex, _topn_threshold
+from d6tjoin.utils import filter_group_topn, gen_candidates, gen_candidates_blocks, gen_nearest_blocks, unique_keys_sorted, merge_asof_top1, _block_codes
+from d6tjoin.cache import DiffCache, fun_fingerprint
+from d6tjoin.normalize import to_normalizer
+from d6tjoin.instrument import to_profile, stage
+from d6tjoin.plan import count_pairs, plan_chunks
+
+_MULTICORE_MIN_PAIRS = 100000 # below that many pairs process pool overhead outweighs the speedup
+_MULTICORE_CHUNKS_PER_JOB = 4 # more chunks than cores for load balancing
+_STREAM_CHUNKSIZE = 65536 # right values scored at once when streaming
+_STREAM_PROBESIZE = 256 # right values scored first to bound differences of the remaining values
+_MATCHTYPE = pd.CategoricalDtype(['exact', 'top1 left']) # '__matchtype__' values
+_EARTH_RADIUS_KM = 6371.0088 # mean earth radius for haversine distances
+
 # ******************************************
 # helpers
 # ******************************************
@@ -16,32 +32,267 @@ def _set_values(dfg, key):
     return set(v)
 
 
-def _filter_group_min(dfg, col, topn=1):
+def _select_topn(diffs, topn=1, top_limit=None):
     """
 
-    Returns all rows equal to min in col
+    Returns positions and values of the topn smallest differences, including ties
 
     """
+    diffs = pd.Series(diffs)
+    if top_limit:
+        diffs = diffs[diffs <= top_limit]
     if topn==1:
-        return dfg[dfg[col] == dfg[col].min()]
+        diffs = diffs[diffs == diffs.min()]
     else:
-        return dfg[dfg[col].isin(np.sort(dfg[col].unique())[:topn])]
+        diffs = diffs[diffs.isin(np.sort(diffs.unique())[:topn])]
+    return diffs.index.values, diffs.values
+
+
+def _to_array(values):
+    values = list(values)
+    return pd.Series(values, dtype=None if values else object).values
+
+
+def _matchtype(matchtype, n):
+    return pd.Categorical.from_codes(np.full(n, _MATCHTYPE.categories.get_loc(matchtype), dtype=np.int8), dtype=_MATCHTYPE)
+
+
+def _factorize_shared(*values):
+    """
+
+    Encodes values as int32 codes into one shared vocabulary. The vocabulary is sorted if possible so codes group in the same order as values
+
+    Returns:
+         tuple: list of codes for each of values, vocabulary
+
+    """
+    values = [pd.Series(_to_array(v)).astype(object) for v in values]
+    values_all = pd.concat(values, ignore_index=True).values
+    try:
+        codes, vocab = factorize(values_all, sort=True)
+    except TypeError: # not sortable
+        codes, vocab = factorize(values_all)
+    bounds = np.cumsum([0]+[len(v) for v in values])
+    return [codes[i:j].astype(np.int32) for i, j in zip(bounds[:-1], bounds[1:])], vocab
+
+
+def _apply_unique(values, fun):
+    """
+
+    Applies fun once for each unique value
+
+    """
+    codes, uniques = factorize(list(values))
+    return _to_array([fun(v) for v in uniques])[codes]
+
+
+def _decode_codes(df, vocab, cols=('__top1left__', '__top1right__')):
+    return df.assign(**dict((c, _to_array(vocab[df[c].values.astype(int)])) for c in cols))
+
+
+def _to_shared_array(values):
+    """
+
+    Converts values to an array joblib can memmap into worker processes, see `d6tjoin.distance.to_str_array`
+
+    """
+    values = list(values)
+    if is_str_values(values):
+        return to_str_array(values)
+    return _to_array(values)
+
+
+def _chunk_bounds(n, nchunks):
+    bounds = np.unique(np.linspace(0, n, max(min(n, nchunks),1)+1).astype(int))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _apply_fun_pairs(values1, values2, func):
+    return [func(v1, v2) for v1, v2 in zip(values1, values2)]
 
 
 def _applyFunMulticore(values1, values2, func):
+    """
+
+    Applies func to aligned pairs of values on all cores. Pairs are dispatched in one chunk per task, not one task per pair
+
+    """
+    n_jobs = multiprocessing.cpu_count()
+    retLst = Parallel(n_jobs=n_jobs)(delayed(_apply_fun_pairs)(values1[i:j], values2[i:j], func) for i, j in _chunk_bounds(len(values1), n_jobs*_MULTICORE_CHUNKS_PER_JOB))
+    return list(itertools.chain.from_iterable(retLst))
+
+
+def _top1_stream(value, values_right, fun_diff_batch, topn=1, top_limit=None):
+    """
+
+    Scores value against values_right in bounded chunks, keeping only the running topn differences
+
+    Returns:
+         tuple: positions of topn values in values_right, differences
+
+    """
+    positions, diffs = np.zeros(0, dtype=int), None
+    best, threshold = np.zeros(0), np.inf if top_limit is None else top_limit
+    # a small first chunk gives bounded difference functions a best difference early
+    chunksize = _STREAM_PROBESIZE if has_bounded_batch(fun_diff_batch) else _STREAM_CHUNKSIZE
+    start = 0
+    while start < len(values_right):
+        d = apply_fun_diff_bounded(fun_diff_batch, value, values_right[start:start+chunksize], threshold)
+        p = np.arange(start, start+len(d))
+        best, threshold = _topn_threshold(best, d, topn, top_limit)
+        if diffs is not None:
+            p, d = np.concatenate([positions, p]), np.concatenate([diffs, d])
+        idx, diffs = _select_topn(d, topn, top_limit)
+        positions = p[idx]
+        start, chunksize = start+chunksize, _STREAM_CHUNKSIZE
+    return positions, diffs if diffs is not None else np.zeros(0)
+
+
+def _top1_chunk(values_left, values_right, fun_diff, fun_diff_batch=None, topn=1, top_limit=None, index_right=None):
+    """
+
+    Scores a chunk of left values against all right values and keeps the topn closest right values for each left value. Runs in worker processes
+
+    Returns:
+         tuple: arrays with position of left value in chunk, position of right value in values_right, difference. Number of pairs scored
+
+    """
+    fun_score = fun_diff_batch if fun_diff_batch else fun_diff_to_batch(fun_diff)
+
+    ileft, iright, diffs = [], [], []
+    npairs = 0
+    for i, v in enumerate(values_left):
+        if index_right is not None:
+            positions, d = index_right.query(v, fun_score, topn, top_limit)
+            npairs += len(d)
+            idx, d = _select_topn(d, topn, top_limit)
+            positions = positions[idx]
+        else:
+            positions, d = _top1_stream(v, values_right, fun_score, topn, top_limit)
+            npairs += len(values_right)
+        ileft.append(np.full(len(positions), i))
+        iright.append(positions)
+        diffs.append(d)
+    if not ileft:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0), npairs
+    return np.concatenate(ileft), np.concatenate(iright), np.concatenate(diffs), npairs
+
+
+def _prep_top1_values(values_left, values_right, fun_diff_batch=None, index=None):
+    """
+
+    Converts values to arrays for scoring. Batched difference functions and string indexes only apply if all values are strings
+
+    """
+    values_left, values_right = _to_array(values_left), _to_array(values_right)
+    shared_left, shared_right = _to_shared_array(values_left), _to_shared_array(values_right)
+    if not is_str_values(shared_left) or not is_str_values(shared_right):
+        fun_diff_batch = None
+        if index in ('length', 'qgram'):
+            index = None
+    return values_left, values_right, shared_left, shared_right, fun_diff_batch, index
+
+
+def _top1_task(values_left, values_right, fun_diff, fun_diff_batch=None, topn=1, top_limit=None, index=None, index_right=None):
+    """
+
+    Scores one task of `_applyFunTop1Blocks`, builds the index if the parent didn't. Runs in worker processes
+
+    """
+    if index and index_right is None:
+        index_right = build_index(index, values_right, fun_diff)
+    return _top1_chunk(values_left, values_right, fun_diff, fun_diff_batch, topn, top_limit, index_right)
+
+
+def _applyFunTop1Blocks(blocks, fun_diff, fun_diff_batch=None, topn=1, top_limit=None, index=None, use_multicore=True, counts=None):
+    """
+
+    Finds the topn closest right values for each left value within independent blocks, eg one block for each value of the exact join keys, on all cores. Large blocks are split into chunks of left values
+
+    Args:
+        blocks (list): list of (left values, right values) tuples
+        counts (dict): adds candidate pairs to 'pairs_generated', pairs actually scored to 'pairs_scored' and pairs skipped by the index to 'pairs_pruned', eg a `d6tjoin.instrument.JoinProfile` stage record
+
+    Returns:
+         dataframe: columns '__block__' position of block in blocks,'__top1left__','__top1right__','__top1diff__'
+
+    """
+    top_limit = top_limit if top_limit else None
+    blocks = [_prep_top1_values(values_left, values_right, fun_diff_batch, index) for values_left, values_right in blocks]
+    npairs = np.array([len(b[0])*len(b[1]) for b in blocks], dtype=float)
+    n_jobs = multiprocessing.cpu_count() if use_multicore and npairs.sum()>=_MULTICORE_MIN_PAIRS else 1
+
+    # tasks: (block, start of left chunk, pairs, task)
+    task_pairs = max(npairs.sum()/(n_jobs*_MULTICORE_CHUNKS_PER_JOB), 1)
+    tasks = []
+    for iblock, (values_left, values_right, shared_left, shared_right, block_fun_diff_batch, block_index) in enumerate(blocks):
+        bounds = _chunk_bounds(len(values_left), int(np.ceil(npairs[iblock]/task_pairs)))
+        index_right = build_index(block_index, shared_right, fun_diff) if block_index and len(bounds)>1 else None
+        for i, j in bounds:
+            tasks.append((iblock, i, (j-i)*len(values_right), delayed(_top1_task)(shared_left[i:j], shared_right, fun_diff, block_fun_diff_batch, topn, top_limit, block_index, index_right)))
+    tasks = sorted(tasks, key=lambda t: -t[2])
+    retLst = Parallel(n_jobs=n_jobs)(t[3] for t in tasks)
+    if counts is not None:
+        nscored = sum(r[3] for r in retLst)
+        counts['pairs_generated'] += int(npairs.sum())
+        counts['pairs_scored'] += nscored
+        counts['pairs_pruned'] += int(npairs.sum()) - nscored
+
+    if not tasks:
+        return pd.DataFrame(columns=['__block__','__top1left__','__top1right__','__top1diff__'])
+    iblocks, lefts, rights, diffs = [], [], [], []
+    for (iblock, i, _, _), (ileft, iright, d, _) in sorted(zip(tasks, retLst), key=lambda t: t[0][:2]):
+        iblocks.append(np.full(len(ileft), iblock))
+        lefts.append(blocks[iblock][0][ileft+i])
+        rights.append(blocks[iblock][1][iright])
+        diffs.append(d)
+    return pd.DataFrame({'__block__':np.concatenate(iblocks), '__top1left__':np.concatenate(lefts), '__top1right__':np.concatenate(rights), '__top1diff__':np.concatenate(diffs)})
+
+
+def _applyFunTop1Chunked(values_left, values_right, fun_diff, fun_diff_batch=None, topn=1, top_limit=None, index=None, use_multicore=True):
+    """
 
-    retLst = Parallel(n_jobs=multiprocessing.cpu_count())(delayed(func)(p[0],p[1]) for p in zip(values1,values2))
-    return retLst
+    Finds the topn closest right values for each left value on all cores. Optionally only scores candidates from an index over the right values, see `MergeTop1Diff`
+
+    Returns:
+         dataframe: columns '__top1left__','__top1right__','__top1diff__'
+
+    """
+    df_diff = _applyFunTop1Blocks([(values_left, values_right)], fun_diff, fun_diff_batch, topn, top_limit, index, use_multicore)
+    return df_diff.drop(columns='__block__')
 
 class MergeTop1Diff(object):
     """
 
     Top1 minimum difference join. Mostly used for strings. Helper for `MergeTop1`.
 
+    Args:
+        df1 (dataframe): left dataframe onto which the right dataframe is joined
+        df2 (dataframe): right dataframe
+        fuzzy_left_on (str): join key for similarity match, left dataframe
+        fuzzy_right_on (str): join key for similarity match, right dataframe
+        fun_diff (function): difference function, lower is better
+        exact_left_on (list, default None): join keys for exact match, left dataframe
+        exact_right_on (list, default None): join keys for exact match, right dataframe
+        top_limit (float, default None): maximum difference. Batched Levenshtein distance only computes pairs up to top_limit or the best difference so far, see `d6tjoin.distance.levenshtein_codes_bounded`
+        topn (int): keep all matches with the topn smallest differences
+        fun_preapply (function): applied to key values before computing differences
+        fun_postapply (function): applied to key values after computing differences
+        normalize (list): normalization steps for string keys, see `d6tjoin.normalize.Normalizer`. Differences are computed between normalized keys, results keep the original keys
+        is_keep_debug (bool): keep diagnostics columns, good for debugging
+        use_multicore (bool): score on all cores
+        use_batch (bool): use batched difference function if available, see `d6tjoin.distance.FUN_DIFF_BATCH`
+        index (str): index over right values to skip candidates which can't be a top match. 'length' for edit distances, 'qgram' for Levenshtein distance with top_limit, 'bktree' for any integer valued metric, None to score all pairs. 'auto' picks 'length' for difference functions in `d6tjoin.distance.FUN_DIFF_LENGTH_BOUND`
+        stream (bool): score candidates in bounded chunks and keep only a running topn for each left value instead of materializing all candidate pairs. Memory stays O(left values x topn)
+        cache (DiffCache or str): persistent cache, see `d6tjoin.cache.DiffCache`, or path to its SQLite file. Only left values or key pairs not seen in previous runs get scored, left values seen with fewer right values only against the added right values. Functions are identified by their code and the values they depend on, see `d6tjoin.cache.fun_fingerprint`
+        profile (bool or JoinProfile): record time, candidate pairs and memory by stage, see `d6tjoin.instrument.JoinProfile`. Results of `merge` have it under 'profile'
+        memory_budget (float): maximum estimated peak memory in MB. Larger joins score left values in chunks which fit the budget, see `explain`
+
     """
 
     def __init__(self, df1, df2, fuzzy_left_on, fuzzy_right_on, fun_diff=None, exact_left_on=None, exact_right_on=None,
-                 top_limit=None, topn=1, fun_preapply = None, fun_postapply = None, is_keep_debug=False, use_multicore=True):
+                 top_limit=None, topn=1, fun_preapply = None, fun_postapply = None, normalize=None, is_keep_debug=False, use_multicore=True, use_batch=True,
+                 index='auto', stream=True, cache=None, profile=None, memory_budget=None):
 
         # check exact keys
         if not exact_left_on:
@@ -63,6 +314,15 @@ class MergeTop1Diff(object):
         if (fun_preapply and fun_postapply) and (not callable(fun_preapply) or not callable(fun_postapply)):
             raise ValueError('fun_preapply and fun_postapply needs to a function')
 
+        if index not in ('auto', 'length', 'qgram', 'bktree', None):
+            raise ValueError("index needs to be one of 'auto', 'length', 'qgram', 'bktree', None")
+        if index=='auto':
+            index = 'length' if has_length_bound(fun_diff) else None
+        if index=='length' and not has_length_bound(fun_diff):
+            raise ValueError("index='length' needs a difference function in d6tjoin.distance.FUN_DIFF_LENGTH_BOUND")
+        if index=='qgram' and (not has_qgram_bound(fun_diff) or not top_limit):
+            raise ValueError("index='qgram' needs top_limit and a difference function in d6tjoin.distance.FUN_DIFF_QGRAM_BOUND")
+
         # use blocking index?
         if not exact_left_on and not exact_right_on:
             self.cfg_is_block = False
@@ -82,12 +342,143 @@ class MergeTop1Diff(object):
         self.cfg_fun_diff = fun_diff
         self.cfg_fun_preapply = fun_preapply
         self.cfg_fun_postapply = fun_postapply
+        self.cfg_normalize = to_normalizer(normalize)
         self.cfg_top_limit = top_limit
         self.cfg_is_keep_debug = is_keep_debug
         self.cfg_topn = topn
         self.cfg_use_multicore = use_multicore
+        self.cfg_fun_diff_batch = get_fun_diff_batch(fun_diff) if use_batch else None
+        self.cfg_index = index
+        self.cfg_stream = stream
+        self.cfg_cache = DiffCache(cache) if isinstance(cache, str) else cache
+        self.cfg_profile = to_profile(profile)
+        self.cfg_memory_budget = memory_budget
+        if self.cfg_cache:
+            # once per join, fails early for functions which can't be fingerprinted
+            self._fingerprint_fun_diff = fun_fingerprint(self.cfg_fun_diff)
+            self._fingerprint_fun_preapply = fun_fingerprint(self.cfg_fun_preapply)
+
+    def _sample_fun_diff(self, values_left, values_right):
+        if self.cfg_profile is not None:
+            self.cfg_profile.sample_fun_diff(self.cfg_fun_diff, values_left, values_right)
+
+    def _apply_fun_diff(self, values1, values2):
+        if self.cfg_fun_diff_batch and is_str_values(values1) and is_str_values(values2):
+            return apply_fun_diff_batch(values1, values2, self.cfg_fun_diff_batch)
+        elif self.cfg_use_multicore:
+            return _applyFunMulticore(values1, values2, self.cfg_fun_diff)
+        else:
+            return [self.cfg_fun_diff(v1, v2) for v1, v2 in zip(values1, values2)]
+
+    def _apply_fun_diff_codes(self, codes1, codes2, vocab):
+        if self.cfg_normalize:
+            vocab = self.cfg_normalize(vocab)
+        if not (self.cfg_fun_diff_batch and is_str_values(vocab)):
+            return self._apply_fun_diff_cached(vocab[codes1], vocab[codes2])
+        if not self.cfg_cache:
+            # differences above top_limit get filtered anyway
+            return apply_fun_diff_batch_codes(codes1, vocab, codes2, vocab, self.cfg_fun_diff_batch, self.cfg_top_limit if self.cfg_top_limit else None)
+        # cached differences are exact so they can be reused with any top_limit
+        codes1, codes2 = np.asarray(codes1), np.asarray(codes2)
+        return self._apply_fun_diff_cached(vocab[codes1], vocab[codes2], lambda idx: apply_fun_diff_batch_codes(codes1[idx], vocab, codes2[idx], vocab, self.cfg_fun_diff_batch))
+
+    def _apply_fun_diff_cached(self, values1, values2, fun_apply=None):
+        """
 
-    def _allpairs_candidates(self):
+        Looks up differences of pairs in the cache and only scores pairs not in cache, with fun_apply(positions of pairs) if given
+
+        """
+        if not self.cfg_cache:
+            return self._apply_fun_diff(values1, values2)
+        if fun_apply is None:
+            fun_apply = lambda idx: self._apply_fun_diff(np.asarray(values1)[idx], np.asarray(values2)[idx])
+
+        fingerprint = self._fingerprint_fun_diff
+        pairs = list(zip(values1, values2))
+        cached = self.cfg_cache.get_pairs(fingerprint, pairs)
+        idx_new = np.array([i for i, p in enumerate(pairs) if p not in cached], dtype=int)
+        diffs_new = fun_apply(idx_new) if len(idx_new) else []
+        diffs_new = dict(zip([pairs[i] for i in idx_new], diffs_new))
+        self.cfg_cache.set_pairs(fingerprint, diffs_new)
+        cached.update(diffs_new)
+        return _to_array([cached[p] for p in pairs])
+
+    def _cache_fingerprint(self, topn):
+        return '|'.join([self._fingerprint_fun_diff, self._fingerprint_fun_preapply, str(topn), repr(self.cfg_top_limit if self.cfg_top_limit else None)])
+
+    def _top1_blocks(self, blocks, topn, counts=None):
+        """
+
+        Finds topn matches for each block of (left values, right values), see `_applyFunTop1Blocks`. Normalized values get scored, matches keep the original values
+
+        """
+        if not self.cfg_normalize:
+            return self._top1_blocks_cached(blocks, topn, counts)
+
+        blocks = [(list(values_left), list(values_right)) for values_left, values_right in blocks]
+        blocks_normalized = [(self.cfg_normalize(values_left), self.cfg_normalize(values_right)) for values_left, values_right in blocks]
+        df_diff = self._top1_blocks_cached([(pd.unique(values_left), pd.unique(values_right)) for values_left, values_right in blocks_normalized], topn, counts)
+        if df_diff.empty:
+            return df_diff
+
+        def to_frame(side, values, values_normalized):
+            dfs = [pd.DataFrame({'__block__': iblock, side: v, '__raw__': r}) for iblock, (v, r) in enumerate(zip(values_normalized, values))]
+            return pd.concat(dfs, ignore_index=True).drop_duplicates()
+        df_left = to_frame('__top1left__', [b[0] for b in blocks], [b[0] for b in blocks_normalized])
+        df_right = to_frame('__top1right__', [b[1] for b in blocks], [b[1] for b in blocks_normalized])
+        df_diff['__block__'] = df_diff['__block__'].astype(int)
+        df_diff = df_diff.merge(df_left, on=['__block__','__top1left__']).drop(columns='__top1left__').rename(columns={'__raw__':'__top1left__'})
+        df_diff = df_diff.merge(df_right, on=['__block__','__top1right__']).drop(columns='__top1right__').rename(columns={'__raw__':'__top1right__'})
+        return df_diff[['__block__','__top1left__','__top1right__','__top1diff__']]
+
+    def _top1_blocks_cached(self, blocks, topn, counts=None):
+        """
+
+        See `_top1_blocks`. With a cache only left values not seen before get scored, or only against right values added since
+
+        """
+        args = (self.cfg_fun_diff, self.cfg_fun_diff_batch, topn, self.cfg_top_limit, self.cfg_index, self.cfg_use_multicore, counts)
+        if not self.cfg_cache:
+            return _applyFunTop1Blocks(blocks, *args)
+
+        # score left values not in cache against all right values, cached left values only against added right values
+        blocks = [(list(values_left), list(values_right)) for values_left, values_right in blocks]
+        fingerprint = self._cache_fingerprint(topn)
+        cached = [self.cfg_cache.get_top1(fingerprint, values_left, values_right) for values_left, values_right in blocks]
+        blocks_new, owners = [], []
+        for iblock, ((values_left, values_right), c) in enumerate(zip(blocks, cached)):
+            blocks_new.append(([v for v in values_left if v not in c], values_right))
+            owners.append(iblock)
+            added = OrderedDict() # left values by right values added since they were cached
+            for v in values_left:
+                if v in c and c[v][1]:
+                    added.setdefault(id(c[v][1]), (c[v][1], []))[1].append(v)
+            for values_added, values_left_added in added.values():
+                blocks_new.append((values_left_added, values_added))
+                owners.append(iblock)
+        df_new = _applyFunTop1Blocks(blocks_new, *args)
+
+        matches = [OrderedDict((v, list(c[v][0]) if v in c else []) for v in values_left) for (values_left, values_right), c in zip(blocks, cached)] # also left values without match
+        for iblock, v1, v2, d in zip(df_new['__block__'].values, df_new['__top1left__'].values, df_new['__top1right__'].values, df_new['__top1diff__'].values):
+            matches[owners[int(iblock)]][v1].append((v2, d))
+        for (values_left, values_right), c, m in zip(blocks, cached, matches):
+            position = dict((v, i) for i, v in enumerate(values_right))
+            for v in values_left:
+                if v in c and c[v][1] and m[v]:
+                    rows = sorted(m[v], key=lambda r: position[r[0]])
+                    idx, _ = _select_topn([r[1] for r in rows], topn, self.cfg_top_limit)
+                    m[v] = [rows[i] for i in idx]
+            m_new = OrderedDict((v, r) for v, r in m.items() if v not in c or c[v][1])
+            if m_new:
+                self.cfg_cache.set_top1(fingerprint, values_right, m_new)
+
+        return pd.DataFrame([(iblock, v1, v2, d) for iblock, m in enumerate(matches) for v1, rows in m.items() for v2, d in rows], columns=['__block__','__top1left__','__top1right__','__top1diff__'])
+
+    def _top1_chunked(self, values_left, values_right, counts=None):
+        df_diff = self._top1_blocks([(values_left, values_right)], self.cfg_topn, counts)
+        return df_diff.drop(columns='__block__')
+
+    def _allpairs_values(self):
         values_left = _set_values(self.dfs[0], self.cfg_fuzzy_left_on)
         values_right = _set_values(self.dfs[1], self.cfg_fuzzy_right_on)
 
@@ -100,40 +491,89 @@ class MergeTop1Diff(object):
 
         # pre apply a function
         if self.cfg_fun_preapply:
-            values_left_fuzzy = [self.cfg_fun_preapply(v) for v in values_left_fuzzy]
-            values_right = [self.cfg_fun_preapply(v) for v in values_right]
+            values_left_fuzzy = _apply_unique(values_left_fuzzy, self.cfg_fun_preapply)
+            values_right = _apply_unique(values_right, self.cfg_fun_preapply)
 
-        df_candidates_fuzzy = list(itertools.product(values_left_fuzzy, values_right))
-        df_candidates_fuzzy = pd.DataFrame(df_candidates_fuzzy,columns=['__top1left__','__top1right__'])
-        df_candidates_fuzzy['__matchtype__'] = 'top1 left'
+        return values_left_exact, values_left_fuzzy, values_right
 
+    def _exact_candidates(self, values_left_exact):
         df_candidates_exact = pd.DataFrame({'__top1left__': list(values_left_exact)})
         df_candidates_exact['__top1right__'] = df_candidates_exact['__top1left__']
-        df_candidates_exact['__matchtype__'] = 'exact'
+        df_candidates_exact['__matchtype__'] = _matchtype('exact', len(df_candidates_exact))
+        return df_candidates_exact
 
-        df_candidates = df_candidates_exact.append(df_candidates_fuzzy, ignore_index=True)
+    def _allpairs_candidates_codes(self):
+        """
 
-        return df_candidates
+        All candidate pairs as int32 codes into a shared vocabulary of left and right values
 
-    def _top1_diff_noblock(self):
-        df_candidates = self._allpairs_candidates()
+        Returns:
+             tuple: candidates dataframe, vocabulary
 
-        idxSel = df_candidates['__matchtype__'] != 'exact'
-        if self.cfg_use_multicore:
-            df_candidates.loc[idxSel, '__top1diff__'] = _applyFunMulticore(df_candidates.loc[idxSel,'__top1left__'].values, df_candidates.loc[idxSel,'__top1right__'].values,self.cfg_fun_diff)
-        else:
-            df_candidates.loc[idxSel,'__top1diff__'] = df_candidates[idxSel].apply(lambda x: self.cfg_fun_diff(x['__top1left__'], x['__top1right__']), axis=1)
+        """
+        values_left_exact, values_left_fuzzy, values_right = self._allpairs_values()
+        (codes_exact, codes_fuzzy, codes_right), vocab = _factorize_shared(values_left_exact, values_left_fuzzy, values_right)
 
-        df_candidates.loc[~idxSel, '__top1diff__'] = 0
-        has_duplicates = False
+        df_candidates_fuzzy = gen_candidates(codes_fuzzy, codes_right)
+        df_candidates_fuzzy['__matchtype__'] = _matchtype('top1 left', len(df_candidates_fuzzy))
 
-        if self.cfg_fun_postapply:
-            df_candidates['__top1left__']=df_candidates['__top1left__'].apply(self.cfg_fun_postapply,1)
-            df_candidates['__top1right__']=df_candidates['__top1right__'].apply(self.cfg_fun_postapply,1)
+        df_candidates_exact = pd.DataFrame({'__top1left__': codes_exact, '__top1right__': codes_exact, '__matchtype__': _matchtype('exact', len(codes_exact))})
 
-        df_diff = df_candidates.groupby('__top1left__',group_keys=False).apply(lambda x: _filter_group_min(x,'__top1diff__',self.cfg_topn))
-        if self.cfg_top_limit:
-            df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
+        df_candidates = df_candidates_exact.append(df_candidates_fuzzy, ignore_index=True)
+
+        return df_candidates, vocab
+
+    def _allpairs_candidates(self):
+        df_candidates, vocab = self._allpairs_candidates_codes()
+        return _decode_codes(df_candidates, vocab)
+
+    def _top1_diff_noblock(self):
+        if self.cfg_use_multicore or self.cfg_index or self.cfg_stream or self.cfg_cache:
+            # score in chunks, only candidates from index, workers only return the topn candidates
+            with stage(self.cfg_profile, 'candidates') as record:
+                values_left_exact, values_left_fuzzy, values_right = self._allpairs_values()
+                record['rows'] = len(values_left_exact)+len(values_left_fuzzy)
+            with stage(self.cfg_profile, 'scoring') as record:
+                df_candidates_fuzzy = self._top1_chunked(values_left_fuzzy, values_right, record)
+                record['rows'] = len(df_candidates_fuzzy)
+            self._sample_fun_diff(values_left_fuzzy, values_right)
+            df_candidates_fuzzy['__matchtype__'] = _matchtype('top1 left', len(df_candidates_fuzzy))
+            df_candidates = self._exact_candidates(values_left_exact).append(df_candidates_fuzzy, ignore_index=True)
+            idxSel = df_candidates['__matchtype__'] != 'exact'
+            df_candidates.loc[~idxSel, '__top1diff__'] = 0
+            is_reduced = True
+            vocab = None
+        else:
+            # candidates as codes, values only decoded after scoring and reduction
+            with stage(self.cfg_profile, 'candidates') as record:
+                df_candidates, vocab = self._allpairs_candidates_codes()
+                idxSel = df_candidates['__matchtype__'] != 'exact'
+                record['pairs_generated'] = record['rows'] = int(idxSel.sum())
+            with stage(self.cfg_profile, 'scoring') as record:
+                df_candidates.loc[idxSel, '__top1diff__'] = self._apply_fun_diff_codes(df_candidates.loc[idxSel,'__top1left__'].values, df_candidates.loc[idxSel,'__top1right__'].values, vocab)
+                df_candidates.loc[~idxSel, '__top1diff__'] = 0
+                record['pairs_generated'] = record['pairs_scored'] = record['rows'] = int(idxSel.sum())
+            if self.cfg_profile is not None and idxSel.any(): # decoding samples costs time when not profiling
+                self._sample_fun_diff(vocab[df_candidates.loc[idxSel,'__top1left__'].values], vocab[df_candidates.loc[idxSel,'__top1right__'].values])
+            is_reduced = not self.cfg_fun_postapply
+
+        with stage(self.cfg_profile, 'reduce') as record:
+            if vocab is not None:
+                if is_reduced:
+                    df_candidates = filter_group_topn(df_candidates, '__top1left__', '__top1diff__', self.cfg_topn)
+                df_candidates = _decode_codes(df_candidates, vocab)
+
+            if self.cfg_fun_postapply:
+                df_candidates['__top1left__']=_apply_unique(df_candidates['__top1left__'].values, self.cfg_fun_postapply)
+                df_candidates['__top1right__']=_apply_unique(df_candidates['__top1right__'].values, self.cfg_fun_postapply)
+
+            if is_reduced and not self.cfg_fun_postapply:
+                df_diff = df_candidates # already topn for each left value
+            else:
+                df_diff = filter_group_topn(df_candidates, '__top1left__', '__top1diff__', self.cfg_topn)
+            if self.cfg_top_limit:
+                df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
+            record['rows'] = len(df_diff)
         has_duplicates = df_diff.groupby('__top1left__').size().max()>1
         if has_duplicates:
             warnings.warn('Top1 join for %s has duplicates' %self.cfg_fuzzy_left_on)
@@ -142,63 +582,89 @@ class MergeTop1Diff(object):
 
 
     def _merge_top1_diff_noblock(self):
-        df_diff, has_duplicates = self._top1_diff_noblock()
-        dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_fuzzy_left_on, right_on='__top1left__')
-        dfjoin = dfjoin.merge(self.dfs[1], left_on='__top1right__', right_on=self.cfg_fuzzy_right_on, suffixes=['','__right__'])
+        df_diff, has_duplicates = self.top1_diff()
+        with stage(self.cfg_profile, 'merge') as record:
+            dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_fuzzy_left_on, right_on='__top1left__')
+            dfjoin = dfjoin.merge(self.dfs[1], left_on='__top1right__', right_on=self.cfg_fuzzy_right_on, suffixes=['','__right__'])
+            record['rows'] = len(dfjoin)
 
         if not self.cfg_is_keep_debug:
             dfjoin = dfjoin[dfjoin.columns[~dfjoin.columns.str.startswith('__')]]
 
-        return {'merged':dfjoin, 'top1':df_diff, 'duplicates':has_duplicates}
+        return {'merged':dfjoin, 'top1':df_diff, 'duplicates':has_duplicates, 'profile':self.cfg_profile}
 
 
     def _top1_diff_withblock(self):
-
-        def apply_gen_candidates_group(dfg):
-            return pd.DataFrame(list(itertools.product(dfg['__top1left__'].values[0],dfg['__top1right__'].values[0])),columns=['__top1left__','__top1right__'])
-
-        # find key unique values
-        keysleft = self.dfs[0][self.cfg_exact_left_on+[self.cfg_fuzzy_left_on]].drop_duplicates().dropna()
-        keysright = self.dfs[1][self.cfg_exact_right_on+[self.cfg_fuzzy_right_on]].drop_duplicates().dropna()
-        keysleft = {tuple(x) for x in keysleft.values}
-        keysright = {tuple(x) for x in keysright.values}
-        values_left_exact = keysleft.intersection(keysright)
-        values_left_fuzzy = keysleft.difference(keysright)
-
-        df_keys_left_exact = pd.DataFrame(list(values_left_exact))
-        if not df_keys_left_exact.empty:
-            df_keys_left_exact.columns = self.cfg_exact_left_on+['__top1left__']
+        is_blocks = self.cfg_use_multicore or self.cfg_index or self.cfg_stream
+
+        with stage(self.cfg_profile, 'candidates') as record:
+            # find key unique values
+            keysleft = self.dfs[0][self.cfg_exact_left_on+[self.cfg_fuzzy_left_on]].drop_duplicates().dropna()
+            keysright = self.dfs[1][self.cfg_exact_right_on+[self.cfg_fuzzy_right_on]].drop_duplicates().dropna()
+            keysleft = {tuple(x) for x in keysleft.values}
+            keysright = {tuple(x) for x in keysright.values}
+            values_left_exact = keysleft.intersection(keysright)
+            values_left_fuzzy = keysleft.difference(keysright)
+
+            # tuples lose the column dtypes, empty frames would turn exact keys into objects
+            dtypes_left = self.dfs[0][self.cfg_exact_left_on+[self.cfg_fuzzy_left_on]].dtypes.values
+            df_keys_left_exact = pd.DataFrame(list(values_left_exact), columns=self.cfg_exact_left_on+['__top1left__'])
+            df_keys_left_exact = df_keys_left_exact.astype(dict(zip(df_keys_left_exact.columns, dtypes_left)))
             df_keys_left_exact['__top1right__']=df_keys_left_exact['__top1left__']
-            df_keys_left_exact['__matchtype__'] = 'exact'
-
-        df_keys_left_fuzzy = pd.DataFrame(list(values_left_fuzzy))
-        if not df_keys_left_fuzzy.empty:
-            df_keys_left_fuzzy.columns = self.cfg_exact_left_on+[self.cfg_fuzzy_left_on]
-
-        # fuzzy pair candidates
-        df_keys_left = pd.DataFrame(df_keys_left_fuzzy.groupby(self.cfg_exact_left_on)[self.cfg_fuzzy_left_on].unique())
-        df_keys_right = pd.DataFrame(self.dfs[1].groupby(self.cfg_exact_right_on)[self.cfg_fuzzy_right_on].unique())
-        df_keysets_groups = df_keys_left.merge(df_keys_right, left_index=True, right_index=True)
-        df_keysets_groups.columns = ['__top1left__', '__top1right__']
-        df_keysets_groups = df_keysets_groups.reset_index().groupby(self.cfg_exact_left_on).apply(apply_gen_candidates_group)
-        df_keysets_groups = df_keysets_groups.reset_index(-1, drop=True).reset_index()
-        df_keysets_groups = df_keysets_groups.dropna()
-
-        df_candidates = df_keysets_groups[['__top1left__', '__top1right__']].drop_duplicates()
-        if self.cfg_use_multicore:
-            df_candidates['__top1diff__'] = _applyFunMulticore(df_candidates['__top1left__'].values, df_candidates['__top1right__'].values, self.cfg_fun_diff)
-        else:
-            df_candidates['__top1diff__'] = df_candidates.apply(lambda x: self.cfg_fun_diff(x['__top1left__'], x['__top1right__']), axis=1)
-        df_candidates['__matchtype__'] = 'top1 left'
-
-        # calculate difference
-        df_diff = df_keysets_groups.merge(df_candidates, on=['__top1left__', '__top1right__'])
-
-        df_diff = df_diff.append(df_keys_left_exact)
-        df_diff['__top1diff__']=df_diff['__top1diff__'].fillna(0) # exact keys
-        df_diff = df_diff.groupby(self.cfg_exact_left_on+['__top1left__'],group_keys=False).apply(lambda x: _filter_group_min(x,'__top1diff__'))
-        if self.cfg_top_limit:
-            df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
+            df_keys_left_exact['__matchtype__'] = _matchtype('exact', len(df_keys_left_exact))
+
+            df_keys_left_fuzzy = pd.DataFrame(list(values_left_fuzzy), columns=self.cfg_exact_left_on+[self.cfg_fuzzy_left_on])
+            df_keys_left_fuzzy = df_keys_left_fuzzy.astype(dict(zip(df_keys_left_fuzzy.columns, dtypes_left)))
+
+            vocab = None
+            if is_blocks:
+                # blocks are independent, score them in parallel and only keep top1 for each block
+                df_keys_left = pd.DataFrame(df_keys_left_fuzzy.groupby(self.cfg_exact_left_on)[self.cfg_fuzzy_left_on].unique())
+                df_keys_right = pd.DataFrame(self.dfs[1].groupby(self.cfg_exact_right_on)[self.cfg_fuzzy_right_on].unique())
+                df_keys_right.index.names = self.cfg_exact_left_on # index merge joins on shared level names
+                df_keysets_groups = df_keys_left.merge(df_keys_right, left_index=True, right_index=True)
+                df_keysets_groups.columns = ['__top1left__', '__top1right__']
+                df_keysets_groups = df_keysets_groups.reset_index()
+                blocks = [(v1[~pd.isnull(v1)], v2[~pd.isnull(v2)]) for v1, v2 in zip(df_keysets_groups['__top1left__'].values, df_keysets_groups['__top1right__'].values)]
+                record['rows'] = len(keysleft)
+            else:
+                # fuzzy pair candidates as codes, values only decoded after scoring and reduction
+                df_keys_right = self.dfs[1][self.cfg_exact_right_on+[self.cfg_fuzzy_right_on]].dropna()
+                (codes_left, codes_right, codes_exact), vocab = _factorize_shared(df_keys_left_fuzzy[self.cfg_fuzzy_left_on], df_keys_right[self.cfg_fuzzy_right_on], df_keys_left_exact['__top1left__'])
+                df_keys_left_fuzzy[self.cfg_fuzzy_left_on], df_keys_right[self.cfg_fuzzy_right_on] = codes_left, codes_right
+                df_keys_left_exact['__top1left__'], df_keys_left_exact['__top1right__'] = codes_exact, codes_exact
+                df_keysets_groups = gen_candidates_blocks(df_keys_left_fuzzy, df_keys_right, self.cfg_exact_left_on, self.cfg_exact_right_on, self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on)
+                record['pairs_generated'] = record['rows'] = len(df_keysets_groups)
+
+        with stage(self.cfg_profile, 'scoring') as record:
+            if is_blocks:
+                df_diff = self._top1_blocks(blocks, 1, record)
+                df_diff = pd.concat([df_keysets_groups[self.cfg_exact_left_on].iloc[df_diff['__block__'].values.astype(int)].reset_index(drop=True), df_diff.drop(columns='__block__')], axis=1)
+                df_diff['__matchtype__'] = _matchtype('top1 left', len(df_diff))
+            else:
+                df_candidates = df_keysets_groups[['__top1left__', '__top1right__']].drop_duplicates()
+                df_candidates['__top1diff__'] = self._apply_fun_diff_codes(df_candidates['__top1left__'].values, df_candidates['__top1right__'].values, vocab)
+                df_candidates['__matchtype__'] = _matchtype('top1 left', len(df_candidates))
+
+                # calculate difference
+                df_diff = df_keysets_groups.merge(df_candidates, on=['__top1left__', '__top1right__'])
+                record['pairs_generated'], record['pairs_scored'] = len(df_keysets_groups), len(df_candidates)
+                record['pairs_pruned'] = len(df_keysets_groups)-len(df_candidates) # same pair in several blocks
+            record['rows'] = len(df_diff)
+        if self.cfg_profile is not None and is_blocks and blocks:
+            self._sample_fun_diff(np.concatenate([b[0] for b in blocks]), np.concatenate([b[1] for b in blocks]))
+        elif self.cfg_profile is not None and not is_blocks and len(df_candidates):
+            self._sample_fun_diff(vocab[df_candidates['__top1left__'].values], vocab[df_candidates['__top1right__'].values])
+
+        with stage(self.cfg_profile, 'reduce') as record:
+            df_diff = df_diff.append(df_keys_left_exact)
+            df_diff['__top1diff__']=df_diff['__top1diff__'].fillna(0) # exact keys
+            df_diff = filter_group_topn(df_diff, self.cfg_exact_left_on+['__top1left__'], '__top1diff__')
+            if vocab is not None:
+                df_diff = _decode_codes(df_diff, vocab)
+            if self.cfg_top_limit:
+                df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
+            record['rows'] = len(df_diff)
         has_duplicates = df_diff.groupby(self.cfg_exact_left_on+['__top1left__']).size().max()>1
 
         return df_diff, has_duplicates
@@ -206,18 +672,64 @@ class MergeTop1Diff(object):
 
     def _merge_top1_diff_withblock(self):
 
-        df_diff, has_duplicates = self._top1_diff_withblock()
+        df_diff, has_duplicates = self.top1_diff()
 
-        dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_exact_left_on+[self.cfg_fuzzy_left_on], right_on=self.cfg_exact_left_on+['__top1left__'])
-        # todo: add exact join keys
-        dfjoin = dfjoin.merge(self.dfs[1], left_on=self.cfg_exact_left_on+['__top1right__'], right_on=self.cfg_exact_right_on+[self.cfg_fuzzy_right_on], suffixes=['','__right__'])
+        with stage(self.cfg_profile, 'merge') as record:
+            dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_exact_left_on+[self.cfg_fuzzy_left_on], right_on=self.cfg_exact_left_on+['__top1left__'])
+            # todo: add exact join keys
+            dfjoin = dfjoin.merge(self.dfs[1], left_on=self.cfg_exact_left_on+['__top1right__'], right_on=self.cfg_exact_right_on+[self.cfg_fuzzy_right_on], suffixes=['','__right__'])
+            record['rows'] = len(dfjoin)
 
         if not self.cfg_is_keep_debug:
             dfjoin = dfjoin[dfjoin.columns[~dfjoin.columns.str.startswith('__')]]
 
-        return {'merged':dfjoin, 'top1':df_diff, 'duplicates':has_duplicates}
+        return {'merged':dfjoin, 'top1':df_diff, 'duplicates':has_duplicates, 'profile':self.cfg_profile}
+
+    def _strategy(self):
+        # mirrors the branches of _top1_diff_noblock and _top1_diff_withblock
+        if self.cfg_use_multicore or self.cfg_index or self.cfg_stream or (self.cfg_cache and not self.cfg_is_block):
+            return 'stream'
+        return 'allpairs'
+
+    def _plan(self):
+        df_counts, nright = count_pairs(self.dfs[0], self.dfs[1], self.cfg_exact_left_on, self.cfg_exact_right_on, self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on,
+                                        is_exact_excluded=self.cfg_is_block or self.cfg_topn==1)
+        memory_budget = self.cfg_memory_budget*2**20 if self.cfg_memory_budget else None
+        plan, chunk_ids = plan_chunks(df_counts, nright, self._strategy(), 1 if self.cfg_is_block else self.cfg_topn, len(self.cfg_exact_left_on), memory_budget)
+        plan['index'] = self.cfg_index
+        return plan, df_counts, chunk_ids
+
+    def explain(self):
+        """
+
+        Estimates the join from unique key counts by exact key block without generating candidates
+
+        Returns:
+             dict: 'strategy' 'allpairs' materializes all candidate pairs, 'stream' scores in chunks and keeps the running topn. 'blocks', unique keys, 'candidate pairs' scored without an index, 'peak memory MB' estimate and 'chunks' to fit memory_budget
+
+        """
+        return self._plan()[0]
+
+    def _top1_diff_chunks(self, df_counts, chunk_ids):
+        # top1 of each left value is independent of other left values, so joining left values in chunks gives the same result
+        cfg_keys_left = self.cfg_exact_left_on+[self.cfg_fuzzy_left_on]
+        dfs_diff, has_duplicates = [], False
+        for ichunk in range(chunk_ids.max()+1):
+            join = copy.copy(self)
+            join.dfs = [self.dfs[0].merge(df_counts.loc[chunk_ids==ichunk, cfg_keys_left], on=cfg_keys_left), self.dfs[1]]
+            join.cfg_memory_budget = None
+            df_diff, is_duplicates = join.top1_diff()
+            dfs_diff.append(df_diff)
+            has_duplicates = has_duplicates or is_duplicates
+        df_diff = pd.concat(dfs_diff, ignore_index=True)
+        df_diff['__matchtype__'] = df_diff['__matchtype__'].astype(_MATCHTYPE)
+        return df_diff, has_duplicates
 
     def top1_diff(self):
+        if self.cfg_memory_budget:
+            plan, df_counts, chunk_ids = self._plan()
+            if plan['chunks']>1:
+                return self._top1_diff_chunks(df_counts, chunk_ids)
         if self.cfg_is_block:
             return self._top1_diff_withblock()
         else:
@@ -238,10 +750,23 @@ class MergeTop1Number(object):
 
     Top1 minimum difference join for numbers. Helper for `MergeTop1`.
 
+    Args:
+        df1 (dataframe): left dataframe onto which the right dataframe is joined
+        df2 (dataframe): right dataframe
+        fuzzy_left_on (str): join key for nearest match, left dataframe
+        fuzzy_right_on (str): join key for nearest match, right dataframe
+        exact_left_on (list, default None): join keys for exact match, left dataframe
+        exact_right_on (list, default None): join keys for exact match, right dataframe
+        direction (str): 'nearest', 'backward' for right values smaller or equal, 'forward' for right values larger or equal
+        top_limit (float, default None): maximum difference
+        topn (int): keep all matches with the topn smallest differences, see `d6tjoin.utils.gen_nearest_blocks`. Top1 keeps one match for each left value
+        is_keep_debug (bool): keep diagnostics columns, good for debugging
+        profile (bool or JoinProfile): record time and rows by stage, see `d6tjoin.instrument.JoinProfile`
+
     """
 
     def __init__(self, df1, df2, fuzzy_left_on, fuzzy_right_on, exact_left_on=None, exact_right_on=None,
-                 direction='nearest', top_limit=None, is_keep_debug=False):
+                 direction='nearest', top_limit=None, topn=1, is_keep_debug=False, profile=None):
 
         # check exact keys
         if not exact_left_on:
@@ -272,67 +797,234 @@ class MergeTop1Number(object):
         self.cfg_exact_right_on = exact_right_on
         self.cfg_direction = direction
         self.cfg_top_limit = top_limit
+        self.cfg_topn = topn
         self.cfg_is_keep_debug = is_keep_debug
+        self.cfg_profile = to_profile(profile)
 
-    def _top1_diff_withblock(self):
+    def _top1_diff_topn(self):
+        df_diff = gen_nearest_blocks(self.dfs[0], self.dfs[1], self.cfg_exact_left_on, self.cfg_exact_right_on, self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on, self.cfg_topn, self.cfg_direction)
+        df_diff['__matchtype__'] = 'top1 left'
+        df_diff.loc[df_diff['__top1left__'] == df_diff['__top1right__'], '__matchtype__'] = 'exact'
+        df_diff['__matchtype__'] = df_diff['__matchtype__'].astype(_MATCHTYPE)
+        if self.cfg_top_limit:
+            df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
 
-        # unique values
-        df_keys_left = self.dfs[0].groupby(self.cfg_exact_left_on)[self.cfg_fuzzy_left_on].apply(lambda x: pd.Series(x.unique()))
-        df_keys_left.index = df_keys_left.index.droplevel(-1)
-        df_keys_left = pd.DataFrame(df_keys_left)
-        df_keys_right = self.dfs[1].groupby(self.cfg_exact_right_on)[self.cfg_fuzzy_right_on].apply(lambda x: pd.Series(x.unique()))
-        df_keys_right.index = df_keys_right.index.droplevel(-1)
-        df_keys_right = pd.DataFrame(df_keys_right)
+        return df_diff
 
-        # todo: global consolidation like with MergeTop1Diff
+    def _top1_diff_withblock(self):
 
-        # sort
-        df_keys_left = df_keys_left.sort_values(self.cfg_fuzzy_left_on).reset_index().rename(columns={self.cfg_fuzzy_left_on:'__top1left__'})
-        df_keys_right = df_keys_right.sort_values(self.cfg_fuzzy_right_on).reset_index().rename(columns={self.cfg_fuzzy_right_on:'__top1right__'})
+        # unique values, sorted
+        df_keys_left = unique_keys_sorted(self.dfs[0], self.cfg_exact_left_on, self.cfg_fuzzy_left_on).rename(columns={self.cfg_fuzzy_left_on:'__top1left__'})
+        df_keys_right = unique_keys_sorted(self.dfs[1], self.cfg_exact_right_on, self.cfg_fuzzy_right_on).rename(columns={self.cfg_fuzzy_right_on:'__top1right__'})
 
-        # merge
-        df_diff = pd.merge_asof(df_keys_left, df_keys_right, left_on='__top1left__', right_on='__top1right__', left_by=self.cfg_exact_left_on, right_by=self.cfg_exact_right_on, direction=self.cfg_direction)
-        df_diff['__top1diff__'] = (df_diff['__top1left__']-df_diff['__top1right__']).abs()
+        # merge, bounded by top_limit
+        df_diff = merge_asof_top1(df_keys_left, df_keys_right, self.cfg_exact_left_on, self.cfg_exact_right_on, self.cfg_direction, self.cfg_top_limit if self.cfg_top_limit else None)
         df_diff['__matchtype__'] = 'top1 left'
         df_diff.loc[df_diff['__top1left__'] == df_diff['__top1right__'], '__matchtype__'] = 'exact'
-        if self.cfg_top_limit:
-            df_diff = df_diff[df_diff['__top1diff__']<=self.cfg_top_limit]
+        df_diff['__matchtype__'] = df_diff['__matchtype__'].astype(_MATCHTYPE)
 
         return df_diff
 
     def _top1_diff_noblock(self):
-            # uniques
-            values_left = _set_values(self.dfs[0], self.cfg_fuzzy_left_on)
-            values_right = _set_values(self.dfs[1], self.cfg_fuzzy_right_on)
+            # uniques, sorted
+            df_keys_left = unique_keys_sorted(self.dfs[0], [], self.cfg_fuzzy_left_on).rename(columns={self.cfg_fuzzy_left_on:'__top1left__'})
+            df_keys_right = unique_keys_sorted(self.dfs[1], [], self.cfg_fuzzy_right_on).rename(columns={self.cfg_fuzzy_right_on:'__top1right__'})
 
-            # sort
-            df_keys_left = pd.DataFrame({'__top1left__':list(values_left)}).sort_values('__top1left__')
-            df_keys_right = pd.DataFrame({'__top1right__':list(values_right)}).sort_values('__top1right__')
-
-            # merge
-            df_diff = pd.merge_asof(df_keys_left, df_keys_right, left_on='__top1left__', right_on='__top1right__', direction=self.cfg_direction)
-            df_diff['__top1diff__'] = (df_diff['__top1left__']-df_diff['__top1right__']).abs()
+            # merge, bounded by top_limit
+            df_diff = merge_asof_top1(df_keys_left, df_keys_right, direction=self.cfg_direction, top_limit=self.cfg_top_limit if self.cfg_top_limit else None)
             df_diff['__matchtype__'] = 'top1 left'
             df_diff.loc[df_diff['__top1left__'] == df_diff['__top1right__'], '__matchtype__'] = 'exact'
+            df_diff['__matchtype__'] = df_diff['__matchtype__'].astype(_MATCHTYPE)
 
             return df_diff
 
     def top1_diff(self):
-        if self.cfg_is_block:
-            return self._top1_diff_withblock()
-        else:
-            return self._top1_diff_noblock()
+        # sorted search, one stage
+        with stage(self.cfg_profile, 'scoring') as record:
+            if self.cfg_topn>1:
+                df_diff = self._top1_diff_topn()
+            elif self.cfg_is_block:
+                df_diff = self._top1_diff_withblock()
+            else:
+                df_diff = self._top1_diff_noblock()
+            record['rows'] = len(df_diff)
+        return df_diff
+
+    def explain(self):
+        """
+
+        Estimates the join from unique key counts, sorted search looks at each unique key once. See `MergeTop1Diff.explain`
+
+        """
+        df_counts, nright = count_pairs(self.dfs[0], self.dfs[1], self.cfg_exact_left_on, self.cfg_exact_right_on, self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on, is_exact_excluded=False)
+        plan = plan_chunks(df_counts, nright, 'merge_asof', self.cfg_topn)[0]
+        plan['candidate pairs'] = plan['left uniques']*self.cfg_topn
+        plan['index'] = 'sorted'
+        return plan
 
     def merge(self):
         df_diff = self.top1_diff()
 
-        dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_exact_left_on+[self.cfg_fuzzy_left_on], right_on=self.cfg_exact_left_on+['__top1left__'])
-        dfjoin = dfjoin.merge(self.dfs[1], left_on=self.cfg_exact_left_on+['__top1right__'], right_on=self.cfg_exact_right_on+[self.cfg_fuzzy_right_on], suffixes=['','__right__'])
+        with stage(self.cfg_profile, 'merge') as record:
+            dfjoin = self.dfs[0].merge(df_diff, left_on=self.cfg_exact_left_on+[self.cfg_fuzzy_left_on], right_on=self.cfg_exact_left_on+['__top1left__'])
+            dfjoin = dfjoin.merge(self.dfs[1], left_on=self.cfg_exact_left_on+['__top1right__'], right_on=self.cfg_exact_right_on+[self.cfg_fuzzy_right_on], suffixes=['','__right__'])
+            record['rows'] = len(dfjoin)
 
         if not self.cfg_is_keep_debug:
             dfjoin = dfjoin[dfjoin.columns[~dfjoin.columns.str.startswith('__')]]
 
-        return {'merged': dfjoin, 'top1': df_diff, 'duplicates': None}
+        return {'merged': dfjoin, 'top1': df_diff, 'duplicates': None, 'profile': self.cfg_profile}
+
+def _to_points(df, metric='euclidean', weights=None):
+    """
+
+    Converts key columns to coordinates. Dates become seconds, (lat, lon) in degrees become unit vectors so chord distances order the same as great circle distances
+
+    """
+    coords = []
+    for col in df.columns:
+        values = df[col]
+        if values.dtype.kind == 'M':
+            values = (values - pd.Timestamp(0))/pd.Timedelta(seconds=1)
+        coords.append(values.values.astype(float))
+    coords = np.column_stack(coords) if coords else np.zeros((0, 0))
+    if metric == 'haversine':
+        lat, lon = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+        return np.column_stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)])
+    if weights is not None:
+        coords = coords*np.asarray(weights, dtype=float)
+    return coords
+
+
+class MergeTop1Points(object):
+    """
+
+    Top1 nearest neighbour join which treats several number or date keys as one point, eg (lat, lon) or (trade time, price). Right points are indexed for each block of exact keys, see `d6tjoin.index.PointIndex`. Helper for `MergeTop1`.
+
+    Args:
+        df1 (dataframe): left dataframe onto which the right dataframe is joined
+        df2 (dataframe): right dataframe
+        fuzzy_left_on (list): join keys for nearest match, left dataframe
+        fuzzy_right_on (list): join keys for nearest match, right dataframe
+        exact_left_on (list, default None): join keys for exact match, left dataframe
+        exact_right_on (list, default None): join keys for exact match, right dataframe
+        metric (str): 'euclidean' for weighted euclidean distance, 'haversine' for great circle distance in km between (lat, lon) keys in degrees
+        weights (list): euclidean only, multiplies each fuzzy key before computing distances. Dates are in seconds
+        top_limit (float, default None): maximum distance
+        topn (int): keep the topn nearest right points, ties are broken arbitrarily
+        is_keep_debug (bool): keep diagnostics columns, good for debugging
+
+    Note:
+        * '__top1left__' and '__top1right__' in the top1 table are tuples of fuzzy key values
+
+    """
+
+    def __init__(self, df1, df2, fuzzy_left_on, fuzzy_right_on, exact_left_on=None, exact_right_on=None,
+                 metric='euclidean', weights=None, top_limit=None, topn=1, is_keep_debug=False):
+
+        # check exact keys
+        if not exact_left_on:
+            exact_left_on = []
+        if not exact_right_on:
+            exact_right_on = []
+
+        if len(exact_left_on) != len(exact_right_on):
+            raise ValueError('Need to pass same number of exact keys')
+        if not isinstance(exact_left_on, (list)) or not isinstance(exact_right_on, (list)):
+            raise ValueError('Exact keys need to be a list')
+
+        # check fuzzy keys
+        if not isinstance(fuzzy_left_on, (list)) or not isinstance(fuzzy_right_on, (list)) or len(fuzzy_left_on) != len(fuzzy_right_on) or not fuzzy_left_on:
+            raise ValueError('Fuzzy keys need to be lists of the same length')
+        if metric not in ('euclidean', 'haversine'):
+            raise ValueError("metric needs to be one of 'euclidean', 'haversine'")
+        if metric == 'haversine' and (len(fuzzy_left_on) != 2 or weights is not None):
+            raise ValueError("metric='haversine' needs (lat, lon) fuzzy keys and no weights")
+        if weights is not None and len(weights) != len(fuzzy_left_on):
+            raise ValueError('weights need to have an entry for each fuzzy key')
+
+        # store data
+        self.dfs = [df1,df2]
+
+        # store config
+        self.cfg_fuzzy_left_on = fuzzy_left_on
+        self.cfg_fuzzy_right_on = fuzzy_right_on
+        self.cfg_exact_left_on = exact_left_on
+        self.cfg_exact_right_on = exact_right_on
+        self.cfg_metric = metric
+        self.cfg_weights = weights
+        self.cfg_top_limit = top_limit
+        self.cfg_topn = topn
+        self.cfg_is_keep_debug = is_keep_debug
+
+    def _max_dist(self):
+        if not self.cfg_top_limit:
+            return None
+        if self.cfg_metric == 'haversine': # great circle distance to chord of unit sphere
+            return 2*np.sin(min(self.cfg_top_limit/_EARTH_RADIUS_KM, np.pi)/2)
+        return self.cfg_top_limit
+
+    def _top1_points(self):
+        """
+
+        Returns:
+             tuple: unique left keys, unique right keys, position of left keys, position of right keys, distances
+
+        """
+        keys_left = self.dfs[0][self.cfg_exact_left_on+self.cfg_fuzzy_left_on].dropna().drop_duplicates()
+        keys_right = self.dfs[1][self.cfg_exact_right_on+self.cfg_fuzzy_right_on].dropna().drop_duplicates()
+        codes_left, codes_right = _block_codes(keys_left, keys_right, self.cfg_exact_left_on, self.cfg_exact_right_on)
+        points_left = _to_points(keys_left[self.cfg_fuzzy_left_on], self.cfg_metric, self.cfg_weights)
+        points_right = _to_points(keys_right[self.cfg_fuzzy_right_on], self.cfg_metric, self.cfg_weights)
+
+        # index right points for each block
+        order_left, order_right = np.argsort(codes_left, kind='mergesort'), np.argsort(codes_right, kind='mergesort')
+        blocks = np.unique(codes_left)
+        bounds_left = np.searchsorted(codes_left[order_left], np.append(blocks, np.inf))
+        bounds_right = np.searchsorted(codes_right[order_right], np.append(blocks, np.inf))
+        ilefts, irights, dists = [], [], []
+        for i in range(len(blocks)):
+            block_left = order_left[bounds_left[i]:bounds_left[i+1]]
+            block_right = order_right[bounds_right[i]:bounds_right[i+1]]
+            iquery, ipoint, d = PointIndex(points_right[block_right]).query(points_left[block_left], self.cfg_topn, self._max_dist())
+            ilefts.append(block_left[iquery])
+            irights.append(block_right[ipoint])
+            dists.append(d)
+        ileft = np.concatenate(ilefts) if ilefts else np.zeros(0, dtype=int)
+        iright = np.concatenate(irights) if irights else np.zeros(0, dtype=int)
+        dist = np.concatenate(dists) if dists else np.zeros(0)
+
+        if self.cfg_metric == 'haversine':
+            dist = 2*_EARTH_RADIUS_KM*np.arcsin(np.minimum(dist/2, 1))
+        return keys_left, keys_right, ileft, iright, dist
+
+    def _top1_frame(self, keys_left, keys_right, ileft, iright, dist):
+        df_diff = keys_left[self.cfg_exact_left_on].iloc[ileft].reset_index(drop=True)
+        df_diff['__top1left__'] = list(keys_left[self.cfg_fuzzy_left_on].iloc[ileft].itertuples(index=False, name=None))
+        df_diff['__top1right__'] = list(keys_right[self.cfg_fuzzy_right_on].iloc[iright].itertuples(index=False, name=None))
+        df_diff['__top1diff__'] = dist
+        df_diff['__matchtype__'] = pd.Categorical.from_codes((dist > 0).astype(np.int8), dtype=_MATCHTYPE)
+        return df_diff
+
+    def top1_diff(self):
+        return self._top1_frame(*self._top1_points())
+
+    def merge(self):
+        keys_left, keys_right, ileft, iright, dist = self._top1_points()
+        df_keys = keys_left.iloc[ileft].reset_index(drop=True)
+        for keyleft, keyright in zip(self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on):
+            df_keys['__top1right__'+keyleft] = keys_right[keyright].values[iright]
+        df_keys['__top1diff__'] = dist
+
+        cfg_right_left_on = self.cfg_exact_left_on+['__top1right__'+k for k in self.cfg_fuzzy_left_on]
+        dfjoin = self.dfs[0].merge(df_keys, on=self.cfg_exact_left_on+self.cfg_fuzzy_left_on)
+        dfjoin = dfjoin.merge(self.dfs[1], left_on=cfg_right_left_on, right_on=self.cfg_exact_right_on+self.cfg_fuzzy_right_on, suffixes=['','_right'])
+
+        if not self.cfg_is_keep_debug:
+            dfjoin = dfjoin[dfjoin.columns[~dfjoin.columns.str.startswith('__')]]
+
+        return {'merged': dfjoin, 'top1': self._top1_frame(keys_left, keys_right, ileft, iright, dist), 'duplicates': None}
+
 
 class MergeTop1(object):
     """
@@ -348,7 +1040,15 @@ class MergeTop1(object):
         exact_right_on (list, default None): join keys for exact match, right dataframe
         fun_diff (list, default None): list of difference functions to be applied for each fuzzy key
         top_limit (list, default None): list of values to cap similarity matches
+        direction (str): for numbers and dates, 'nearest', 'backward' to match smaller or equal right values, 'forward' to match larger or equal right values
+        normalize (list): normalization steps for string keys, see `d6tjoin.normalize.Normalizer`
         is_keep_debug (bool): keep diagnostics columns, good for debugging
+        use_multicore (bool): score on all cores
+        cache (DiffCache or str): persistent cache for string matches, see `d6tjoin.cache.DiffCache`, or path to its SQLite file
+        metric (str, default None): 'euclidean' or 'haversine' to match all fuzzy keys together as the nearest point instead of key by key, see `MergeTop1Points`. Can't be combined with fun_diff or direction
+        weights (list, default None): with metric='euclidean', multiplies each fuzzy key before computing distances
+        profile (bool or JoinProfile): record time, candidate pairs and memory by stage and fuzzy key, see `d6tjoin.instrument.JoinProfile`. Results have it under 'profile'
+        memory_budget (float): maximum estimated peak memory in MB for each string key, see `MergeTop1Diff`
 
     Note:
         * fun_diff: applies the difference function to find the best match with minimum distance
@@ -358,11 +1058,14 @@ class MergeTop1(object):
             * Needs to be a difference function so lower is better. For functions like Jaccard higher is better so you need to adjust for that
         * top_limit: Limits the number of matches to anything below that values. For example if two strings differ by 3 but top_limit is 2, that match will be ignored
             * for dates you can use `pd.offsets.Day(1)` or similar
+            * for numbers and dates it bounds the search as `pd.merge_asof` tolerance
+            * with metric a single maximum distance for the points, in km for 'haversine'
 
     """
 
     def __init__(self, df1, df2, fuzzy_left_on=None, fuzzy_right_on=None, exact_left_on=None, exact_right_on=None,
-                 fun_diff = None, top_limit=None, is_keep_debug=False, use_multicore=True):
+                 fun_diff = None, top_limit=None, direction='nearest', normalize=None, is_keep_debug=False, use_multicore=True, cache=None,
+                 metric=None, weights=None, profile=None, memory_budget=None):
 
 
         # todo: pass custom merge asof param
@@ -397,6 +1100,10 @@ class MergeTop1(object):
             raise ValueError('Need to pass exact keys for both or neither dataframe')
 
         # check custom params
+        if metric: # one limit on the distance between points
+            if fun_diff or direction != 'nearest':
+                raise ValueError('metric matches nearest points, fun_diff and direction are not supported')
+            top_limit_points, top_limit = top_limit, None
         if not top_limit:
             top_limit = [None,]*self.cfg_njoins_fuzzy
         if not fun_diff:
@@ -419,53 +1126,186 @@ class MergeTop1(object):
         self.cfg_exact_right_on = exact_right_on
         self.cfg_top_limit = top_limit
         self.cfg_fun_diff = fun_diff
+        self.cfg_direction = direction
+        self.cfg_normalize = to_normalizer(normalize) # shared by all levels, so keys get normalized once
         self.cfg_is_keep_debug = is_keep_debug
         self.cfg_use_multicore = use_multicore
+        self.cfg_cache = DiffCache(cache) if isinstance(cache, str) else cache
+        self.cfg_metric = metric
+        self.cfg_weights = weights
+        self.cfg_top_limit_points = top_limit_points if metric else None
+        self.cfg_profile = to_profile(profile)
+        self.cfg_memory_budget = memory_budget
+
+    def _join_level(self, ilevel, df_left, df_right, exact_left_on, exact_right_on):
+        keyleft = self.cfg_fuzzy_left_on[ilevel]
+        keyright = self.cfg_fuzzy_right_on[ilevel]
+        typeleft = self.dfs[0][keyleft].dtype
+
+        if self.cfg_fun_diff[ilevel]:
+            return MergeTop1Diff(df_left, df_right, keyleft, keyright, self.cfg_fun_diff[ilevel], exact_left_on, exact_right_on, top_limit=self.cfg_top_limit[ilevel], normalize=self.cfg_normalize, use_multicore=self.cfg_use_multicore, cache=self.cfg_cache, profile=self.cfg_profile, memory_budget=self.cfg_memory_budget)
+        else:
+            if typeleft == 'int64' or typeleft == 'float64' or typeleft == 'datetime64[ns]':
+                return MergeTop1Number(df_left, df_right, keyleft, keyright, exact_left_on, exact_right_on, direction=self.cfg_direction, top_limit=self.cfg_top_limit[ilevel], profile=self.cfg_profile)
+            elif typeleft == 'object' and type(self.dfs[0][keyleft].values[0])==str:
+                return MergeTop1Diff(df_left, df_right, keyleft, keyright, jellyfish.levenshtein_distance, exact_left_on, exact_right_on, top_limit=self.cfg_top_limit[ilevel], normalize=self.cfg_normalize, use_multicore=self.cfg_use_multicore, cache=self.cfg_cache, profile=self.cfg_profile, memory_budget=self.cfg_memory_budget)
+                # todo: handle duplicates
+            else:
+                raise ValueError('Unrecognized data type for top match, need to pass fun_diff in arguments')
 
-    def merge(self):
+    def _top1_diff_level(self, ilevel, df_left, df_right, exact_left_on, exact_right_on):
+        if self.cfg_profile is not None:
+            self.cfg_profile.level = self.cfg_fuzzy_left_on[ilevel]
+        join = self._join_level(ilevel, df_left, df_right, exact_left_on, exact_right_on)
+        if isinstance(join, MergeTop1Diff):
+            return join.top1_diff()[0]
+        return join.top1_diff()
+
+    def explain(self):
         """
 
-        Executes merge
+        Estimates each fuzzy key join from unique key counts without generating candidates, see `MergeTop1Diff.explain`. Later keys are also blocked by matches of previous keys, so their candidate pairs and memory are upper bounds
 
         Returns:
-             dict: keys 'merged' has merged dataframe, 'top1' has best matches by fuzzy_left_on. See example notebooks for details
+             dataframe: one row per fuzzy key
+
+        """
+        if self.cfg_metric:
+            raise NotImplementedError('explain is not available with metric')
+        plans = [self._join_level(ilevel, self.dfs[0], self.dfs[1], self.cfg_exact_left_on, self.cfg_exact_right_on).explain() for ilevel in range(self.cfg_njoins_fuzzy)]
+        return pd.DataFrame(plans, index=pd.Index(self.cfg_fuzzy_left_on, name='key'))
+
+    def _merge_levels(self, fun_top1_diff):
+        """
+
+        Joins best matches level by level, `fun_top1_diff(ilevel, dfjoined, exact_left_on, exact_right_on)` returns the best matches for a fuzzy key. Exact keys of later levels include the matches of previous levels
 
         """
         df_diff_bylevel = OrderedDict()
 
-        self.dfjoined = self.dfs[0].copy()
-        cfg_exact_left_on = self.cfg_exact_left_on
-        cfg_exact_right_on = self.cfg_exact_right_on
+        # levels only join unique key tuples, payload columns get joined once at the end
+        cfg_keys_left = list(OrderedDict.fromkeys(self.cfg_exact_left_on+self.cfg_fuzzy_left_on))
+        dfkeys = self.dfs[0][cfg_keys_left].drop_duplicates()
+        cfg_exact_left_on = list(self.cfg_exact_left_on)
+        cfg_exact_right_on = list(self.cfg_exact_right_on)
 
-        a=1
         for ilevel, ikey in enumerate(self.cfg_fuzzy_left_on):
             keyleft = ikey
             keyright = self.cfg_fuzzy_right_on[ilevel]
-            typeleft = self.dfs[0][keyleft].dtype
 
-            if self.cfg_fun_diff[ilevel]:
-                df_diff_bylevel[ikey] = MergeTop1Diff(self.dfjoined, self.dfs[1], keyleft, keyright, self.cfg_fun_diff[ilevel], cfg_exact_left_on, cfg_exact_right_on, top_limit=self.cfg_top_limit[ilevel], use_multicore=self.cfg_use_multicore).top1_diff()[0]
-            else:
-                if typeleft == 'int64' or typeleft == 'float64' or typeleft == 'datetime64[ns]':
-                    df_diff_bylevel[ikey] = MergeTop1Number(self.dfjoined, self.dfs[1], keyleft, keyright, cfg_exact_left_on, cfg_exact_right_on, top_limit=self.cfg_top_limit[ilevel]).top1_diff()
-                elif typeleft == 'object' and type(self.dfs[0][keyleft].values[0])==str:
-                    df_diff_bylevel[ikey] = MergeTop1Diff(self.dfjoined, self.dfs[1], keyleft, keyright, jellyfish.levenshtein_distance, cfg_exact_left_on, cfg_exact_right_on, top_limit=self.cfg_top_limit[ilevel], use_multicore=self.cfg_use_multicore).top1_diff()[0]
-                    # todo: handle duplicates
-                else:
-                    raise ValueError('Unrecognized data type for top match, need to pass fun_diff in arguments')
-
-            self.dfjoined = self.dfjoined.merge(df_diff_bylevel[ikey], left_on=cfg_exact_left_on+[keyleft], right_on=cfg_exact_left_on+['__top1left__'], suffixes=['',keyleft])
+            df_diff_bylevel[ikey] = fun_top1_diff(ilevel, dfkeys, cfg_exact_left_on, cfg_exact_right_on)
+
+            dfkeys = dfkeys.merge(df_diff_bylevel[ikey], left_on=cfg_exact_left_on+[keyleft], right_on=cfg_exact_left_on+['__top1left__'], suffixes=['',keyleft])
             cfg_col_rename = ['__top1left__','__top1right__','__top1diff__','__matchtype__']
-            self.dfjoined = self.dfjoined.rename(columns=dict((k,k+keyleft) for k in cfg_col_rename))
+            dfkeys = dfkeys.rename(columns=dict((k,k+keyleft) for k in cfg_col_rename))
             cfg_exact_left_on += ['__top1right__%s'%keyleft,]
             cfg_exact_right_on += [keyright,]
 
-        self.dfjoined = self.dfjoined.merge(self.dfs[1], left_on=cfg_exact_left_on, right_on=cfg_exact_right_on, suffixes=['','_right'])
+        if self.cfg_profile is not None:
+            self.cfg_profile.level = None
+        with stage(self.cfg_profile, 'merge') as record:
+            self.dfjoined = self.dfs[0].merge(dfkeys, on=cfg_keys_left)
+            self.dfjoined = self.dfjoined.merge(self.dfs[1], left_on=cfg_exact_left_on, right_on=cfg_exact_right_on, suffixes=['','_right'])
+            record['rows'] = len(self.dfjoined)
 
         if not self.cfg_is_keep_debug:
             self.dfjoined = self.dfjoined[self.dfjoined.columns[~self.dfjoined.columns.str.startswith('__')]]
 
-        return {'merged': self.dfjoined, 'top1': df_diff_bylevel, 'duplicates': None}
+        return {'merged': self.dfjoined, 'top1': df_diff_bylevel, 'duplicates': None, 'profile': self.cfg_profile}
+
+    def merge(self):
+        """
+
+        Executes merge
+
+        Returns:
+             dict: keys 'merged' has merged dataframe, 'top1' has best matches by fuzzy_left_on. See example notebooks for details
+
+        """
+        if self.cfg_metric:
+            with stage(self.cfg_profile, 'scoring') as record:
+                result = MergeTop1Points(self.dfs[0], self.dfs[1], self.cfg_fuzzy_left_on, self.cfg_fuzzy_right_on, self.cfg_exact_left_on, self.cfg_exact_right_on,
+                                         metric=self.cfg_metric, weights=self.cfg_weights, top_limit=self.cfg_top_limit_points, is_keep_debug=self.cfg_is_keep_debug).merge()
+                record['rows'] = len(result['merged'])
+            self.dfjoined = result['merged']
+            return {'merged': self.dfjoined, 'top1': OrderedDict([(tuple(self.cfg_fuzzy_left_on), result['top1'])]), 'duplicates': None, 'profile': self.cfg_profile}
+        return self._merge_levels(lambda ilevel, dfjoined, exact_left_on, exact_right_on: self._top1_diff_level(ilevel, dfjoined, self.dfs[1], exact_left_on, exact_right_on))
+
+
+class MergeTop1Incremental(MergeTop1):
+    """
+
+    Left best match join for append-only data. Same arguments and results as `MergeTop1`. `update` only scores new left values and new right values.
+
+    Note:
+        * equally close matches from old and new right values are all kept, a full merge of numbers keeps only one
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MergeTop1Incremental, self).__init__(*args, **kwargs)
+        if self.cfg_metric:
+            raise NotImplementedError('Incremental updates are not supported with metric')
+        self.top1 = None
+
+    def merge(self):
+        """
+
+        Executes full merge and keeps best matches for updates
+
+        Returns:
+             dict: see `MergeTop1.merge`
+
+        """
+        result = super(MergeTop1Incremental, self).merge()
+        self.top1 = result['top1']
+        return result
+
+    def _top1_diff_update(self, ilevel, dfjoined, exact_left_on, exact_right_on, df_right_new):
+        ikey = self.cfg_fuzzy_left_on[ilevel]
+        keys_diff = exact_left_on+['__top1left__']
+        df_diff_old = self.top1[ikey]
+
+        # split left keys into matched before and new
+        df_keys = dfjoined[exact_left_on+[ikey]].drop_duplicates().rename(columns={ikey:'__top1left__'})
+        df_keys = df_keys.merge(df_diff_old[keys_diff].drop_duplicates(), on=keys_diff, how='left', indicator=True)
+        df_keys_old = df_keys.loc[df_keys['_merge']=='both', keys_diff]
+        df_keys_new = df_keys.loc[df_keys['_merge']!='both', keys_diff]
+
+        dfs_diff = [df_diff_old.merge(df_keys_old, on=keys_diff)]
+        if not df_keys_new.empty: # new left keys against all right values
+            dfs_diff.append(self._top1_diff_level(ilevel, df_keys_new.rename(columns={'__top1left__':ikey}), self.dfs[1], exact_left_on, exact_right_on))
+        if df_right_new is not None and not df_right_new.empty and not df_keys_old.empty: # old left keys against new right values
+            dfs_diff.append(self._top1_diff_level(ilevel, df_keys_old.rename(columns={'__top1left__':ikey}), df_right_new, exact_left_on, exact_right_on))
+
+        df_diff = pd.concat([df for df in dfs_diff if not df.empty] or dfs_diff[:1], ignore_index=True, sort=False)
+        df_diff = filter_group_topn(df_diff, keys_diff, '__top1diff__')
+        return df_diff.drop_duplicates(keys_diff+['__top1right__']).reset_index(drop=True)
+
+    def update(self, df1_new=None, df2_new=None):
+        """
+
+        Appends new rows and updates merge
+
+        Args:
+            df1_new (dataframe): new rows of left dataframe
+            df2_new (dataframe): new rows of right dataframe
+
+        Returns:
+             dict: see `MergeTop1.merge`
+
+        """
+        if self.top1 is None:
+            raise ValueError('Need to run merge() before update()')
+
+        if df1_new is not None:
+            self.dfs[0] = pd.concat([self.dfs[0], df1_new], ignore_index=True, sort=False)
+        if df2_new is not None:
+            self.dfs[1] = pd.concat([self.dfs[1], df2_new], ignore_index=True, sort=False)
+
+        result = self._merge_levels(lambda ilevel, dfjoined, exact_left_on, exact_right_on: self._top1_diff_update(ilevel, dfjoined, exact_left_on, exact_right_on, df2_new))
+        self.top1 = result['top1']
+        return result
 
 '''
 multikey: want to merge left match onto right df
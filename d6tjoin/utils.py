@@ -1,7 +1,18 @@
 from collections import OrderedDict
+import itertools
+import multiprocessing
+import os
 
 import pandas as pd
 import numpy as np
+from joblib import Parallel, delayed
+
+try:
+    import pyarrow.parquet as pq
+except ImportError: # optional, needed to read parquet files
+    pq = None
+
+from d6tjoin.sketch import sketch_keys, stats_sketches, _is_nan
 
 
 # ******************************************
@@ -37,6 +48,249 @@ def df_str_summary(dfg, columns=None, unique_count=False):
     return dfg[columns].select_dtypes(include=['object']).apply(lambda x: _apply_strlen(x, unique_count)).T[cfg_col_sel]
 
 
+# ******************************************
+# candidates
+# ******************************************
+
+def _to_values(values):
+    values = list(values)
+    return pd.Series(values, dtype=None if values else object).values
+
+
+def gen_candidates(values_left, values_right):
+    """
+    Generates all pairs of left and right values. Vectorized, same rows in same order as `itertools.product`
+
+    Args:
+        values_left (list): left values
+        values_right (list): right values
+
+    Returns:
+        dataframe: columns '__top1left__','__top1right__'
+    """
+    values_left, values_right = _to_values(values_left), _to_values(values_right)
+    return pd.DataFrame({'__top1left__':np.repeat(values_left, len(values_right)), '__top1right__':np.tile(values_right, len(values_left))})
+
+
+def gen_candidates_blocks(df_left, df_right, by_left, by_right, key_left, key_right):
+    """
+    Generates all pairs of unique left and right key values within each block of exact keys. Blocks sorted by exact keys, values in order of appearance
+
+    Args:
+        df_left (dataframe): left dataframe
+        df_right (dataframe): right dataframe
+        by_left (list): exact keys, left dataframe
+        by_right (list): exact keys, right dataframe
+        key_left (str): fuzzy key, left dataframe
+        key_right (str): fuzzy key, right dataframe
+
+    Returns:
+        dataframe: columns by_left,'__top1left__','__top1right__'
+    """
+    keys_left = df_left[by_left+[key_left]].dropna().drop_duplicates()
+    keys_right = df_right[by_right+[key_right]].dropna().drop_duplicates()
+    codes_left, codes_right = _block_codes(keys_left, keys_right, by_left, by_right)
+    codes = np.concatenate([codes_left, codes_right])
+    nblocks = codes.max()+1 if len(codes) else 0
+
+    # each left value is repeated once for each right value in its block
+    order_left = np.argsort(codes_left, kind='mergesort')
+    order_right = np.argsort(codes_right, kind='mergesort')
+    count_right = np.bincount(codes_right, minlength=nblocks)
+    start_right = np.cumsum(count_right) - count_right
+    nrepeat = count_right[codes_left[order_left]]
+    ileft = np.repeat(order_left, nrepeat)
+    offset = np.arange(nrepeat.sum()) - np.repeat(np.cumsum(nrepeat) - nrepeat, nrepeat)
+    iright = order_right[np.repeat(start_right[codes_left[order_left]], nrepeat) + offset]
+
+    df_candidates = keys_left[by_left].iloc[ileft].reset_index(drop=True)
+    df_candidates['__top1left__'] = keys_left[key_left].values[ileft]
+    df_candidates['__top1right__'] = keys_right[key_right].values[iright]
+    return df_candidates
+
+
+def unique_keys_sorted(df, by, key, nrecords=None):
+    """
+    Unique key tuples sorted by the fuzzy key, eg for `pd.merge_asof`. Vectorized over all blocks of exact keys and inputs which are already sorted don't get sorted again
+
+    Args:
+        df (dataframe): dataframe
+        by (list): exact keys
+        key (str): fuzzy key
+        nrecords (int): only keep the first nrecords unique values in each block
+
+    Returns:
+        dataframe: columns by+[key], rows with nulls are dropped
+    """
+    df_keys = df[by+[key]].dropna().drop_duplicates()
+    if nrecords is not None:
+        df_keys = df_keys[df_keys.groupby(by).cumcount() < nrecords] if by else df_keys.iloc[:nrecords]
+    if not df_keys[key].is_monotonic_increasing:
+        df_keys = df_keys.sort_values(key, kind='mergesort')
+    return df_keys.reset_index(drop=True)
+
+
+def _asof_tolerance(top_limit, values):
+    """
+    top_limit as `pd.merge_asof` tolerance for the dtype of values, None if it can't be one
+    """
+    if values.dtype.kind == 'M':
+        try:
+            tolerance = pd.Timedelta(top_limit)
+        except (ValueError, TypeError):
+            raise ValueError('top_limit for dates needs to be a fixed duration like pd.offsets.Day(1), not a calendar offset')
+        return tolerance if tolerance >= pd.Timedelta(0) else None
+    if isinstance(top_limit, (pd.DateOffset, pd.Timedelta)) or top_limit < 0:
+        return None
+    return int(np.floor(top_limit)) if values.dtype.kind in 'iu' else float(top_limit)
+
+
+def merge_asof_top1(df_keys_left, df_keys_right, by_left=None, by_right=None, direction='nearest', top_limit=None):
+    """
+    Finds the closest right value for each left value with `pd.merge_asof`. top_limit is passed as tolerance so the search is bounded, left values without a match within top_limit are dropped
+
+    Args:
+        df_keys_left (dataframe): left keys sorted by '__top1left__', see `unique_keys_sorted`
+        df_keys_right (dataframe): right keys sorted by '__top1right__'
+        by_left (list): exact keys, left dataframe
+        by_right (list): exact keys, right dataframe
+        direction (str): 'nearest', 'backward' for right values smaller or equal, 'forward' for right values larger or equal
+        top_limit (float): maximum difference, `pd.offsets` or `pd.Timedelta` for dates. None for no limit
+
+    Returns:
+        dataframe: columns by_left,'__top1left__','__top1right__','__top1diff__'
+    """
+    tolerance = _asof_tolerance(top_limit, df_keys_left['__top1left__']) if top_limit is not None else None
+    kwargs = {'left_by': by_left, 'right_by': by_right} if by_left else {}
+    df_diff = pd.merge_asof(df_keys_left, df_keys_right, left_on='__top1left__', right_on='__top1right__', direction=direction, tolerance=tolerance, **kwargs)
+    if tolerance is not None:
+        df_diff = df_diff.dropna(subset=['__top1right__'])
+    df_diff['__top1diff__'] = (df_diff['__top1left__']-df_diff['__top1right__']).abs()
+    if top_limit is not None and tolerance is None:
+        df_diff = df_diff[df_diff['__top1diff__']<=top_limit]
+    return df_diff
+
+
+def _block_codes(keys_left, keys_right, by_left, by_right):
+    # block codes in sorted key order, shared by both sides
+    if not by_left:
+        return np.zeros(len(keys_left), dtype=int), np.zeros(len(keys_right), dtype=int)
+    blocks = pd.concat([keys_left[by_left], keys_right[by_right].rename(columns=dict(zip(by_right, by_left)))], ignore_index=True)
+    codes = blocks.groupby(by_left, sort=True).ngroup().values
+    return codes[:len(keys_left)], codes[len(keys_left):]
+
+
+def _searchsorted_blocks(codes_right, values_right, codes_left, values_left, side='left'):
+    """
+    `np.searchsorted` of left values into right values sorted by (block, value), within the block of each left value. Returns positions into the right values
+    """
+    nright = len(values_right)
+    is_left = np.r_[np.zeros(nright, dtype=bool), np.ones(len(values_left), dtype=bool)]
+    tie = is_left if side=='right' else ~is_left # equal right values before or after left values
+    order = np.lexsort((tie, np.concatenate([values_right, values_left]), np.concatenate([codes_right, codes_left])))
+    nright_before = np.cumsum(~is_left[order]) # right values up to each position
+    positions = np.zeros(len(values_left), dtype=int)
+    positions[order[is_left[order]] - nright] = nright_before[is_left[order]]
+    return positions
+
+
+def gen_nearest_blocks(df_left, df_right, by_left, by_right, key_left, key_right, topn=1, direction='nearest'):
+    """
+    Finds the right values with the topn smallest differences to each unique left value within each block of exact keys, for numbers and dates. Only scores the topn neighbours on each side in the sorted right values
+
+    Args:
+        df_left (dataframe): left dataframe
+        df_right (dataframe): right dataframe
+        by_left (list): exact keys, left dataframe
+        by_right (list): exact keys, right dataframe
+        key_left (str): fuzzy key, left dataframe
+        key_right (str): fuzzy key, right dataframe
+        topn (int): keep all matches with the topn smallest differences
+        direction (str): 'nearest', 'backward' for right values smaller or equal, 'forward' for right values larger or equal
+
+    Returns:
+        dataframe: columns by_left,'__top1left__','__top1right__','__top1diff__'. Sorted by block and left value, then right value
+    """
+    if direction not in ('nearest', 'backward', 'forward'):
+        raise ValueError("direction needs to be one of 'nearest', 'backward', 'forward'")
+    keys_left = df_left[by_left+[key_left]].dropna().drop_duplicates()
+    keys_right = df_right[by_right+[key_right]].dropna().drop_duplicates()
+    codes_left, codes_right = _block_codes(keys_left, keys_right, by_left, by_right)
+
+    order_left = np.lexsort((keys_left[key_left].values, codes_left))
+    order_right = np.lexsort((keys_right[key_right].values, codes_right))
+    codes_left, values_left = codes_left[order_left], keys_left[key_left].values[order_left]
+    codes_right, values_right = codes_right[order_right], keys_right[key_right].values[order_right]
+
+    # window of topn right values on each side
+    before = _searchsorted_blocks(codes_right, values_right, codes_left, values_left, 'left')
+    upto = _searchsorted_blocks(codes_right, values_right, codes_left, values_left, 'right')
+    start, end = np.searchsorted(codes_right, codes_left, 'left'), np.searchsorted(codes_right, codes_left, 'right')
+    if direction=='backward':
+        lo, hi = np.maximum(upto-topn, start), upto
+    elif direction=='forward':
+        lo, hi = before, np.minimum(before+topn, end)
+    else:
+        lo, hi = np.maximum(before-topn, start), np.minimum(upto+topn, end)
+    width = 2*topn+1 if direction=='nearest' else topn
+    iright = lo[:, None] + np.arange(width)
+    is_valid = iright < hi[:, None]
+    iright = np.minimum(iright, max(len(values_right)-1, 0))
+
+    # keep topn unique differences
+    if len(values_right):
+        diffs = np.abs(values_right[iright] - values_left[:, None])
+    else:
+        diffs = np.zeros(iright.shape)
+    rank = diffs.view('i8') if diffs.dtype.kind=='m' else diffs.astype(float)
+    rank = np.where(is_valid, rank, np.iinfo(np.int64).max if rank.dtype.kind=='i' else np.inf)
+    rank_sorted = np.sort(rank, axis=1)
+    is_new = np.ones(rank_sorted.shape, dtype=bool)
+    is_new[:, 1:] = rank_sorted[:, 1:] != rank_sorted[:, :-1]
+    nth = np.argmax(np.cumsum(is_new, axis=1) >= topn, axis=1) # position of topn-th unique difference
+    nth[np.cumsum(is_new, axis=1)[:, -1] < topn] = width-1
+    is_top = is_valid & (rank <= rank_sorted[np.arange(len(rank)), nth][:, None])
+
+    ileft, icol = np.nonzero(is_top)
+    df_diff = keys_left[by_left].iloc[order_left[ileft]].reset_index(drop=True)
+    df_diff['__top1left__'] = values_left[ileft]
+    df_diff['__top1right__'] = values_right[iright[ileft, icol]]
+    df_diff['__top1diff__'] = diffs[ileft, icol]
+    return df_diff
+
+
+# ******************************************
+# group filters
+# ******************************************
+
+def filter_group_topn(dfg, by, col, topn=1):
+    """
+    Returns all rows with one of the topn smallest values in col for each group, including ties
+
+    Args:
+        dfg (dataframe): pandas dataframe
+        by (str or list): group keys
+        col (str): column to rank, lower is better
+        topn (int): number of unique smallest values to keep for each group
+
+    Returns:
+        dataframe: filtered dataframe
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    dfg = dfg[dfg[by].notnull().all(axis=1)] # groupby drops missing keys
+    grouped = dfg.groupby(by, sort=False)[col]
+    if topn==1:
+        is_top = dfg[col] == grouped.transform('min')
+    else:
+        is_top = grouped.rank(method='dense') <= topn
+        # missing values sort last in np.sort, kept if group has less than topn unique values
+        is_top |= dfg[col].isnull() & (grouped.transform('nunique') < topn)
+
+    if is_top.all():
+        return dfg # groupby.apply keeps original order if no group was filtered
+    return dfg[is_top].sort_values(by, kind='mergesort') # groups in key order, original order within group
+
+
 # ******************************************
 # join base class
 # ******************************************
@@ -61,8 +315,7 @@ class BaseJoin(object):
         self.keysall = keys+[['__all__']*len(dfs)]
         self.keysdf = keysdf # keys by df
         self.keysdfall = keysdf+[['__all__']]*len(dfs)
-        self.uniques = [] # set of unique values for each join key individually
-        self.keysets = [] # set of unique values for all join keys together __all__
+        self.keysets = [] # stats and sets of unique values for each join key and all join keys together __all__
 
     def _init_dfs(self, dfs):
         # check and save dfs
@@ -113,55 +366,217 @@ class BaseJoin(object):
 # prejoin stats class
 # ******************************************
 
-class PreJoin(BaseJoin):
+_KEYSET_SETS = ['keyset left','keyset right','inner','outer','unmatched total','unmatched left','unmatched right']
+_PREJOIN_CHUNKSIZE = 2**20 # rows read at once from files
+_PREJOIN_COMPACT = 16 # chunks of unique keys collected before dropping duplicates across chunks
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _is_parquet(path):
+    return os.fspath(path).lower().endswith(('.parquet', '.pq'))
+
+
+def read_header(path):
     """
-    Analyze, slice & dice join keys and dataframes before joining. Useful for checking how good a join will be and quickly looking at unmatched join keys.
+    Empty dataframe with the columns of a CSV or parquet file
+    """
+    if _is_parquet(path):
+        if pq is None:
+            raise ImportError('reading parquet files needs pyarrow')
+        return pd.DataFrame(columns=pq.read_schema(path).names)
+    return pd.read_csv(path, nrows=0)
+
+
+def read_chunks(path, columns=None, chunksize=_PREJOIN_CHUNKSIZE):
+    """
+    Reads a CSV or parquet file in chunks of rows, only the given columns get parsed
 
     Args:
-        dfs (list): list of data frames to join
-        keys (var): either list of strings `['a','b']` if join keys have the same names in all dataframes or list of lists if join keys are different across dataframes `[['a1','b1'],['a2','b2']]`
+        path (str): CSV file, or parquet file ending in .parquet or .pq which needs pyarrow
+        columns (list): columns to read, None for all
+        chunksize (int): rows in each chunk
 
+    Yields:
+        dataframe: chunk of rows
     """
+    if _is_parquet(path):
+        if pq is None:
+            raise ImportError('reading parquet files needs pyarrow')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for dfg in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            yield dfg
 
-    def _calc_keysets(self):
 
-        self.keysets = [] # reset
+def read_unique_keys(chunks, keys):
+    """
+    Unique key tuples from chunks of rows, memory grows with unique keys instead of rows
+    """
+    dfs_keys = []
+    for dfg in chunks:
+        dfs_keys.append(dfg[keys].drop_duplicates())
+        if len(dfs_keys) >= _PREJOIN_COMPACT:
+            dfs_keys = [pd.concat(dfs_keys, ignore_index=True).drop_duplicates()]
+    if not dfs_keys:
+        return pd.DataFrame(columns=keys)
+    return pd.concat(dfs_keys, ignore_index=True).drop_duplicates().reset_index(drop=True)
 
-        # find set of unique values for each join key
-        for idx, dfg in enumerate(self.dfs):
 
-            # keys individually
-            uniquedict = OrderedDict()
-            for key in self.keysdf[idx]:
-                v = dfg[key].unique()
-                uniquedict[key] = set(v[~pd.isnull(v)])
+def _factorize_key(values_left, values_right):
+    """
 
-            # keys _all__
-            dft = dfg[self.keysdf[idx]].drop_duplicates()
-            uniquedict['__all__'] = {tuple(x) for x in dft.values}
-            self.uniques.append(uniquedict)
+    Codes of key values shared by both dataframes, 0 for missing values
 
-        # perform set logic
-        for keys in self.keysall:
-            df_key = {}
-            df_key['key left'] = keys[0]
-            df_key['key right'] = keys[1]
-            df_key['keyset left'] = self.uniques[0][df_key['key left']]
-            df_key['keyset right'] = self.uniques[1][df_key['key right']]
+    """
+    return pd.factorize(pd.concat([values_left, values_right], ignore_index=True))[0]+1
+
+
+def _combine_codes(codes):
+    # one code for each unique tuple of codes
+    codes_all = codes[0]
+    for c in codes[1:]:
+        codes_all = pd.factorize(codes_all*(c.max()+1)+c)[0]+1
+    return codes_all
+
+
+def _separate_nan(codes_all, is_nan_left, is_nan_right):
+    # tuples with NaN keep one code within each dataframe but never match the other dataframe
+    offset = int(codes_all.max(initial=0))+1
+    return codes_all + np.concatenate([is_nan_left*offset, is_nan_right*2*offset])
+
+
+def _first_positions(codes, ncodes, is_dropna):
+    # position of a row with each code, -1 for codes not present. Codes are dense so no sorting needed
+    positions = np.full(ncodes, -1)
+    positions[codes] = np.arange(len(codes))
+    if is_dropna:
+        positions[0] = -1
+    return positions
+
+
+class _KeySet(dict):
+    """
+
+    Prejoin stats of one join key from shared codes of both dataframes, see `_factorize_key`. Sets of key values only get built when accessed
+
+    """
+
+    def __init__(self, key_left, key_right, keys_left, keys_right, codes):
+        self._is_all = key_left == '__all__'
+        ncodes = int(codes.max(initial=0))+1
+        positions_left = _first_positions(codes[:len(keys_left)], ncodes, not self._is_all)
+        positions_right = _first_positions(codes[len(keys_left):], ncodes, not self._is_all)
+        is_left, is_right = positions_left>=0, positions_right>=0
+        self._positions = [(positions_left[is_left], is_right[is_left]), (positions_right[is_right], is_left[is_right])]
+        self._keys = [keys_left, keys_right]
+
+        ninner = int((is_left & is_right).sum())
+        nleft, nright = int(is_left.sum()), int(is_right.sum())
+        counts = OrderedDict(zip(_KEYSET_SETS, [nleft, nright, ninner, nleft+nright-ninner, nleft+nright-2*ninner, nleft-ninner, nright-ninner]))
+        super(_KeySet, self).__init__([('key left', key_left), ('key right', key_right), ('counts', counts)])
+
+    def _values(self, idf, is_inner):
+        positions, is_sel = self._positions[idf]
+        dfg = self._keys[idf].iloc[positions[is_sel==is_inner] if is_inner is not None else positions]
+        if self._is_all:
+            return {tuple(x) for x in dfg.values}
+        return set(dfg.iloc[:,0].values)
+
+    def __missing__(self, k):
+        if k == 'keyset left':
+            v = self._values(0, None)
+        elif k == 'keyset right':
+            v = self._values(1, None)
+        elif k == 'inner':
+            v = self._values(0, True)
+        elif k == 'unmatched left':
+            v = self._values(0, False)
+        elif k == 'unmatched right':
+            v = self._values(1, False)
+        elif k == 'outer':
+            v = self['keyset left'].union(self['unmatched right'])
+        elif k == 'unmatched total':
+            v = self['unmatched left'].union(self['unmatched right'])
+        elif k == 'value type':
+            v = type(next(iter(self['keyset left'])))
+        else:
+            raise KeyError(k)
+        self[k] = v
+        return v
+
+
+class PreJoin(BaseJoin):
+    """
+    Analyze, slice & dice join keys and dataframes before joining. Useful for checking how good a join will be and quickly looking at unmatched join keys.
 
-            df_key['inner'] = df_key['keyset left'].intersection(df_key['keyset right'])
-            df_key['outer'] = df_key['keyset left'].union(df_key['keyset right'])
-            df_key['unmatched total'] = df_key['keyset left'].symmetric_difference(df_key['keyset right'])
-            df_key['unmatched left'] = df_key['keyset left'].difference(df_key['keyset right'])
-            df_key['unmatched right'] = df_key['keyset right'].difference(df_key['keyset left'])
+    Args:
+        dfs (list): list of data frames to join. Instead of a dataframe you can pass a path to a CSV or parquet file or an iterator of dataframe chunks eg `pd.read_csv(chunksize=)`, see notes
+        keys (var): either list of strings `['a','b']` if join keys have the same names in all dataframes or list of lists if join keys are different across dataframes `[['a1','b1'],['a2','b2']]`
+        keys_bydf (bool): if keys list is by dataframe or join level, see `d6tjoin.smart_join.FuzzyJoinTop1`
+        chunksize (int): rows read at once from files
+
+    Note:
+        * files get read in chunks by each method which needs them, only join key columns unless `show_*` functions show all columns. Parquet files need pyarrow
+        * iterators get read once when creating the object and only unique join key tuples are kept, `show_*` functions show those instead of rows
+
+    """
+
+    def __init__(self, dfs, keys=None, keys_bydf=False, chunksize=_PREJOIN_CHUNKSIZE):
+        self.cfg_chunksize = chunksize
+
+        # files and iterators start as empty dataframes with their columns to check join keys
+        dfs_init, chunks = [], {}
+        for idf, dfg in enumerate(dfs):
+            if isinstance(dfg, pd.DataFrame):
+                dfs_init.append(dfg)
+            elif _is_path(dfg):
+                dfs_init.append(read_header(dfg))
+            else:
+                dfg = iter(dfg)
+                dfg_first = next(dfg)
+                chunks[idf] = itertools.chain([dfg_first], dfg)
+                dfs_init.append(dfg_first.head(0))
+        super(PreJoin, self).__init__(dfs_init, keys, keys_bydf)
+
+        self.sources = [dfg if _is_path(dfg) else None for dfg in dfs]
+        for idf, dfg in chunks.items():
+            self.dfs[idf] = read_unique_keys(dfg, self.keysdf[idf])
+
+    def _read_keys(self, idf):
+        # dataframe with join keys, unique key tuples for files
+        if self.sources[idf] is None:
+            return self.dfs[idf]
+        return read_unique_keys(read_chunks(self.sources[idf], self.keysdf[idf], self.cfg_chunksize), self.keysdf[idf])
+
+    def _read_rows(self, idf, columns=None, nrows=0, fun_filter=None):
+        # rows of a file read in chunks, optionally filtered by fun_filter(dfg), stops after nrows rows
+        dfs_out, nrows_out = [], 0
+        for dfg in read_chunks(self.sources[idf], columns, self.cfg_chunksize):
+            if fun_filter is not None:
+                dfg = dfg[fun_filter(dfg)]
+            dfs_out.append(dfg)
+            nrows_out += dfg.shape[0]
+            if nrows > 0 and nrows_out >= nrows:
+                break
+        dfg = pd.concat(dfs_out) if dfs_out else self.dfs[idf] if columns is None else self.dfs[idf][columns]
+        return dfg.head(nrows) if nrows > 0 else dfg
 
-            # check types are consistent
-            vl = next(iter(df_key['keyset left'])) # take first element
-            vr = next(iter(df_key['keyset right'])) # take first element
+    def _calc_keysets(self):
 
-            df_key['value type'] = type(vl)
+        # set logic on codes shared by both dataframes, join keys get factorized in parallel. __all__ combines codes of all join keys
+        dfs = [self._read_keys(0), self._read_keys(1)]
+        codes = Parallel(n_jobs=min(self.cfg_njoins, multiprocessing.cpu_count()), prefer='threads')(delayed(_factorize_key)(dfs[0][keys[0]], dfs[1][keys[1]]) for keys in self.keys)
+        is_nan = [np.logical_or.reduce([_is_nan(dfs[idf][keys[idf]]) for keys in self.keys]) for idf in range(2)]
+        codes.append(_separate_nan(_combine_codes(codes), *is_nan))
 
-            self.keysets.append(df_key)
+        self.keysets = []
+        for keys, codes_key in zip(self.keysall, codes):
+            cols = [self.keysdf[0], self.keysdf[1]] if keys[0] == '__all__' else [[keys[0]], [keys[1]]]
+            self.keysets.append(_KeySet(keys[0], keys[1], dfs[0][cols[0]], dfs[1][cols[1]], codes_key))
 
 
     def stats_prejoin(self, print_only=True, rerun=False):
@@ -180,8 +595,8 @@ class PreJoin(BaseJoin):
 
         for key_set in self.keysets:
             df_key = {}
-            for k in ['keyset left','keyset right','inner','outer','unmatched total','unmatched left','unmatched right']:
-                df_key[k] = len(key_set[k])
+            for k in _KEYSET_SETS:
+                df_key[k] = key_set['counts'][k]
             for k in ['key left','key right']:
                 df_key[k] = key_set[k]
             df_key['all matched'] = df_key['inner']==df_key['outer']
@@ -192,6 +607,27 @@ class PreJoin(BaseJoin):
         df_out = df_out[['key left','key right','all matched','inner','left','right','outer','unmatched total','unmatched left','unmatched right']]
 
 
+        if print_only:
+            print(df_out)
+        else:
+            return df_out
+
+    def stats_prejoin_approx(self, print_only=True, p=14, k=1024):
+        """
+        Approximate prejoin statistics from sketches streamed over chunks of rows, for very large dataframes. Sketches are kept in `self.sketches`, see `d6tjoin.sketch`
+
+        Args:
+            print_only (bool): print instead of returning results
+            p (int): 2**p HyperLogLog registers, see `d6tjoin.sketch.KeySketch`
+            k (int): smallest hashes kept to estimate overlaps, see `d6tjoin.sketch.KeySketch`
+
+        Returns:
+            dataframe: same columns as `stats_prejoin` with estimated counts, then standard errors of the counts. Counts are exact for keys with fewer than k unique values
+
+        """
+        self.sketches = [sketch_keys(dfg if self.sources[idf] is None else read_chunks(self.sources[idf], self.keysdf[idf], self.cfg_chunksize), self.keysdf[idf], p, k) for idf, dfg in enumerate(self.dfs)]
+        df_out = stats_sketches(self.sketches[0], self.sketches[1], self.keys)
+
         if print_only:
             print(df_out)
         else:
@@ -207,7 +643,7 @@ class PreJoin(BaseJoin):
             raise ValueError('key ', self.cfg_show_key, ' not a join key in ', self.keys)
         ilevel = keymask.index(True)
 
-        return (self.keysets[ilevel]['key left']==key or self.keysets[ilevel]['key right']==key) and len(self.keysets[ilevel]['unmatched total'])==0
+        return (self.keysets[ilevel]['key left']==key or self.keysets[ilevel]['key right']==key) and self.keysets[ilevel]['counts']['unmatched total']==0
 
     def show_input(self, nrows=3, keys_only=True, print_only=False):
         """
@@ -225,8 +661,11 @@ class PreJoin(BaseJoin):
 
             df = dfg
 
+            if self.sources[idf] is not None:
+                df = self._read_rows(idf, self.keysdf[idf] if keys_only else None, nrows)
+
             if keys_only:
-                df = dfg[self.keysdf[idf]]
+                df = df[self.keysdf[idf]]
 
             if nrows>0:
                 df = df.head(nrows)
@@ -277,7 +716,13 @@ class PreJoin(BaseJoin):
         if self.cfg_show_nrecords > 0:
             keys = keys[:self.cfg_show_nrecords]
 
-        if self.cfg_show_key == '__all__' and self.cfg_njoins>1:
+        if self.sources[idf] is not None:
+            if self.cfg_show_key == '__all__':
+                fun_filter = lambda dfg: pd.MultiIndex.from_frame(dfg[self.keysdf[idf]]).isin(keys)
+            else:
+                fun_filter = lambda dfg: dfg[self.cfg_show_key].isin(keys)
+            dfg = self._read_rows(idf, self.keysdf[idf] if self.cfg_show_keys_only else None, self.cfg_show_nrows, fun_filter)[cfg_col_sel]
+        elif self.cfg_show_key == '__all__' and self.cfg_njoins>1:
             dfg = self.dfs[idf].copy()
             dfg = self.dfs[idf].reset_index().set_index(self.keysdf[idf])
             dfg = dfg.loc[keys]
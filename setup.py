@@ -18,6 +18,10 @@ setup(
         'jellyfish',
         'joblib'
     ],
+    extras_require={
+        'kdtree': ['scipy'],
+        'parquet': ['pyarrow'],
+    },
     include_package_data=True,
     python_requires='>=3.6'
 )
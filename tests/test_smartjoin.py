@@ -80,6 +80,38 @@ def test_df_str_summary():
        [ 2.5,  2.5,  2. ,  3. ,  4. ,  2. ]]))
 
 
+def test_gen_candidates():
+    import itertools
+    from d6tjoin.utils import gen_candidates, gen_candidates_blocks
+
+    dfr = gen_candidates(['a','b'], [1, 2, 3])
+    assert dfr.values.tolist() == [list(x) for x in itertools.product(['a','b'], [1, 2, 3])]
+
+    df1 = pd.DataFrame({'g':['b','a','b','a','c','b'],'h':[0,0,0,1,0,0],'k':['x','y','z','y',None,'x']})
+    df2 = pd.DataFrame({'g2':['a','b','a','d','b'],'h':[0,0,0,0,1],'k2':['u','v','w','u','v']})
+    dfr = gen_candidates_blocks(df1, df2, ['g'], ['g2'], 'k', 'k2')
+    assert dfr.values.tolist() == [['a','y','u'],['a','y','w'],['b','x','v'],['b','z','v']]
+    dfr = gen_candidates_blocks(df1, df2, ['g','h'], ['g2','h'], 'k', 'k2')
+    assert dfr.values.tolist() == [['a',0,'y','u'],['a',0,'y','w'],['b',0,'x','v'],['b',0,'z','v']]
+    assert gen_candidates_blocks(df1, df2.iloc[:0], ['g'], ['g2'], 'k', 'k2').shape == (0, 3)
+
+
+def test_unique_keys_sorted():
+    from d6tjoin.utils import unique_keys_sorted
+
+    df = pd.DataFrame({'g':['b','a','b','a','b',None],'v':[3,2,3,1,0,5]})
+    dfr = unique_keys_sorted(df, ['g'], 'v')
+    assert dfr.values.tolist() == [['b',0],['a',1],['a',2],['b',3]]
+    dfr = unique_keys_sorted(df, ['g'], 'v', nrecords=1)
+    assert dfr.values.tolist() == [['a',2],['b',3]]
+    dfr = unique_keys_sorted(df, [], 'v', nrecords=2)
+    assert dfr.values.tolist() == [[2],[3]]
+
+    # sorted input is kept as is
+    df = pd.DataFrame({'v':pd.date_range('2010-01-01', periods=5)})
+    assert unique_keys_sorted(df, [], 'v').equals(df)
+
+
 def test_basejoin():
     df1 = pd.DataFrame({'a': range(3), 'b': range(3)})
     df2 = pd.DataFrame({'a': range(3), 'b': range(3)})
@@ -203,6 +235,98 @@ def test_prejoin():
     assert dfr['right'].empty
 
 
+def test_prejoin_stats():
+    # counts from shared codes same as python set logic, missing values only count for __all__, int and float keys match
+    df1 = pd.DataFrame({'a': [0, 1, 1, 2, 3], 'b': ['x', 'y', None, 'y', 'x']})
+    df2 = pd.DataFrame({'a': [1., 2., 4., np.nan, 1.], 'b': ['y', 'x', None, 'x', None]})
+    j = PreJoin([df1,df2],['a','b'])
+    dfr = j.stats_prejoin(print_only=False)
+    sets_left = [{0,1,2,3}, {'x','y'}, {(0,'x'),(1,'y'),(1,None),(2,'y'),(3,'x')}]
+    sets_right = [{1.,2.,4.}, {'x','y'}, {(1.,'y'),(2.,'x'),(4.,None),(np.nan,'x'),(1.,None)}]
+    for ilevel, (set_left, set_right) in enumerate(zip(sets_left, sets_right)):
+        check = [len(set_left), len(set_right), len(set_left & set_right), len(set_left | set_right), len(set_left ^ set_right), len(set_left - set_right), len(set_right - set_left)]
+        assert dfr.loc[ilevel, ['left','right','inner','outer','unmatched total','unmatched left','unmatched right']].tolist() == check
+    assert dfr['all matched'].tolist() == [False, True, False]
+
+    # sets only get built when needed
+    assert 'inner' not in j.keysets[2]
+    assert j.keysets[2]['inner'] == {(1,'y'),(1,None)}
+    assert j.keysets[0]['unmatched right'] == {4.}
+    assert j.is_all_matched('b') and not j.is_all_matched()
+    dfr = j.show_unmatched('a',nrecords=-1,keys_only=True)
+    assert dfr['left'].tolist() == [0, 3] and dfr['right'].tolist() == [4.]
+
+    # tuples with NaN don't match, like NaN from different rows in python sets, but None does
+    df1 = pd.DataFrame({'a': [np.nan, np.nan, 1.], 'b': ['x', 'x', None]})
+    df2 = pd.DataFrame({'a': [np.nan, 1., 1.], 'b': ['x', None, 'y']})
+    dfr = PreJoin([df1,df2],['a','b']).stats_prejoin(print_only=False)
+    assert dfr.loc[2, ['left','right','inner','unmatched left','unmatched right']].tolist() == [2, 3, 1, 1, 2]
+
+
+def test_prejoin_approx():
+    import d6tjoin.sketch
+    cols = ['key left','key right','all matched','inner','left','right','outer','unmatched total','unmatched left','unmatched right']
+
+    # exact below k unique values
+    df1 = pd.DataFrame({'a': [0, 1, 1, 2, 3], 'b': ['x', 'y', None, 'y', 'x']})
+    df2 = pd.DataFrame({'a': [1., 2., 4., np.nan, 1.], 'b': ['y', 'x', None, 'x', None]})
+    j = PreJoin([df1,df2],['a','b'])
+    dfr = j.stats_prejoin_approx(print_only=False)
+    assert dfr[cols].equals(j.stats_prejoin(print_only=False)[cols])
+    assert (dfr[[c+' stderr' for c in cols[3:]]]==0).all().all()
+
+    # exact below k unique values with missing values, tuples with NaN don't match
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        df1 = pd.DataFrame({'a': rng.choice([1., 2., 3., np.nan], 50), 'b': rng.choice(['x', 'y', None, np.nan], 50)})
+        df2 = pd.DataFrame({'a': rng.choice([1, 2, 4], 50).astype(float), 'b': rng.choice(['x', 'z', None, np.nan], 50)})
+        df2.loc[rng.rand(50)<0.2, 'a'] = np.nan
+        j = PreJoin([df1,df2],['a','b'])
+        assert j.stats_prejoin_approx(print_only=False)[cols].equals(j.stats_prejoin(print_only=False)[cols])
+
+    # estimates within error bounds, sketches of partitions merge
+    rng = np.random.RandomState(0)
+    df1 = pd.DataFrame({'a': rng.randint(0, 50000, 100000), 'b': rng.choice(['x','y',None], 100000)})
+    df2 = pd.DataFrame({'a': rng.randint(25000, 100000, 100000), 'b': rng.choice(['x','z',None], 100000)})
+    j = PreJoin([df1,df2],['a','b'])
+    dfe = j.stats_prejoin(print_only=False)
+    dfr = j.stats_prejoin_approx(print_only=False)
+    for c in cols[3:]:
+        assert ((dfr[c]-dfe[c]).abs() <= 4*dfr[c+' stderr']+1).all()
+    sketches = d6tjoin.sketch.merge_sketches(d6tjoin.sketch.sketch_keys(df1.iloc[:50000], ['a','b']), d6tjoin.sketch.sketch_keys(df1.iloc[50000:], ['a','b']))
+    assert d6tjoin.sketch.stats_sketches(sketches, j.sketches[1], j.keys).equals(dfr)
+
+
+def test_prejoin_files(tmp_path):
+    rng = np.random.RandomState(0)
+    df1 = pd.DataFrame({'a': rng.randint(0, 500, 2000), 'b': rng.choice(['x','y',None], 2000), 'v': rng.randn(2000)})
+    df2 = pd.DataFrame({'a': rng.randint(250, 750, 2000).astype(float), 'b': rng.choice(['x','z',None], 2000), 'w': rng.randn(2000)})
+    df1.to_csv(tmp_path/'df1.csv', index=False)
+    df2.to_csv(tmp_path/'df2.csv', index=False)
+    df1, df2 = pd.read_csv(tmp_path/'df1.csv'), pd.read_csv(tmp_path/'df2.csv')
+
+    # files read in chunks and iterators give same stats as dataframes
+    j = PreJoin([df1,df2],['a','b'])
+    jf = PreJoin([str(tmp_path/'df1.csv'),tmp_path/'df2.csv'],['a','b'],chunksize=300)
+    ji = PreJoin([pd.read_csv(tmp_path/'df1.csv',chunksize=300),df2],['a','b'])
+    dfr = j.stats_prejoin(print_only=False)
+    assert dfr.equals(jf.stats_prejoin(print_only=False))
+    assert dfr.equals(ji.stats_prejoin(print_only=False))
+    assert j.stats_prejoin_approx(print_only=False).equals(jf.stats_prejoin_approx(print_only=False))
+    assert ji.dfs[0].shape[0] == df1[['a','b']].drop_duplicates().shape[0]
+
+    # rows get read from files
+    assert jf.show_input(3,keys_only=False)[0].equals(df1.head(3))
+    dfs = j.show_unmatched('__all__',nrecords=-1,nrows=-1,keys_only=False)
+    dfsf = jf.show_unmatched('__all__',nrecords=-1,nrows=-1,keys_only=False)
+    for side in ['left','right']:
+        assert dfsf[side].reset_index(drop=True).equals(dfs[side].reset_index(drop=True))
+    assert jf.show_matched('a',nrecords=-1,nrows=5)['right'].equals(j.show_matched('a',nrecords=-1,nrows=5)['right'])
+
+    with pytest.raises(KeyError):
+        PreJoin([str(tmp_path/'df1.csv'),df2],['v'])
+
+
 # ******************************************
 # fuzzy join
 # ******************************************
@@ -251,6 +375,15 @@ def test_fakedata_singlekey_string():
     assert not sj._gen_match_top1(0)['has duplicates']
 
 
+    # candidate index gives same matches as scoring all pairs
+    dfr1 = d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],fuzzy_keys=['key'],fuzzy_how={0:{'index':None,'top_limit':10}})._gen_match_top1(0)['table']
+    dfr2 = d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],fuzzy_keys=['key'],fuzzy_how={0:{'index':'qgram','top_limit':10}})._gen_match_top1(0)['table']
+    dfr3 = d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],fuzzy_keys=['key'],fuzzy_how={0:{'index':'length','top_limit':10}})._gen_match_top1(0)['table']
+    assert dfr1.reset_index(drop=True).equals(dfr2.reset_index(drop=True))
+    assert dfr1.reset_index(drop=True).equals(dfr3.reset_index(drop=True))
+    with pytest.raises(ValueError) as e_info:
+        d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],fuzzy_keys=['key'],fuzzy_how={0:{'index':'qgram'}})
+
     sj = d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],fuzzy_keys=['key'])
     dfr1 = sj._gen_match_top1(0)['table']
     # assert df1.shape[0] == dfr1.shape[0] # todo: deal with duplicates
@@ -312,13 +445,8 @@ def fakedata_multikey():
     keyright=keyleft
 
     '''
-    from d6tjoin.smart_join import apply_gen_candidates_group
-    df_keys_left = pd.DataFrame(df1.groupby(cfg_group_left)[keyleft].unique())
-    df_keys_right = pd.DataFrame(df2.groupby(cfg_group_right)[keyright].unique())
-    df_keysets_groups = df_keys_left.merge(df_keys_right, left_index=True, right_index=True)
-    df_keysets_groups.columns = ['__top1left__', '__top1right__']
-    dfg = df_keysets_groups.reset_index().groupby(cfg_group_left).apply(apply_gen_candidates_group)
-    dfg = dfg.reset_index(-1, drop=True).reset_index()
+    from d6tjoin.utils import gen_candidates_blocks
+    dfg = gen_candidates_blocks(df1, df2, cfg_group_left, cfg_group_right, keyleft, keyright)
     '''
     with pytest.raises(NotImplementedError) as e_info:
             d6tjoin.smart_join.FuzzyJoinTop1([df1,df2], fuzzy_keys=['key','date'])
@@ -386,6 +514,37 @@ def test_fakedata_multikey_iddate():
     print('a')
 
 
+def test_fakedata_multikey_blocks():
+    import jellyfish
+    from d6tjoin.utils import gen_candidates_blocks
+    fake = Faker()
+    fake.seed(0)
+    names = [fake.name() for _ in range(60)]
+    df1 = pd.DataFrame({'key':[n[1:] for n in names],'grp':[0]*40+[1]*15+[2]*4+[3]})
+    df2 = pd.DataFrame({'key':names[::-1],'grp':[0]*20+[1]*30+[2]*5+[4]*5})
+    df1.loc[[0,1,45],'key'] = names[-1] # exact match in one block
+
+    for fuzzy_how in [{}, {'top_limit':3}, {'index':None}]:
+        top_limit = fuzzy_how.get('top_limit')
+        sj = d6tjoin.smart_join.FuzzyJoinTop1([df1,df2],exact_keys=['grp'],fuzzy_keys=['key'],fuzzy_how={0:fuzzy_how})
+        dfr = sj._gen_match_top1(0)['table']
+
+        # score all candidates
+        dfc = gen_candidates_blocks(df1, df2, ['grp'], ['grp'], 'key', 'key')
+        dfc_exact = dfc[dfc['__top1left__']==dfc['__top1right__']].copy()
+        dfc_exact['__top1diff__'] = 0
+        dfc_exact['__match type__'] = 'exact'
+        dfc = dfc[~dfc['__top1left__'].isin(dfc_exact['__top1left__'])]
+        dfc['__top1diff__'] = dfc.apply(lambda x: jellyfish.levenshtein_distance(x['__top1left__'], x['__top1right__']), axis=1)
+        if top_limit is not None:
+            dfc = dfc[dfc['__top1diff__'] <= top_limit]
+        dfc = dfc.groupby('__top1left__',group_keys=False).apply(lambda x: x[x['__top1diff__']==x['__top1diff__'].min()])
+        dfc['__match type__'] = 'top1 left'
+        dfc = pd.concat([dfc,dfc_exact])
+
+        pd.testing.assert_frame_equal(dfr.reset_index(drop=True), dfc.reset_index(drop=True), check_dtype=False)
+
+
 def fiddle():
     cfg_path_folder_base = '/mnt/data/data.raw/travelclick/'
     from d6tstack.read_excel_adv import read_excel_advanced
@@ -1,8 +1,10 @@
+import pytest
 import numpy as np
 import pandas as pd
 pd.set_option('display.expand_frame_repr', False)
 import importlib
 import d6tjoin.top1
+import d6tjoin.distance
 import jellyfish
 from faker import Faker
 
@@ -24,6 +26,22 @@ def gen_df2_num():
     df2 = pd.DataFrame({'id': l2 * 4})
     return df1, df2
 
+def filter_group_min(dfg, col, topn=1):
+    # reference for the topn reductions, all rows with one of the topn smallest values in col
+    if topn==1:
+        return dfg[dfg[col] == dfg[col].min()]
+    else:
+        return dfg[dfg[col].isin(np.sort(dfg[col].unique())[:topn])]
+
+
+def assert_top1_equal(r1, r2, cfg_cols=None, check_dtype=False):
+    # same matches regardless of row order
+    if cfg_cols is None:
+        cfg_cols = ['__top1left__','__top1right__','__matchtype__','__top1diff__']
+    r1 = r1[cfg_cols].sort_values(cfg_cols).reset_index(drop=True)
+    r2 = r2[cfg_cols].sort_values(cfg_cols).reset_index(drop=True)
+    pd.testing.assert_frame_equal(r1, r2, check_dtype=check_dtype)
+
 
 def test_top1_gen_candidates():
 
@@ -46,6 +64,30 @@ def test_top1_gen_candidates():
     helper(df1, df2)
 
 
+def test_top1_codes():
+    df1, df2 = gen_df2_str()
+    dfc, vocab = d6tjoin.top1.MergeTop1Diff(df1, df2,'id','id',jellyfish.levenshtein_distance)._allpairs_candidates_codes()
+    assert dfc['__top1left__'].dtype == np.int32 and dfc['__top1right__'].dtype == np.int32
+    assert dfc['__matchtype__'].dtype == 'category'
+    assert list(vocab) == sorted(set(df1['id']) | set(df2['id']))
+
+    df1, df2 = gen_df2_num()
+    r = d6tjoin.top1.MergeTop1Number(df1.astype(float), df2,'id','id').top1_diff()
+    assert r['__matchtype__'].dtype == 'category'
+
+
+@pytest.mark.parametrize('exact', [[], ['block']])
+@pytest.mark.parametrize('mode', [{}, {'use_batch':False}, {'cache':':memory:'}])
+def test_top1_codes_values(exact, mode):
+    # codes path matches values path
+    df1, df2 = gen_df2_str()
+    df1['block'], df2['block'] = 0, 0
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'id','id',jellyfish.levenshtein_distance,exact,exact,use_multicore=False,index=None,stream=False,**mode).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'id','id',jellyfish.levenshtein_distance,exact,exact,use_multicore=True).top1_diff()[0]
+    assert r1['__matchtype__'].dtype == 'category' and r1['__top1left__'].dtype == object
+    assert_top1_equal(r1, r2, exact+['__top1left__','__top1right__','__matchtype__','__top1diff__'])
+
+
 def test_top1_str():
 
     df1, df2 = gen_df2_str()
@@ -69,6 +111,456 @@ def test_top1_str():
     df1.merge(df2, on=['date','key']).head()
     dfr.head()
 
+def test_levenshtein_batch():
+    import d6tjoin.smart_join
+    f1 = Faker()
+    f1.seed(0)
+    values = [f1.name() for _ in range(20)]+['', 'a', 'x'*70, 'a\x00', '\x00\x00'] # numpy strips trailing '\x00'
+
+    for a in values:
+        r = d6tjoin.distance.levenshtein_batch(a, values)
+        assert r.tolist()==[jellyfish.levenshtein_distance(a, v) for v in values]
+
+    values1 = np.array(values*2, dtype=object)
+    values2 = np.array(values[::-1]*2, dtype=object)
+    r = d6tjoin.distance.apply_fun_diff_batch(values1, values2, d6tjoin.distance.levenshtein_batch)
+    assert r.tolist()==[jellyfish.levenshtein_distance(a, b) for a, b in zip(values1, values2)]
+
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=False)
+    df2['key'] = df2['key'].str[1:]
+    for exact_on in [None, ['date']]:
+        r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,exact_on,exact_on,use_multicore=False).merge()
+        r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,exact_on,exact_on,use_multicore=False,use_batch=False).merge()
+        assert r1['top1'].equals(r2['top1'])
+        assert r1['merged'].equals(r2['merged'])
+
+    # keys with '\x00' through the joins, pandas hashes strings only up to '\x00'
+    values1 = np.array(['ab','ab','cd'], dtype=object)
+    values2 = np.array(['ab\x00','ab','cd\x00\x00'], dtype=object)
+    r = d6tjoin.distance.apply_fun_diff_batch(values1, values2, d6tjoin.distance.levenshtein_batch)
+    assert r.tolist()==[jellyfish.levenshtein_distance(a, b) for a, b in zip(values1, values2)]
+    df1 = pd.DataFrame({'key':['ab','cd']})
+    df2 = pd.DataFrame({'key':['ab\x00\x00','abx','cd\x00']})
+    j = d6tjoin.smart_join.FuzzyJoinTop1([df1, df2], fuzzy_keys=['key'])
+    j.join()
+    assert j.table_fuzzy[0]['table'][['__top1left__','__top1right__','__top1diff__']].values.tolist() == [['ab','abx',1],['cd','cd\x00',1]]
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance).merge()
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,use_batch=False).merge()
+    assert r1['merged']['key__right__'].tolist() == r2['merged']['key__right__'].tolist() == ['abx','cd\x00']
+
+
+def test_levenshtein_bounded():
+    f1 = Faker()
+    f1.seed(0)
+    values = [f1.name() for _ in range(30)]+['', 'a', 'x'*70]
+    values += [v[1:] for v in values[:10]]+[v[:4]+'x'+v[4:] for v in values[:10]]
+
+    for max_diff in [0, 1, 2.5, 3, 10]:
+        for a in values:
+            r = d6tjoin.distance.levenshtein_batch(a, values, max_diff)
+            assert r.tolist()==[min(jellyfish.levenshtein_distance(a, v), int(max_diff)+1) for v in values]
+    assert d6tjoin.distance.levenshtein_bounded('abc', 'abd', 2)==1
+    assert d6tjoin.distance.levenshtein_bounded('abc', 'xyz', 1)==2
+
+
+@pytest.mark.parametrize('mode', [{'index':None}, {'index':'length'}, {'index':None,'stream':False}, {'index':'length','use_batch':False}, {'index':None,'cache':':memory:'}, {'index':None,'stream':False,'cache':':memory:'}, {'index':None,'stream':False,'memory_budget':0.001}])
+@pytest.mark.parametrize('kwargs', [{}, {'top_limit':1}, {'topn':2}, {'topn':2, 'top_limit':2}])
+def test_levenshtein_bounded_modes(monkeypatch, mode, kwargs):
+    # bounded by top_limit and best so far, same matches as scoring all pairs
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=False)
+    df2['key'] = df2['key'].str[1:]
+    monkeypatch.setattr(d6tjoin.top1, '_STREAM_PROBESIZE', 2)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,use_multicore=False,**mode,**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,use_multicore=False,index=None,stream=False,use_batch=False,**kwargs).top1_diff()[0]
+    assert_top1_equal(r1, r2)
+
+
+@pytest.mark.parametrize('min_pairs', [None, 0])
+@pytest.mark.parametrize('fun_diff, kwargs', [(jellyfish.levenshtein_distance, {}), (jellyfish.levenshtein_distance, {'topn':2}), (jellyfish.levenshtein_distance, {'top_limit':2}), ('weighted', {}), (lambda a, b: jellyfish.hamming_distance(a, b), {'topn':2}), (jellyfish.damerau_levenshtein_distance, {'topn':2})])
+def test_top1_chunked(monkeypatch, min_pairs, fun_diff, kwargs):
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=False)
+    df2['key'] = df2['key'].str[1:]
+
+    if fun_diff == 'weighted':
+        # closure gets shipped to workers
+        cfg_weight = 2
+        def fun_diff(a, b):
+            return cfg_weight*jellyfish.levenshtein_distance(a, b)
+
+    if min_pairs is not None:
+        monkeypatch.setattr(d6tjoin.top1, '_MULTICORE_MIN_PAIRS', min_pairs)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',fun_diff,use_multicore=True,**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',fun_diff,use_multicore=False,index=None,stream=False,**kwargs).top1_diff()[0]
+    assert_top1_equal(r1, r2, check_dtype=True)
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'index':None}, {'stream':False}, {'use_batch':False}, {'index':'bktree'}, {'index':'length'}, {'index':'qgram','top_limit':2}, {'use_multicore':False,'index':None,'stream':False}, {'use_multicore':False,'index':None,'stream':False,'use_batch':False}])
+def test_top1_nul(kwargs):
+    # fixed width numpy strings drop trailing '\x00'
+    df1 = pd.DataFrame({'key':['ab'],'block':0})
+    df2 = pd.DataFrame({'key':['ab\x00\x00','abx'],'block':0})
+    for exact in [[], ['block']]:
+        r = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,exact,exact,**kwargs).top1_diff()[0]
+        assert r[['__top1right__','__top1diff__']].values.tolist() == [['abx', 1]]
+
+
+@pytest.mark.parametrize('min_pairs', [None, 0])
+@pytest.mark.parametrize('kwargs', [{}, {'top_limit':3}, {'index':None}, {'stream':False}, {'use_batch':False}, {'cache':':memory:'}, {'use_multicore':False}])
+def test_top1_blocks(monkeypatch, min_pairs, kwargs):
+    f1 = Faker()
+    f1.seed(0)
+    names = [f1.name() for _ in range(60)]
+    # blocks of very different sizes
+    df1 = pd.DataFrame({'key':[n[1:] for n in names],'block':[0]*40+[1]*15+[2]*4+[3]})
+    df2 = pd.DataFrame({'key':names[::-1],'block':[0]*20+[1]*30+[2]*5+[4]*5})
+    df1.loc[0,'key'] = names[-1] # exact match
+
+    if min_pairs is not None:
+        monkeypatch.setattr(d6tjoin.top1, '_MULTICORE_MIN_PAIRS', min_pairs)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,['block'],['block'],**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,['block'],['block'],use_multicore=False,index=None,stream=False,top_limit=kwargs.get('top_limit')).top1_diff()[0]
+    assert_top1_equal(r1, r2, ['block','__top1left__','__top1right__','__matchtype__','__top1diff__'])
+
+    # several exact keys with different names, datetime index levels
+    df1['date'] = pd.to_datetime('2020-01-01') + pd.to_timedelta(df1['block'] % 2, unit='D')
+    df2 = df2.rename(columns={'block':'block_right'})
+    df2['date_right'] = pd.to_datetime('2020-01-01') + pd.to_timedelta(df2['block_right'] % 2, unit='D')
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,['block','date'],['block_right','date_right'],**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,['block','date'],['block_right','date_right'],use_multicore=False,index=None,stream=False,top_limit=kwargs.get('top_limit')).top1_diff()[0]
+    assert_top1_equal(r1, r2, ['block','date','__top1left__','__top1right__','__matchtype__','__top1diff__'])
+
+
+def test_top1_blocks_tasks():
+    # largest tasks first, big blocks split
+    blocks = [(['a']*2, ['b']), (['a']*50, ['b']*50), (['c'], [])]
+    df_diff = d6tjoin.top1._applyFunTop1Blocks(blocks, jellyfish.levenshtein_distance)
+    assert df_diff['__block__'].tolist() == [0]*2+[1]*2500
+
+
+@pytest.mark.parametrize('fun_diff', [jellyfish.levenshtein_distance, jellyfish.hamming_distance])
+@pytest.mark.parametrize('kwargs', [{}, {'topn':2}, {'top_limit':5}, {'topn':3, 'top_limit':6}, {'use_batch':False}, {'cache':':memory:'}])
+def test_top1_stream(monkeypatch, fun_diff, kwargs):
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=False)
+    df2['key'] = df2['key'].str[1:]
+
+    monkeypatch.setattr(d6tjoin.top1, '_STREAM_CHUNKSIZE', 3)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',fun_diff,use_multicore=False,index=None,stream=True,**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',fun_diff,use_multicore=False,index=None,stream=False,**kwargs).top1_diff()[0]
+    assert_top1_equal(r1, r2, check_dtype=True)
+
+
+def test_top1_index_length():
+    import d6tjoin.index
+    f1 = Faker()
+    f1.seed(0)
+    values_right = np.array([f1.name() for _ in range(200)]+['a','ab','xyz'], dtype=object)
+    values_left = [f1.name() for _ in range(20)]+['', 'ab']
+
+    index = d6tjoin.index.LengthIndex(values_right)
+    for topn in [1, 3]:
+        for top_limit in [None, 2, 5]:
+            for v in values_left:
+                positions, diffs = index.query(v, d6tjoin.distance.levenshtein_batch, topn, top_limit)
+                assert len(positions) <= len(values_right)
+                diffs_exact = np.array([jellyfish.levenshtein_distance(v, values_right[i]) for i in positions])
+                assert np.all(diffs <= diffs_exact) # bounded differences
+                idx, d = d6tjoin.top1._select_topn(diffs, topn, top_limit)
+                assert d.tolist() == diffs_exact[idx].tolist()
+                idx_all, d_all = d6tjoin.top1._select_topn(d6tjoin.distance.levenshtein_batch(v, values_right), topn, top_limit)
+                assert sorted(positions[idx].tolist()) == sorted(idx_all.tolist())
+
+    # skips most pairs for identifiers of different lengths
+    index = d6tjoin.index.LengthIndex(['a'*i for i in range(1, 50)])
+    positions, diffs = index.query('a'*10, d6tjoin.distance.levenshtein_batch)
+    assert len(positions) == 1
+
+
+def test_top1_index_qgram():
+    import d6tjoin.index
+    f1 = Faker()
+    f1.seed(0)
+    values_right = np.array([f1.name() for _ in range(200)]+['', 'a'], dtype=object)
+    values_left = [f1.name() for _ in range(20)]+['', 'ab']+values_right[:5].tolist()
+
+    for q in [1, 2, 3]:
+        index = d6tjoin.index.QGramIndex(values_right, q)
+        for top_limit in [0, 1, 3, 5.5]:
+            for v in values_left:
+                positions, diffs = index.query(v, d6tjoin.distance.levenshtein_batch, top_limit=top_limit)
+                diffs_all = d6tjoin.distance.levenshtein_batch(v, values_right)
+                assert set(positions[diffs<=top_limit]) == set(np.flatnonzero(diffs_all<=top_limit))
+                if q > 1 and top_limit <= 3:
+                    assert len(positions) < len(values_right)/2
+
+    with pytest.raises(ValueError):
+        index.query('a', d6tjoin.distance.levenshtein_batch)
+
+    df1 = pd.DataFrame({'key':values_left})
+    df2 = pd.DataFrame({'key':values_right})
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,index='qgram')
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.hamming_distance,top_limit=1,index='qgram')
+
+
+@pytest.mark.parametrize('topn', [1, 2])
+@pytest.mark.parametrize('mode', [{}, {'stream':False}, {'use_batch':False}, {'cache':':memory:'}, {'use_multicore':True}])
+def test_top1_index_qgram_join(topn, mode):
+    f1 = Faker()
+    f1.seed(0)
+    values_right = [f1.name() for _ in range(200)]+['', 'a']
+    df1 = pd.DataFrame({'key':[f1.name() for _ in range(20)]+['', 'ab']+values_right[:5]})
+    df2 = pd.DataFrame({'key':[v[1:] for v in values_right]})
+    kwargs = dict({'use_multicore':False}, **mode)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,top_limit=3,topn=topn,index='qgram',**kwargs).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,top_limit=3,topn=topn,index=None,use_multicore=False,stream=False).top1_diff()[0]
+    assert_top1_equal(r1, r2, check_dtype=True)
+
+
+def test_top1_index_bktree():
+    import d6tjoin.index
+    f1 = Faker()
+    f1.seed(0)
+    values_right = np.array([f1.name() for _ in range(200)], dtype=object)
+    values_left = [f1.name() for _ in range(20)]+['']+values_right[:5].tolist()
+
+    index = d6tjoin.index.BKTree(values_right, jellyfish.levenshtein_distance)
+    for topn in [1, 3]:
+        for top_limit in [None, 2, 5]:
+            for v in values_left:
+                positions, diffs = index.query(v, topn=topn, top_limit=top_limit)
+                idx, d = d6tjoin.top1._select_topn(diffs, topn, top_limit)
+                idx_all, d_all = d6tjoin.top1._select_topn(d6tjoin.distance.levenshtein_batch(v, values_right), topn, top_limit)
+                assert sorted(positions[idx].tolist()) == sorted(idx_all.tolist())
+
+
+def diff_abs(a, b):
+    return abs(a-b)
+
+
+@pytest.mark.parametrize('min_pairs', [None, 0])
+@pytest.mark.parametrize('topn', [1, 2])
+@pytest.mark.parametrize('mode', [{}, {'stream':False}, {'cache':':memory:'}])
+def test_top1_index_bktree_join(monkeypatch, min_pairs, topn, mode):
+    # any integer metric
+    df1 = pd.DataFrame({'key':range(0, 1000, 7)})
+    df2 = pd.DataFrame({'key':range(0, 1000, 5)})
+
+    if min_pairs is not None:
+        monkeypatch.setattr(d6tjoin.top1, '_MULTICORE_MIN_PAIRS', min_pairs)
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_abs,topn=topn,index='bktree',**mode).top1_diff()[0]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_abs,topn=topn,index=None,use_multicore=False,stream=False).top1_diff()[0]
+    assert_top1_equal(r1, r2)
+
+
+def test_filter_group_topn():
+    import d6tjoin.utils
+    np.random.seed(0)
+    for i in range(20):
+        n = 50
+        df = pd.DataFrame({'block':np.random.choice(['x','y'],n),'__top1left__':np.random.choice(list('abcde'),n),'__top1diff__':np.random.randint(0,4,n).astype(float)})
+        df.index = np.random.permutation(n)
+        if i % 2:
+            df.loc[df.index[:5],'__top1diff__'] = np.nan
+        for by in ['__top1left__', ['block','__top1left__']]:
+            for topn in [1, 2, 3]:
+                r1 = d6tjoin.utils.filter_group_topn(df, by, '__top1diff__', topn)
+                r2 = df.groupby(by,group_keys=False).apply(lambda x: filter_group_min(x,'__top1diff__',topn))
+                pd.testing.assert_frame_equal(r1, r2)
+
+    # nothing filtered keeps original order
+    df = pd.DataFrame({'__top1left__':['b','a','b'],'__top1diff__':[1,2,1]})
+    assert d6tjoin.utils.filter_group_topn(df, '__top1left__', '__top1diff__').index.tolist() == [0,1,2]
+
+
+def test_top1_cache(tmp_path, monkeypatch):
+    import threading
+    import d6tjoin.cache
+    calls = []
+    def diff_count(a, b):
+        calls.append((a, b))
+        return jellyfish.levenshtein_distance(a, b)
+    diff_count.cache_key = 'diff_count' # calls in closure change its fingerprint
+
+    f1 = Faker()
+    f1.seed(0)
+    df1 = pd.DataFrame({'key':[f1.name() for _ in range(30)]})
+    df2 = pd.DataFrame({'key':[f1.name() for _ in range(30)]+df1['key'].values[:5].tolist()})
+    cfg_cols = ['__top1left__','__top1right__','__matchtype__','__top1diff__']
+    path = str(tmp_path / 'cache.db')
+
+    r0 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,use_multicore=False).top1_diff()[0]
+    assert len(calls) == 25*35
+    del calls[:]
+    r1 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,use_multicore=False,cache=path).top1_diff()[0]
+    assert len(calls) == 25*35
+    del calls[:]
+    r2 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,use_multicore=False,cache=d6tjoin.cache.DiffCache(path)).top1_diff()[0]
+    assert len(calls) == 0
+    pd.testing.assert_frame_equal(r0[cfg_cols], r1[cfg_cols])
+    pd.testing.assert_frame_equal(r0[cfg_cols], r2[cfg_cols], check_dtype=False)
+
+    # new left values only
+    df1_new = df1.append(pd.DataFrame({'key':['John Doe']}), ignore_index=True)
+    r3 = d6tjoin.top1.MergeTop1Diff(df1_new, df2,'key','key',diff_count,use_multicore=False,cache=path).top1_diff()[0]
+    assert len(calls) == 35
+    assert r3['__top1left__'].isin(['John Doe']).any()
+    del calls[:]
+
+    # removed right values don't reuse matches
+    d6tjoin.top1.MergeTop1Diff(df1, df2.iloc[1:],'key','key',diff_count,use_multicore=False,cache=path).top1_diff()
+    assert len(calls) == 25*34
+    del calls[:]
+
+    # added right values only get scored against cached left values
+    df2_new = df2.append(pd.DataFrame({'key':['John Doe','Jane Roe']}), ignore_index=True)
+    r6 = d6tjoin.top1.MergeTop1Diff(df1, df2_new,'key','key',diff_count,use_multicore=False,cache=path).top1_diff()[0]
+    assert len(calls) == 25*2
+    del calls[:]
+    r7 = d6tjoin.top1.MergeTop1Diff(df1, df2_new,'key','key',diff_count,use_multicore=False).top1_diff()[0]
+    assert_top1_equal(r6, r7)
+    del calls[:]
+    d6tjoin.top1.MergeTop1Diff(df1, df2_new,'key','key',diff_count,use_multicore=False,cache=path).top1_diff()
+    assert len(calls) == 0
+    for topn in [2, 3]:
+        d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,use_multicore=False,topn=topn,cache=path).top1_diff()
+        r8 = d6tjoin.top1.MergeTop1Diff(df1, df2_new,'key','key',diff_count,use_multicore=False,topn=topn,cache=path).top1_diff()[0]
+        r9 = d6tjoin.top1.MergeTop1Diff(df1, df2_new,'key','key',diff_count,use_multicore=False,topn=topn).top1_diff()[0]
+        assert_top1_equal(r8, r9)
+    del calls[:]
+
+    # blocks, top1 by block and key pairs
+    df1['block'], df2['block'] = np.arange(len(df1)) % 2, np.arange(len(df2)) % 2
+    for stream in [True, False]:
+        del calls[:]
+        r4 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,['block'],['block'],use_multicore=False,stream=stream,cache=path).top1_diff()[0]
+        n_calls = len(calls)
+        assert n_calls > 0
+        r5 = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,['block'],['block'],use_multicore=False,stream=stream,cache=path).top1_diff()[0]
+        assert len(calls) == n_calls
+        pd.testing.assert_frame_equal(r4, r5, check_dtype=False)
+
+    # key pairs not in cache get scored with the batched difference function
+    batch_calls = []
+    apply_fun_diff_batch_codes = d6tjoin.top1.apply_fun_diff_batch_codes
+    def apply_count(codes1, *args, **kwargs):
+        batch_calls.append(len(codes1))
+        return apply_fun_diff_batch_codes(codes1, *args, **kwargs)
+    monkeypatch.setattr(d6tjoin.top1, 'apply_fun_diff_batch_codes', apply_count)
+    args = (df1, df2,'key','key',jellyfish.levenshtein_distance,['block'],['block'])
+    kwargs = dict(use_multicore=False, index=None, stream=False)
+    r10 = d6tjoin.top1.MergeTop1Diff(*args,**kwargs,top_limit=3).top1_diff()[0]
+    n_pairs = sum(batch_calls)
+    assert n_pairs > 0
+    del batch_calls[:]
+    r11 = d6tjoin.top1.MergeTop1Diff(*args,**kwargs,top_limit=3,cache=path).top1_diff()[0]
+    assert sum(batch_calls) == n_pairs
+    del batch_calls[:]
+    r12 = d6tjoin.top1.MergeTop1Diff(*args,**kwargs,cache=path).top1_diff()[0]
+    assert sum(batch_calls) == 0
+    r13 = d6tjoin.top1.MergeTop1Diff(*args,use_multicore=False).top1_diff()[0]
+    assert_top1_equal(r10, r11)
+    assert_top1_equal(r12, r13)
+
+    # size bound
+    cache = d6tjoin.cache.DiffCache(':memory:', maxsize=10)
+    d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_count,use_multicore=False,cache=cache).top1_diff()
+    assert cache.conn.execute('SELECT COUNT(*) FROM top1').fetchone()[0] == 10
+
+    # fingerprints change with defaults, closure values and globals
+    def make_diff(offset):
+        def diff_offset(a, b, scale=1):
+            return jellyfish.levenshtein_distance(a, b)*scale+offset
+        return diff_offset
+    fp = d6tjoin.cache.fun_fingerprint
+    assert fp(make_diff(0)) == fp(make_diff(0))
+    assert fp(make_diff(0)) != fp(make_diff(1))
+    diff_scaled = make_diff(0)
+    diff_scaled.__defaults__ = (2,)
+    assert fp(make_diff(0)) != fp(diff_scaled)
+    code = 'def diff_global(a, b):\n    return jellyfish.levenshtein_distance(a, b)*scale'
+    globals1, globals2 = {'jellyfish':jellyfish, 'scale':1}, {'jellyfish':jellyfish, 'scale':2}
+    exec(code, globals1)
+    exec(code, globals2)
+    assert fp(globals1['diff_global']) != fp(globals2['diff_global'])
+
+    # values which can't be pickled need an explicit key
+    lock = threading.Lock()
+    def diff_lock(a, b):
+        with lock:
+            return jellyfish.levenshtein_distance(a, b)
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_lock,use_multicore=False,cache=':memory:')
+    diff_lock.cache_key = 'diff_lock'
+    d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',diff_lock,use_multicore=False,cache=':memory:').top1_diff()
+
+
+def test_top1_incremental():
+    calls = []
+    def diff_count(a, b):
+        calls.append((a, b))
+        return jellyfish.levenshtein_distance(a, b)
+
+    f1 = Faker()
+    f1.seed(0)
+    names = [f1.name() for _ in range(50)]
+    df1 = pd.DataFrame({'key':[n[1:] for n in names[:40]],'v1':range(40)})
+    df2 = pd.DataFrame({'key':names,'v2':range(50)})
+
+    m = d6tjoin.top1.MergeTop1Incremental(df1.iloc[:30], df2.iloc[:35], ['key'], ['key'], fun_diff=[diff_count], use_multicore=False)
+    with pytest.raises(ValueError):
+        m.update(df1.iloc[30:])
+    m.merge()
+    del calls[:]
+    r1 = m.update(df1.iloc[30:], df2.iloc[35:])
+    assert len(calls) == 10*50 + 30*15
+    r2 = d6tjoin.top1.MergeTop1(df1, df2, ['key'], ['key'], use_multicore=False).merge()
+    assert_top1_equal(r1['merged'], r2['merged'], ['key','v1','v2'])
+
+    # match of first key is exact key for second key
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
+    df1, df2 = df1.reset_index(drop=True), df2.reset_index(drop=True)
+    df1['key'] = df1['key'].str[1:]
+    m = d6tjoin.top1.MergeTop1Incremental(df1.iloc[:10], df2.iloc[:8], ['key','date'], ['key','date'], use_multicore=False)
+    m.merge()
+    m.update(df1.iloc[10:12])
+    r1 = m.update(df1.iloc[12:], df2.iloc[8:])
+    r2 = d6tjoin.top1.MergeTop1(df1, df2, ['key','date'], ['key','date'], use_multicore=False).merge()
+    assert_top1_equal(r1['merged'], r2['merged'], ['key','date','value','value_right'])
+
+
+def test_top1_normalize():
+    import d6tjoin.normalize
+    calls = []
+    def fun_count(v):
+        calls.append(v)
+        return v
+
+    normalize = d6tjoin.normalize.Normalizer(['unicode_fold', 'strip_punctuation', 'collapse_whitespace', fun_count])
+    r = normalize(['Café  Müller, Inc.', 'ÅNGSTRÖM', 1, 'Café  Müller, Inc.'])
+    assert r.tolist() == ['cafe muller inc', 'angstrom', 1, 'cafe muller inc']
+    r = normalize(['ÅNGSTRÖM', 'abc'])
+    assert r.tolist() == ['angstrom', 'abc']
+    assert len(calls) == 4 # once for each unique value
+    assert d6tjoin.normalize.Normalizer([len])(['ab', 'ab\x00']).tolist() == [2, 3]
+    assert d6tjoin.top1._apply_unique(['ab', 'ab\x00'], len).tolist() == [2, 3]
+    with pytest.raises(ValueError):
+        d6tjoin.normalize.Normalizer(['upper'])
+
+    df1 = pd.DataFrame({'key':['Mueller, Inc.', 'ACME corp', 'Beta  Ltd', 'beta ltd'], 'block':0})
+    df2 = pd.DataFrame({'key':['mueller inc', 'Acme Corp.', 'Beta Ltd.', 'Gamma'], 'block':0})
+    for exact_on in [None, ['block']]:
+        for kwargs in [{}, {'use_multicore':False, 'index':None, 'stream':False}]:
+            r = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,exact_on,exact_on,normalize=['lower','strip_punctuation','collapse_whitespace'],**kwargs).top1_diff()[0]
+            r = r.sort_values('__top1left__')
+            assert r['__top1left__'].tolist() == ['ACME corp', 'Beta  Ltd', 'Mueller, Inc.', 'beta ltd']
+            assert r['__top1right__'].tolist() == ['Acme Corp.', 'Beta Ltd.', 'mueller inc', 'Beta Ltd.']
+            assert (r['__top1diff__']==0).all()
+
+    r = d6tjoin.top1.MergeTop1(df1, df2, ['key'], ['key'], normalize=['lower','strip_punctuation'], use_multicore=False).merge()
+    assert r['merged'].shape[0] == 4
+
+
 def test_top1_num():
 
     df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
@@ -88,6 +580,182 @@ def test_top1_num():
     df2.sort_values(['key','date'])
     r['top1']
 
+def test_top1_num_topn():
+    df1 = pd.DataFrame({'v':[1.,5.,10.,20.,np.nan],'g':[0,0,0,1,1]})
+    df2 = pd.DataFrame({'v':[0.,2.,4.,5.,6.,9.,30.],'g':[0,0,0,0,0,1,1]})
+
+    dfr = d6tjoin.top1.MergeTop1Number(df1, df2,'v','v',topn=2).top1_diff()
+    assert dfr[['__top1left__','__top1right__']].values.tolist() == [[1,0],[1,2],[1,4],[5,4],[5,5],[5,6],[10,6],[10,9],[20,9],[20,30]] # ties kept
+    assert dfr.loc[dfr['__matchtype__']=='exact','__top1left__'].tolist() == [5]
+
+    dfr = d6tjoin.top1.MergeTop1Number(df1, df2,'v','v',['g'],['g'],topn=2,direction='backward').top1_diff()
+    assert dfr[['g','__top1left__','__top1right__']].values.tolist() == [[0,1,0],[0,5,4],[0,5,5],[0,10,5],[0,10,6],[1,20,9]]
+
+    dfr = d6tjoin.top1.MergeTop1Number(df1, df2,'v','v',['g'],['g'],topn=3,top_limit=3).top1_diff()
+    assert dfr['__top1diff__'].max() <= 3
+
+    # includes top1 matches
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
+    r1 = d6tjoin.top1.MergeTop1Number(df1, df2,'date','date').top1_diff()
+    r2 = d6tjoin.top1.MergeTop1Number(df1, df2,'date','date',topn=2).top1_diff()
+    cfg_cols = ['__top1left__','__top1right__']
+    assert set(map(tuple, r1[cfg_cols].values.tolist())) <= set(map(tuple, r2[cfg_cols].values.tolist()))
+    assert r2.groupby('__top1left__')['__top1diff__'].nunique().max() == 2
+
+def test_top1_num_tolerance():
+    import d6tjoin.utils
+    df1 = pd.DataFrame({'date':pd.to_datetime(['2010-01-01','2010-01-05','2010-01-10']),'g':0})
+    df2 = pd.DataFrame({'date':pd.to_datetime(['2010-01-02','2010-01-08','2010-03-01']),'g':0})
+
+    for exact_on in [None, ['g']]:
+        r = d6tjoin.top1.MergeTop1Number(df1, df2,'date','date',exact_on,exact_on,top_limit=pd.offsets.Day(2)).top1_diff()
+        assert r['__top1left__'].tolist() == [pd.Timestamp('2010-01-01'),pd.Timestamp('2010-01-10')]
+        assert r['__top1right__'].tolist() == [pd.Timestamp('2010-01-02'),pd.Timestamp('2010-01-08')]
+        r = d6tjoin.top1.MergeTop1Number(df1, df2,'date','date',exact_on,exact_on,direction='forward',top_limit=pd.Timedelta(days=3)).top1_diff()
+        assert r['__top1right__'].tolist() == [pd.Timestamp('2010-01-02'),pd.Timestamp('2010-01-08')]
+        with pytest.raises(ValueError):
+            d6tjoin.top1.MergeTop1Number(df1, df2,'date','date',exact_on,exact_on,top_limit=pd.offsets.MonthEnd(1)).top1_diff()
+
+    r = d6tjoin.top1.MergeTop1(df1, df2,['date'],['date'],direction='backward').merge()
+    assert r['top1']['date']['__top1right__'].dropna().tolist() == [pd.Timestamp('2010-01-02'),pd.Timestamp('2010-01-08')]
+    assert r['merged'].shape[0] == 2
+
+    df1, df2 = pd.DataFrame({'v':[1,5,9]}), pd.DataFrame({'v':[3,12]})
+    r = d6tjoin.top1.MergeTop1Number(df1, df2,'v','v',top_limit=2.5).top1_diff()
+    assert r[['__top1left__','__top1right__']].values.tolist() == [[1,3],[5,3]]
+    assert d6tjoin.utils._asof_tolerance(2.5, df1['v']) == 2
+
+
+def test_top1_points():
+    rng = np.random.RandomState(0)
+    df1 = pd.DataFrame({'g':rng.randint(0,3,50),'x':rng.rand(50),'y':rng.rand(50)*10,'v1':range(50)})
+    df2 = pd.DataFrame({'g':rng.randint(0,3,60),'x':rng.rand(60),'y':rng.rand(60)*10,'v2':range(60)})
+
+    # same distances as brute force within blocks
+    r = d6tjoin.top1.MergeTop1Points(df1, df2, ['x','y'], ['x','y'], ['g'], ['g'], weights=[1,0.1], topn=2).top1_diff()
+    for g, x, y in df1[['g','x','y']].values:
+        dfg = df2[df2['g']==g]
+        dist = np.sort(np.sqrt((dfg['x']-x)**2+((dfg['y']-y)*0.1)**2))[:2]
+        assert np.allclose(np.sort(r.loc[r['__top1left__']==(x,y),'__top1diff__']), dist)
+    assert r['__matchtype__'].dtype == d6tjoin.top1._MATCHTYPE
+
+    r = d6tjoin.top1.MergeTop1(df1, df2, ['x','y'], ['x','y'], ['g'], ['g'], metric='euclidean', weights=[1,0.1], top_limit=0.05, is_keep_debug=True).merge()
+    assert r['merged']['__top1diff__'].max() <= 0.05
+    assert list(r['top1']) == [('x','y')]
+
+    # haversine in km
+    df1 = pd.DataFrame({'lat':[40.7128,51.5074],'lon':[-74.0060,-0.1278]})
+    df2 = pd.DataFrame({'lat':[48.8566,40.7306,34.05],'lon':[2.3522,-73.9352,-118.24],'city':['paris','brooklyn','la']})
+    r = d6tjoin.top1.MergeTop1(df1, df2, ['lat','lon'], ['lat','lon'], metric='haversine').merge()
+    assert r['merged']['city'].tolist() == ['brooklyn','paris']
+    assert np.allclose(r['top1'][('lat','lon')]['__top1diff__'], [6.29, 343.56], atol=0.01)
+    r = d6tjoin.top1.MergeTop1(df1, df2, ['lat','lon'], ['lat','lon'], metric='haversine', top_limit=100).merge()
+    assert r['merged']['city'].tolist() == ['brooklyn']
+    m = d6tjoin.top1.MergeTop1Points(df1, df2, ['lat','lon'], ['lat','lon'], metric='haversine')
+    pd.testing.assert_frame_equal(m.merge()['top1'], m.top1_diff())
+
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1Points(df1, df2, ['lat'], ['lat'], metric='haversine')
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1Points(df1, df2, ['lat','lon'], ['lat','lon'], weights=[1])
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1(df1, df2, ['lat','lon'], ['lat','lon'], fun_diff=[None, None], metric='haversine')
+    with pytest.raises(ValueError):
+        d6tjoin.top1.MergeTop1(df1, df2, ['lat','lon'], ['lat','lon'], direction='backward', metric='haversine')
+
+
+def test_top1_profile():
+    import logging
+    import d6tjoin.instrument
+    import d6tjoin.smart_join
+
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
+    df2['key'] = 'Mr. '+df1['key']
+
+    # stages by fuzzy key, same merge as without profile
+    r1 = d6tjoin.top1.MergeTop1(df1, df2,['date','key'],['date','key']).merge()
+    r2 = d6tjoin.top1.MergeTop1(df1, df2,['date','key'],['date','key'],profile=d6tjoin.instrument.JoinProfile(trace_memory=True)).merge()
+    assert r1['profile'] is None
+    assert r1['merged'].equals(r2['merged'])
+    dfp = r2['profile'].to_frame()
+    assert dfp[['level','stage']].values.tolist() == [['date','scoring'],['key','candidates'],['key','scoring'],['key','reduce'],[None,'merge']]
+    assert (dfp['seconds']>=0).all() and (dfp['peak_mb']>0).all()
+    scoring = dfp[dfp['level']=='key'].iloc[1]
+    assert scoring['pairs_scored'] > 0 and scoring['pairs_generated'] == scoring['pairs_scored']+scoring['pairs_pruned']
+    assert dfp['rows'].iloc[-1] == r2['merged'].shape[0]
+    dfs = r2['profile'].slowest_frame()
+    assert dfs.shape[0] == 5 and dfs['seconds'].is_monotonic_decreasing
+
+    # all pairs are scored without index
+    r = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,use_multicore=False,index=None,stream=False,profile=True).merge()
+    dfp = r['profile'].to_frame()
+    nkeys = df1['key'].nunique()*df2['key'].nunique()
+    assert dfp.loc[dfp['stage']=='scoring', ['pairs_generated','pairs_scored','pairs_pruned']].values.tolist() == [[nkeys, nkeys, 0]]
+
+    # fuzzy join, stages also get logged
+    class Handler(logging.Handler):
+        def __init__(self):
+            super(Handler, self).__init__()
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+    handler = Handler()
+    logger = logging.getLogger('d6tjoin')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    j = d6tjoin.smart_join.FuzzyJoinTop1([df1, df2], exact_keys=['date'], fuzzy_keys=['key'], fuzzy_how={0:{}})
+    j.join(profile=True)
+    logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
+    assert j.profile.to_frame()['stage'].tolist() == ['candidates','scoring','reduce','merge']
+    assert len(handler.messages) == 4 and handler.messages[0].startswith('key candidates')
+
+    # all left keys match exactly, nothing to sample
+    df1 = pd.DataFrame({'key':['ab','cd'],'g':[0,0]})
+    df2 = pd.DataFrame({'key':['ab','cd','x'],'g':[0,0,0]})
+    for exact_keys in [[],['g']]:
+        for profile in [None, True]:
+            r = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,exact_keys,exact_keys,use_multicore=False,index=None,stream=False,profile=profile).merge()
+            assert r['merged']['key__right__'].tolist() == ['ab','cd']
+
+
+def test_top1_plan():
+    import d6tjoin.smart_join
+
+    df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
+    df2['key'] = 'Mr. '+df2['key']
+
+    # pairs from unique counts, without blocks and by date
+    plan = d6tjoin.top1.MergeTop1Diff(df1, df2,'key','key',jellyfish.levenshtein_distance,use_multicore=False,index=None,stream=False).explain()
+    assert plan['strategy'] == 'allpairs' and plan['chunks'] == 1
+    assert plan['candidate pairs'] == df1['key'].nunique()*df2['key'].nunique()
+    df1b, df2b = df1.copy(), df2.copy()
+    df2b['date'] = df1b['date'].values
+    plan = d6tjoin.top1.MergeTop1Diff(df1b, df2b,'key','key',jellyfish.levenshtein_distance,['date'],['date']).explain()
+    npairs = df1b.groupby('date')['key'].nunique().mul(df2b.groupby('date')['key'].nunique()).sum()
+    assert plan['strategy'] == 'stream' and plan['blocks'] == 4 and plan['candidate pairs'] == npairs
+    dfp = d6tjoin.top1.MergeTop1(df1, df2,['date','key'],['date','key']).explain()
+    assert dfp['strategy'].tolist() == ['merge_asof','stream'] and dfp['peak memory MB'].gt(0).all()
+
+    # chunks which fit the budget give the same matches
+    for exact_left_on in [None, ['date']]:
+        m = d6tjoin.top1.MergeTop1Diff(df1b, df2b,'key','key',jellyfish.levenshtein_distance,exact_left_on,exact_left_on,use_multicore=False,index=None,stream=False)
+        r1 = m.merge()
+        m.cfg_memory_budget = m.explain()['peak memory MB']/3
+        assert m.explain()['chunks'] >= 3
+        r2 = m.merge()
+        cols = ['__top1left__','__top1right__']
+        assert r1['top1'].sort_values(cols).reset_index(drop=True).equals(r2['top1'][r1['top1'].columns].sort_values(cols).reset_index(drop=True))
+        assert r1['merged'].shape == r2['merged'].shape
+
+    # fuzzy join scores in chunks instead of all pairs over budget
+    j = d6tjoin.smart_join.FuzzyJoinTop1([df1, df2], fuzzy_keys=['key'], fuzzy_how={0:{'index':None}})
+    assert j.explain()['strategy'].tolist() == ['allpairs objects']
+    j2 = d6tjoin.smart_join.FuzzyJoinTop1([df1, df2], fuzzy_keys=['key'], fuzzy_how={0:{'index':None, 'memory_budget':j.explain()['peak memory MB'].iloc[0]/2}})
+    assert j2.explain()['strategy'].tolist() == ['stream']
+    assert j.join().sort_values(['key','date','value']).reset_index(drop=True).equals(j2.join().sort_values(['key','date','value']).reset_index(drop=True))
+
+
 def test_top1_multi():
 
     df1, df2 = tests.test_smartjoin.gen_multikey_complex(unmatched_date=True)
@@ -95,8 +763,27 @@ def test_top1_multi():
 
     r = d6tjoin.top1.MergeTop1(df1, df2,['date','key'],['date','key']).merge()
 
-
-    assert True
+    # levels run on unique keys, left rows with the same keys all get joined
+    df1['v1'] = range(df1.shape[0])
+    df1 = pd.concat([df1, df1.iloc[:3].assign(v1=-1)], ignore_index=True)
+    r = d6tjoin.top1.MergeTop1(df1, df2,['date','key'],['date','key'],is_keep_debug=True).merge()
+    dfr = r['merged']
+    assert (dfr['v1']==-1).sum() == dfr['v1'].isin(df1['v1'].values[:3]).sum()
+    assert dfr.columns.tolist()[:df1.shape[1]] == df1.columns.tolist()
+    assert r['top1']['date'].shape[0] == df1[['date']].drop_duplicates().shape[0]
+
+    # exact key plus date then string fuzzy keys, string level blocks on exact key and matched date
+    df1 = pd.DataFrame({'g':[0,0,1,1],'d':pd.to_datetime(['2020-01-01','2020-01-05','2020-01-01','2020-01-05']),'s':['apple','banana','cherry','grape']})
+    df2 = pd.DataFrame({'g':[0,0,1,1],'d':pd.to_datetime(['2020-01-02','2020-01-06','2020-01-02','2020-01-06']),'s':['appel','bananas','chery','grap']})
+    for use_multicore in [True, False]:
+        dfr = d6tjoin.top1.MergeTop1(df1, df2,['d','s'],['d','s'],['g'],['g'],use_multicore=use_multicore).merge()['merged']
+        assert dfr['s_right'].tolist() == df2['s'].tolist()
+
+    # no exact string matches, exact keys of the number level keep their dtype
+    df1 = pd.DataFrame({'g':[0,1],'s':['aaaa','bbbb'],'d':pd.to_datetime(['2020-01-01','2020-01-02'])})
+    df2 = pd.DataFrame({'g':[0,1],'s':['cc','dd'],'d':pd.to_datetime(['2020-01-01','2020-01-03'])})
+    dfr = d6tjoin.top1.MergeTop1(df1, df2,['s','d'],['s','d'],['g'],['g'],use_multicore=False).merge()['merged']
+    assert dfr['d_right'].tolist() == df2['d'].tolist()
 
 
 def test_top1_examples():